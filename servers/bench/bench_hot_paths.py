@@ -0,0 +1,194 @@
+"""
+Latency and peak memory of the language server's hot paths on a synthetic corpus:
+
+- SpellCheck.is_correction_needed, check and complete, for dictionaries of 1k to 200k entries
+- ServableSpelling.spell_diagnostic on documents of 100 to 5,000 lines, and on one document as the dictionary grows
+- ServerFunctions completion and code action dispatch, as pygls calls them
+- CodexReader parsing of a .codex notebook
+
+Results are printed and written as json to bench/results (see bench.measure). Run from the servers directory:
+
+    python -m bench.bench_hot_paths
+    python -m bench.bench_hot_paths --quick --output results.json
+    python -m bench.measure bench/results/<old>.json bench/results/<new>.json
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import tempfile
+from types import SimpleNamespace
+
+import lsprotocol.types as lsp_types
+from pygls.server import LanguageServer
+from pygls.workspace import Workspace
+
+from bench.corpus import make_document, make_notebook, make_words, write_dictionary, write_notebook
+from bench.measure import Results, measure
+from expirements import hash_check
+from servable.spelling import ServableSpelling
+from tools.codex_tools import CodexReader
+from tools.ls_tools import ServerFunctions
+from tools.spell_check import SUGGESTION_ENGINE, Dictionary, SpellCheck
+
+DICTIONARY_SIZES = [1_000, 10_000, 50_000, 200_000]
+DOCUMENT_LINES = [100, 1_000, 5_000]
+DIAGNOSTIC_DICTIONARY_SIZE = 10_000
+SWEEP_DOCUMENT_LINES = 200  # the document spell_diagnostic checks against each dictionary size
+NOTEBOOK_CHAPTERS = [10, 50]
+SAMPLE_WORDS = 200
+ENGINE = SUGGESTION_ENGINE.COMBINED  # as server.py configures it
+
+QUICK_DICTIONARY_SIZES = [1_000, 10_000]
+QUICK_DOCUMENT_LINES = [100, 1_000]
+QUICK_NOTEBOOK_CHAPTERS = [10]
+
+# suggestions and code actions render words with the project font, which isn't part of the repository
+HASHING = os.path.exists(hash_check.FONT_PATH)
+
+
+def misspell(rng: random.Random, word: str) -> str:
+    """
+    the word with one letter replaced, so it is one edit from a dictionary word
+    """
+    position = rng.randrange(len(word))
+    return word[:position] + rng.choice('abcdefghijklmnopqrstuvwxyz'.replace(word[position], '')) + word[position + 1:]
+
+
+def bench_spell_check(results: Results, directory: str, words: list, rng: random.Random, quick: bool) -> None:
+    size = len(words)
+    parameters = {'entries': size, 'engine': ENGINE.value}
+    write_dictionary(directory, words, rng)
+    results.add('dictionary.load', parameters,
+                measure(lambda: Dictionary(directory), repeats=1 if quick else 3, warmup=0))
+    spell_check = SpellCheck(Dictionary(directory), relative_checking=True, engine=ENGINE)
+
+    known = rng.sample(words, min(SAMPLE_WORDS, size))
+    typos = [misspell(rng, word) for word in known]
+    mixed = itertools.cycle([word for pair in zip(known, typos) for word in pair])
+    results.add('spell_check.is_correction_needed', parameters,
+                measure(lambda: spell_check.is_correction_needed(next(mixed)), repeats=1000, memory=False))
+
+    if HASHING:
+        typo_cycle = itertools.cycle(typos)
+        results.add('spell_check.check', parameters,
+                    measure(lambda: spell_check.check(next(typo_cycle)), repeats=10 if quick else 50))
+
+    prefixes = itertools.cycle([word[:3] for word in known])
+    results.add('spell_check.complete', parameters,
+                measure(lambda: spell_check.complete(next(prefixes)), repeats=200))
+
+    server, server_functions, spelling = make_server(directory)
+    uri = "file:///bench/drafts/Bible/GEN.codex"
+    open_document(server, uri, make_document(rng, words, SWEEP_DOCUMENT_LINES))
+    params = SimpleNamespace(text_document=SimpleNamespace(uri=uri))
+    results.add('spelling.spell_diagnostic', {'entries': size, 'lines': SWEEP_DOCUMENT_LINES},
+                measure(lambda: spelling.spell_diagnostic(server, params, server_functions), repeats=5 if quick else 20))
+
+
+def make_server(directory: str) -> tuple:
+    """
+    a ServerFunctions with the spelling providers registered as server.py does, and the spelling provider
+    loaded from the dictionary in directory
+    """
+    server = LanguageServer("bench-server", "v0.1")
+    server.lsp._workspace = Workspace(None)
+    server_functions = ServerFunctions(server=server, data_path=directory)
+    spelling = ServableSpelling(sf=server_functions, relative_checking=True, engine=ENGINE)
+    spelling.dictionary = Dictionary(directory)
+    spelling.spell_check = SpellCheck(spelling.dictionary, relative_checking=True, engine=ENGINE)
+    server_functions.add_completion(spelling.spell_completion)
+    server_functions.add_action(spelling.spell_action)
+    server_functions.start()
+    return server, server_functions, spelling
+
+
+def open_document(server: LanguageServer, uri: str, text: str) -> None:
+    server.workspace.put_text_document(lsp_types.TextDocumentItem(uri=uri, language_id='scripture', version=1, text=text))
+
+
+def bench_spell_diagnostic(results: Results, directory: str, words: list, rng: random.Random, quick: bool) -> None:
+    server, server_functions, spelling = make_server(directory)
+    for lines in (QUICK_DOCUMENT_LINES if quick else DOCUMENT_LINES):
+        uri = f"file:///bench/drafts/Bible/GEN{lines}.codex"
+        open_document(server, uri, make_document(rng, words, lines))
+        params = SimpleNamespace(text_document=SimpleNamespace(uri=uri))
+        results.add('spelling.spell_diagnostic', {'entries': len(words), 'lines': lines},
+                    measure(lambda: spelling.spell_diagnostic(server, params, server_functions),
+                            repeats=5 if quick else 20))
+
+
+def bench_dispatch(results: Results, directory: str, words: list, rng: random.Random, quick: bool) -> None:
+    server, server_functions, spelling = make_server(directory)
+    uri = "file:///bench/drafts/Bible/GEN.codex"
+    text = make_document(rng, words, 200)
+    open_document(server, uri, text)
+    document_lines = text.split('\n')
+    loop = asyncio.new_event_loop()
+    features = server.lsp.fm.features
+    parameters = {'entries': len(words), 'providers': 'spelling'}
+
+    def completion_params():
+        line = rng.randrange(len(document_lines))
+        character = len(document_lines[line])
+        return lsp_types.CompletionParams(text_document=lsp_types.TextDocumentIdentifier(uri=uri),
+                                          position=lsp_types.Position(line=line, character=character))
+
+    completion = features[lsp_types.TEXT_DOCUMENT_COMPLETION]
+    results.add('server.completion', parameters,
+                measure(lambda: loop.run_until_complete(completion(completion_params())), repeats=200))
+
+    def action_params():
+        line = rng.randrange(len(document_lines))
+        diagnostics = spelling.spell_line_diagnostic(line, document_lines[line])
+        line_range = lsp_types.Range(start=lsp_types.Position(line=line, character=0),
+                                     end=lsp_types.Position(line=line, character=len(document_lines[line])))
+        return lsp_types.CodeActionParams(text_document=lsp_types.TextDocumentIdentifier(uri=uri), range=line_range,
+                                          context=lsp_types.CodeActionContext(diagnostics=diagnostics[:1]))
+
+    if HASHING:
+        action = features[lsp_types.TEXT_DOCUMENT_CODE_ACTION]
+        action_inputs = itertools.cycle([action_params() for _ in range(50)])
+        results.add('server.code_action', parameters,
+                    measure(lambda: action(next(action_inputs)), repeats=10 if quick else 50))
+    loop.close()
+
+
+def bench_codex_reader(results: Results, directory: str, words: list, rng: random.Random, quick: bool) -> None:
+    reader = CodexReader(verse_chunk_size=4)
+    for chapters in (QUICK_NOTEBOOK_CHAPTERS if quick else NOTEBOOK_CHAPTERS):
+        path = write_notebook(os.path.join(directory, f"GEN{chapters}.codex"), make_notebook(rng, words, 'GEN', chapters))
+        parameters = {'chapters': chapters, 'kib': os.path.getsize(path) // 1024}
+        results.add('codex_reader.get_embed_format', parameters,
+                    measure(lambda: reader.get_embed_format(path), repeats=5 if quick else 20))
+
+
+def run(quick: bool = False, seed: int = 0) -> Results:
+    results = Results()
+    rng = random.Random(seed)
+    if not HASHING:
+        print(f"{hash_check.FONT_PATH} is missing, skipping spell_check.check and server.code_action")
+    sizes = QUICK_DICTIONARY_SIZES if quick else DICTIONARY_SIZES
+    all_words = make_words(rng, max(sizes + [DIAGNOSTIC_DICTIONARY_SIZE]))
+    rng.shuffle(all_words)
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            bench_spell_check(results, directory, all_words[:size], rng, quick)
+
+    words = all_words[:DIAGNOSTIC_DICTIONARY_SIZE]
+    for bench in (bench_spell_diagnostic, bench_dispatch, bench_codex_reader):
+        with tempfile.TemporaryDirectory() as directory:
+            write_dictionary(directory, words, rng)
+            bench(results, directory, words, rng, quick)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the language server's hot paths")
+    parser.add_argument("--quick", action="store_true", help="smaller sizes and fewer repeats")
+    parser.add_argument("--output", default=None, help="results file (default: bench/results/<time>-<commit>.json)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    results = run(quick=args.quick, seed=args.seed)
+    print(f"wrote {results.write(args.output)}")
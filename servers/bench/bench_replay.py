@@ -0,0 +1,195 @@
+"""
+Replays a recorded or synthetic session (see bench.lsp_session) against server.py over stdio and measures
+what the editor sees: request latency per method, time from an edit to its diagnostics, and throughput.
+
+The server runs with the stub embedding backend (COPILOT_EMBEDDING_BACKEND=stub), so no model is
+downloaded or loaded. Run from the servers directory:
+
+    python -m bench.lsp_session synthesize /tmp/session.jsonl --project /tmp/project --typists 4
+    python -m bench.bench_replay /tmp/session.jsonl
+    python -m bench.bench_replay /tmp/session.jsonl --speed 0  # send as fast as possible
+"""
+import argparse
+import os
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from bench.lsp_session import SEND, read_message, read_session, write_message
+from bench.measure import Results, summarize
+
+SERVERS_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_COMMAND = [sys.executable, os.path.join(SERVERS_DIRECTORY, 'server.py')]
+
+
+class Replay:
+    """
+    One replay of a session against a server process.
+
+    Client messages are sent at their recorded times divided by `speed` (0 sends them back to back).
+    Requests from the server (capability registration, progress...) are answered right away, so the
+    responses the editor sent to them during recording are not replayed.
+    """
+    def __init__(self, records: List[Dict], command: List[str] = None, speed: float = 1.0, timeout: float = 60) -> None:
+        self.records = [record for record in records if record['direction'] == SEND
+                        and 'method' in record['message']]
+        self.command = command or SERVER_COMMAND
+        self.speed = speed
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()  # the reader thread answers the server's requests
+        self.sent_requests: Dict = {}  # id -> (method, time sent)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.changes: Dict[str, List[tuple]] = defaultdict(list)  # uri -> [(version, time sent)] without diagnostics yet
+        self.diagnostic_latencies: List[float] = []
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.received = 0
+        self.done = threading.Event()
+        self.process = None
+
+    def run(self) -> Dict:
+        environment = dict(os.environ, COPILOT_EMBEDDING_BACKEND='stub')
+        self.process = subprocess.Popen(self.command, cwd=SERVERS_DIRECTORY, env=environment,
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        reader = threading.Thread(target=self.read, daemon=True)
+        reader.start()
+        start = time.monotonic()
+        try:
+            for record in self.records:
+                if self.speed > 0:
+                    delay = start + record['t'] / self.speed - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                self.send(record['message'])
+            sent = time.monotonic()
+            self.wait_for_responses()
+        finally:
+            self.stop()
+        reader.join(timeout=5)
+        return self.summary(time.monotonic() - start, sent - start)
+
+    def send(self, message: Dict) -> None:
+        now = time.monotonic()
+        with self.lock:
+            if 'id' in message:
+                self.sent_requests[message['id']] = (message['method'], now)
+            if message['method'] == 'textDocument/didChange':
+                document = message['params']['textDocument']
+                self.changes[document['uri']].append((document.get('version'), now))
+            elif message['method'] == 'textDocument/didClose':
+                self.changes.pop(message['params']['textDocument']['uri'], None)
+        self.write(message)
+
+    def write(self, message: Dict) -> None:
+        with self.write_lock:
+            write_message(self.process.stdin, message)
+
+    def read(self) -> None:
+        try:
+            while True:
+                message = read_message(self.process.stdout)
+                if message is None:
+                    break
+                self.on_message(message, time.monotonic())
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.done.set()
+
+    def on_message(self, message: Dict, now: float) -> None:
+        with self.lock:
+            self.received += 1
+            if 'method' in message:
+                if 'id' in message:  # a request from the server
+                    self.write({'jsonrpc': '2.0', 'id': message['id'], 'result': None})
+                elif message['method'] == 'textDocument/publishDiagnostics':
+                    self.on_diagnostics(message['params'], now)
+                return
+            request = self.sent_requests.pop(message.get('id'), None)
+            if request is None:
+                return
+            method, sent = request
+            self.latencies[method].append(now - sent)
+            if 'error' in message:
+                self.errors[method] += 1
+
+    def on_diagnostics(self, params: Dict, now: float) -> None:
+        """
+        time to diagnostics: from the latest edit the published diagnostics cover to their arrival,
+        which includes the server's debounce delay
+        """
+        changes = self.changes.get(params['uri'])
+        if not changes:
+            return
+        version = params.get('version')
+        covered = [change for change in changes if version is None or change[0] is None or change[0] <= version]
+        if covered:
+            self.diagnostic_latencies.append(now - covered[-1][1])
+            self.changes[params['uri']] = [change for change in changes if change not in covered]
+
+    def wait_for_responses(self) -> None:
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline and not self.done.is_set():
+            with self.lock:
+                if not self.sent_requests:
+                    return
+            time.sleep(0.01)
+
+    def stop(self) -> None:
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+    def summary(self, duration: float, sending: float) -> Dict:
+        return {
+            'duration_s': duration,
+            'messages_sent': len(self.records),
+            'messages_received': self.received,
+            'throughput_per_s': len(self.records) / sending if sending > 0 else 0.0,
+            'unanswered': sorted({method for method, _ in self.sent_requests.values()}),
+            'errors': dict(self.errors),
+        }
+
+
+def replay(session_path: str, speed: float = 1.0, command: List[str] = None, timeout: float = 60,
+           results: Results = None) -> Results:
+    """
+    Replays the session and adds its latency distributions and throughput to results.
+    """
+    results = results or Results()
+    run = Replay(list(read_session(session_path)), command=command, speed=speed, timeout=timeout)
+    summary = run.run()
+    parameters = {'session': os.path.basename(session_path), 'speed': speed}
+    for method, latencies in sorted(run.latencies.items()):
+        results.add(f"replay.{method}", parameters, summarize(latencies))
+    if run.diagnostic_latencies:
+        results.add('replay.time_to_diagnostics', parameters, summarize(run.diagnostic_latencies))
+    results.environment['replay'] = summary
+    print(f"{summary['messages_sent']} messages in {summary['duration_s']:.1f} s, "
+          f"{summary['throughput_per_s']:.1f} sent/s, {summary['messages_received']} received")
+    if summary['unanswered'] or summary['errors']:
+        print(f"unanswered: {summary['unanswered']}, errors: {summary['errors']}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replays a language server session over stdio and measures latencies")
+    parser.add_argument("session", help="a session file from bench.lsp_session")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed factor, 0 for as fast as possible")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for the last responses")
+    parser.add_argument("--output", default=None, help="results file (default: bench/results/<time>-<commit>.json)")
+    parser.add_argument("--server", default=None, help="the server command (default: python server.py)")
+    args = parser.parse_args()
+    server_command = shlex.split(args.server) if args.server else None
+    results = replay(args.session, speed=args.speed, command=server_command, timeout=args.timeout)
+    print(f"wrote {results.write(args.output)}")
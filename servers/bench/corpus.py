@@ -0,0 +1,103 @@
+"""
+Synthetic projects for the benchmarks: dictionaries, scripture documents and .codex notebooks.
+
+Everything is generated from a seeded random.Random, so two runs bench the same data.
+Write a project to disk from the servers directory with:
+
+    python -m bench.corpus path/to/project --entries 50000 --books 3
+"""
+import argparse
+import json
+import os
+import random
+import string
+from typing import List
+
+BOOKS = ['GEN', 'EXO', 'LEV', 'NUM', 'DEU', 'JOS', 'JDG', 'RUT', '1SA', '2SA', 'MAT', 'MRK', 'LUK', 'JHN', 'ACT', 'ROM']
+
+
+def random_word(rng: random.Random) -> str:
+    return ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 10)))
+
+
+def make_words(rng: random.Random, count: int) -> List[str]:
+    """
+    returns `count` distinct random words
+    """
+    words = set()
+    while len(words) < count:
+        words.add(random_word(rng))
+    return sorted(words)
+
+
+def write_dictionary(path: str, words: List[str], rng: random.Random = None, file_name: str = 'project.dictionary') -> str:
+    """
+    writes words as a .dictionary file in the directory `path`, with random usage frequencies, and returns its path
+    """
+    rng = rng or random.Random(0)
+    entries = [{'headWord': word, 'id': str(i), 'hash': f"{rng.getrandbits(64):016x}",
+                'metadata': {'extra': {'frequency': rng.randint(0, 50)}}} for i, word in enumerate(words)]
+    file_path = os.path.join(path, file_name)
+    with open(file_path, 'w') as file:
+        json.dump({'entries': entries}, file)
+    return file_path
+
+
+def make_line(rng: random.Random, words: List[str], length: int = 12, known: float = 0.8) -> str:
+    """
+    a line of `length` words, `known` of them from the dictionary and the rest misspelled
+    """
+    return ' '.join(rng.choice(words) if rng.random() < known else random_word(rng) for _ in range(length))
+
+
+def make_document(rng: random.Random, words: List[str], lines: int, book: str = 'GEN') -> str:
+    """
+    a scripture document of `lines` verses, each starting with its reference, e.g. 'GEN 1:1'
+    """
+    return '\n'.join(f"{book} {1 + i // 30}:{1 + i % 30} {make_line(rng, words)}" for i in range(lines))
+
+
+def make_notebook(rng: random.Random, words: List[str], book: str = 'GEN', chapters: int = 50, verses: int = 30) -> dict:
+    """
+    a .codex notebook in the shape CodexReader expects: a markdown cell per chapter followed by a scripture cell of its verses
+    """
+    cells = []
+    for chapter in range(1, chapters + 1):
+        cells.append({'kind': 1, 'language': 'markdown', 'value': f"# Chapter {chapter}", 'metadata': {}})
+        text = '\n'.join(f"{book} {chapter}:{verse} {make_line(rng, words)}" for verse in range(1, verses + 1))
+        cells.append({'kind': 2, 'language': 'scripture', 'value': text, 'metadata': {'type': 'chapter-heading'}})
+    return {'cells': cells, 'metadata': {}}
+
+
+def write_notebook(path: str, notebook: dict) -> str:
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(notebook, file, ensure_ascii=False, indent=2)
+    return path
+
+
+def write_project(root: str, entries: int = 10_000, books: int = 2, chapters: int = 50, verses: int = 30,
+                  seed: int = 0) -> List[str]:
+    """
+    writes a project as the server expects it: root/drafts/project.dictionary and root/drafts/Bible/*.codex.
+    Returns the paths of the notebooks.
+    """
+    rng = random.Random(seed)
+    drafts = os.path.join(root, 'drafts')
+    os.makedirs(os.path.join(drafts, 'Bible'), exist_ok=True)
+    words = make_words(rng, entries)
+    write_dictionary(drafts, words, rng)
+    return [write_notebook(os.path.join(drafts, 'Bible', f"{book}.codex"),
+                           make_notebook(rng, words, book, chapters, verses)) for book in BOOKS[:books]]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Writes a synthetic project")
+    parser.add_argument("root")
+    parser.add_argument("--entries", type=int, default=10_000, help="dictionary entries")
+    parser.add_argument("--books", type=int, default=2, help=f"notebooks, at most {len(BOOKS)}")
+    parser.add_argument("--chapters", type=int, default=50)
+    parser.add_argument("--verses", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    paths = write_project(args.root, args.entries, args.books, args.chapters, args.verses, args.seed)
+    print(f"wrote {args.entries} dictionary entries and {len(paths)} notebooks under {args.root}")
@@ -0,0 +1,254 @@
+"""
+Recorded and synthetic language server sessions, for bench.bench_replay.
+
+A session file has one json record per line: {"t": seconds since the start, "direction": "send" or
+"receive", "message": the JSON-RPC message}. "send" is from the editor to the server.
+
+Record a real editing session by pointing the editor's server command at the recorder, which
+passes the traffic through to the real server:
+
+    python -m bench.lsp_session record session.jsonl -- python server.py
+
+Or synthesize one: N typists editing .codex notebooks of a generated project at once:
+
+    python -m bench.lsp_session synthesize session.jsonl --project /tmp/project --typists 4 --edits 200
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from typing import BinaryIO, Dict, Iterator, List, Optional
+
+from bench.corpus import random_word, write_project
+
+SEND = 'send'
+RECEIVE = 'receive'
+
+
+def write_message(stream: BinaryIO, message: Dict) -> None:
+    """
+    writes a JSON-RPC message with its Content-Length header
+    """
+    body = json.dumps(message, separators=(',', ':')).encode('utf-8')
+    stream.write(f"Content-Length: {len(body)}\r\n\r\n".encode('ascii') + body)
+    stream.flush()
+
+
+def read_message(stream: BinaryIO) -> Optional[Dict]:
+    """
+    reads the next JSON-RPC message, or returns None at the end of the stream
+    """
+    length = None
+    while True:
+        line = stream.readline()
+        if not line:
+            return None
+        line = line.strip()
+        if not line:
+            if length is not None:
+                break
+            continue
+        name, _, value = line.decode('ascii').partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    body = stream.read(length)
+    if len(body) < length:
+        return None
+    return json.loads(body)
+
+
+def read_session(path: str) -> Iterator[Dict]:
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+class SessionWriter:
+    """
+    Appends session records to a file; safe to use from the two threads of the recorder.
+    """
+    def __init__(self, path: str) -> None:
+        self.file = open(path, 'w', encoding='utf-8')
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+
+    def write(self, direction: str, message: Dict, t: float = None) -> None:
+        record = {'t': round(time.monotonic() - self.start if t is None else t, 6), 'direction': direction, 'message': message}
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+        with self.lock:
+            self.file.write(line + '\n')
+            self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def record(path: str, command: List[str]) -> int:
+    """
+    Runs the server command and passes this process's stdin and stdout through to it, recording both directions.
+    """
+    writer = SessionWriter(path)
+    server = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def forward(source: BinaryIO, target: BinaryIO, direction: str) -> None:
+        try:
+            while True:
+                message = read_message(source)
+                if message is None:
+                    break
+                writer.write(direction, message)
+                write_message(target, message)
+        except (OSError, ValueError):
+            pass
+        finally:
+            if direction == SEND:
+                server.stdin.close()
+
+    to_server = threading.Thread(target=forward, args=(sys.stdin.buffer, server.stdin, SEND), daemon=True)
+    to_editor = threading.Thread(target=forward, args=(server.stdout, sys.stdout.buffer, RECEIVE), daemon=True)
+    to_server.start()
+    to_editor.start()
+    code = server.wait()
+    to_editor.join(timeout=5)
+    writer.close()
+    return code
+
+
+def file_uri(path: str) -> str:
+    return 'file://' + os.path.abspath(path).replace(os.sep, '/')
+
+
+def cell_uri(path: str, cell: int) -> str:
+    """
+    the uri VS Code gives the text document of a notebook cell
+    """
+    return f"vscode-notebook-cell:{os.path.abspath(path).replace(os.sep, '/')}#cell{cell}"
+
+
+class Typist:
+    """
+    One simulated translator typing words at the end of the verses of a notebook cell.
+    """
+    def __init__(self, uri: str, text: str, rng: random.Random, words: List[str]) -> None:
+        self.uri = uri
+        self.lines = text.split('\n')
+        self.rng = rng
+        self.words = words
+        self.version = 1
+        self.line = 0
+        self.pending = ''  # the rest of the word being typed
+
+    def next_change(self) -> Dict:
+        """
+        the didChange parameters for typing the next character
+        """
+        if not self.pending:
+            self.line = self.rng.randrange(len(self.lines))
+            word = self.rng.choice(self.words) if self.rng.random() < 0.8 else random_word(self.rng)
+            self.pending = ' ' + word
+        character, self.pending = self.pending[0], self.pending[1:]
+        position = {'line': self.line, 'character': len(self.lines[self.line])}
+        self.lines[self.line] += character
+        self.version += 1
+        return {'textDocument': {'uri': self.uri, 'version': self.version},
+                'contentChanges': [{'range': {'start': position, 'end': position}, 'text': character}]}
+
+    def position(self) -> Dict:
+        return {'line': self.line, 'character': len(self.lines[self.line])}
+
+
+def synthesize(path: str, project: str, typists: int = 4, edits: int = 200, interval: float = 0.15,
+               pause: float = 1.0, completion_every: int = 6, entries: int = 10_000, seed: int = 0) -> int:
+    """
+    Writes a session of `typists` translators each typing `edits` characters into their own notebook,
+    one every `interval` seconds and pausing `pause` seconds after every word, asking for completions
+    every `completion_every` characters.
+    The project (dictionary and notebooks) is generated under `project`. Returns the number of messages.
+    """
+    rng = random.Random(seed)
+    notebooks = write_project(project, entries=entries, books=typists, chapters=3, seed=seed)
+    with open(os.path.join(project, 'drafts', 'project.dictionary'), 'r') as file:
+        words = [entry['headWord'] for entry in json.load(file)['entries']]
+    records = []
+    request_ids = iter(range(1, 1_000_000))
+
+    def send(t: float, message: Dict) -> None:
+        records.append({'t': round(t, 6), 'direction': SEND, 'message': message})
+
+    def request(t: float, method: str, params) -> None:
+        send(t, {'jsonrpc': '2.0', 'id': next(request_ids), 'method': method, 'params': params})
+
+    def notify(t: float, method: str, params) -> None:
+        send(t, {'jsonrpc': '2.0', 'method': method, 'params': params})
+
+    request(0, 'initialize', {
+        'processId': None, 'rootUri': file_uri(project), 'rootPath': os.path.abspath(project),
+        'capabilities': {'window': {'workDoneProgress': True},
+                         'textDocument': {'publishDiagnostics': {'versionSupport': True}}}})
+    notify(0.05, 'initialized', {})
+
+    people = []
+    for index, notebook_path in enumerate(notebooks):
+        with open(notebook_path, 'r', encoding='utf-8') as file:
+            cell = json.load(file)['cells'][1]  # the first chapter's verses
+        typist = Typist(cell_uri(notebook_path, 1), cell['value'], random.Random(rng.random()), words)
+        notify(0.1, 'textDocument/didOpen', {'textDocument': {
+            'uri': typist.uri, 'languageId': 'scripture', 'version': typist.version, 'text': cell['value']}})
+        people.append((index * interval / len(notebooks), typist))
+
+    end = 0
+    for offset, typist in people:
+        t = 0.5 + offset
+        for edit in range(edits):
+            t += interval
+            notify(t, 'textDocument/didChange', typist.next_change())
+            if completion_every and (edit + 1) % completion_every == 0:
+                request(t + 0.001, 'textDocument/completion', {
+                    'textDocument': {'uri': typist.uri}, 'position': typist.position()})
+            if not typist.pending:
+                t += pause  # between words
+        end = max(end, t + 1)
+
+    for _, typist in people:
+        notify(end, 'textDocument/didClose', {'textDocument': {'uri': typist.uri}})
+    request(end + 0.5, 'shutdown', None)
+    notify(end + 0.6, 'exit', None)
+
+    records.sort(key=lambda entry: entry['t'])  # stable, so messages sent at the same time keep their order
+    with open(path, 'w', encoding='utf-8') as file:
+        for entry in records:
+            file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+    return len(records)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Records or synthesizes language server sessions")
+    commands = parser.add_subparsers(dest="command", required=True)
+    record_parser = commands.add_parser("record", help="pass an editor's traffic through to the server and record it")
+    record_parser.add_argument("output")
+    record_parser.add_argument("server", nargs=argparse.REMAINDER, help="the server command, after --")
+    synthesize_parser = commands.add_parser("synthesize", help="write a session of simulated typists")
+    synthesize_parser.add_argument("output")
+    synthesize_parser.add_argument("--project", required=True, help="where to generate the project the session edits")
+    synthesize_parser.add_argument("--typists", type=int, default=4)
+    synthesize_parser.add_argument("--edits", type=int, default=200, help="characters typed by each typist")
+    synthesize_parser.add_argument("--interval", type=float, default=0.15, help="seconds between a typist's keystrokes")
+    synthesize_parser.add_argument("--pause", type=float, default=1.0, help="seconds a typist pauses after a word")
+    synthesize_parser.add_argument("--completion-every", type=int, default=6, help="keystrokes between completion requests")
+    synthesize_parser.add_argument("--entries", type=int, default=10_000, help="dictionary entries")
+    synthesize_parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        server_command = args.server[1:] if args.server[:1] == ['--'] else args.server
+        if not server_command:
+            parser.error("record needs the server command, e.g. -- python server.py")
+        sys.exit(record(args.output, server_command))
+    count = synthesize(args.output, args.project, args.typists, args.edits, args.interval, args.pause,
+                       args.completion_every, args.entries, args.seed)
+    print(f"wrote {count} messages to {args.output}")
@@ -0,0 +1,171 @@
+"""
+Timing, memory and result files for the benchmarks.
+
+A results file is json: the run's environment (commit, python, machine) and one record per
+benchmark with its parameters, latency percentiles in milliseconds and peak memory in KiB.
+Compare two of them with:
+
+    python -m bench.measure old.json new.json
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """
+    the value below which `fraction` of sorted_values fall, interpolating between neighbours
+    """
+    if not sorted_values:
+        return 0.0
+    position = fraction * (len(sorted_values) - 1)
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize(timings: List[float]) -> Dict[str, float]:
+    """
+    latency statistics in milliseconds for timings in seconds
+    """
+    values = sorted(timing * 1000 for timing in timings)
+    return {
+        'count': len(values),
+        'min_ms': values[0],
+        'mean_ms': sum(values) / len(values),
+        'p50_ms': percentile(values, 0.50),
+        'p90_ms': percentile(values, 0.90),
+        'p99_ms': percentile(values, 0.99),
+        'max_ms': values[-1],
+    }
+
+
+def peak_memory(function: Callable) -> float:
+    """
+    the peak memory allocated by python while calling function once, in KiB
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def measure(function: Callable, repeats: int = 20, warmup: int = 1, memory: bool = True,
+            max_seconds: float = 30) -> Dict[str, float]:
+    """
+    Times `repeats` calls of function (fewer if they take longer than max_seconds in total),
+    after `warmup` untimed calls. The memory peak comes from one more call, since tracing slows calls down.
+    """
+    for _ in range(warmup):
+        function()
+    timings = []
+    deadline = time.perf_counter() + max_seconds
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+        if start > deadline:
+            break
+    stats = summarize(timings)
+    if memory:
+        stats['peak_kib'] = peak_memory(function)
+    return stats
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ''
+
+
+class Results:
+    """
+    The records of one benchmark run, written as json so runs can be compared across commits.
+
+    Example Usage:
+        results = Results()
+        results.add('spell_check.check', {'entries': 1000}, measure(lambda: spell_check.check('wrod')))
+        results.write()
+    """
+    def __init__(self) -> None:
+        self.environment = {
+            'commit': git_commit(),
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'processor': platform.processor() or platform.machine(),
+            'cpus': os.cpu_count(),
+        }
+        self.records: List[Dict] = []
+
+    def add(self, name: str, parameters: Dict, stats: Dict[str, float]) -> Dict:
+        record = {'name': name, 'parameters': parameters, **stats}
+        self.records.append(record)
+        print(format_record(record), flush=True)
+        return record
+
+    def write(self, path: str = None) -> str:
+        if path is None:
+            stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+            path = os.path.join(RESULTS_DIRECTORY, f"{stamp}-{self.environment['commit'] or 'unknown'}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as file:
+            json.dump({'environment': self.environment, 'results': self.records}, file, indent=2)
+        return path
+
+
+def record_key(record: Dict) -> str:
+    parameters = ', '.join(f"{key}={value}" for key, value in sorted(record['parameters'].items()))
+    return f"{record['name']} ({parameters})" if parameters else record['name']
+
+
+def format_record(record: Dict) -> str:
+    memory = f"  peak {record['peak_kib']:10.0f} KiB" if 'peak_kib' in record else ''
+    return (f"{record_key(record):<60} p50 {record['p50_ms']:9.3f} ms  p90 {record['p90_ms']:9.3f} ms"
+            f"  p99 {record['p99_ms']:9.3f} ms{memory}")
+
+
+def compare(old_path: str, new_path: str, threshold: float = 0.1) -> List[str]:
+    """
+    Lines comparing the p50 latency and peak memory of the benchmarks two results files share.
+    Changes beyond `threshold` (a fraction) are flagged.
+    """
+    with open(old_path) as file:
+        old = {record_key(record): record for record in json.load(file)['results']}
+    with open(new_path) as file:
+        new = {record_key(record): record for record in json.load(file)['results']}
+    lines = []
+    for key, record in new.items():
+        if key not in old:
+            continue
+        ratio = record['p50_ms'] / old[key]['p50_ms'] if old[key]['p50_ms'] else float('inf')
+        flag = 'slower' if ratio > 1 + threshold else 'faster' if ratio < 1 - threshold else ''
+        memory = ''
+        if 'peak_kib' in record and old[key].get('peak_kib'):
+            memory = f"  memory x{record['peak_kib'] / old[key]['peak_kib']:.2f}"
+        lines.append(f"{key:<60} {old[key]['p50_ms']:9.3f} -> {record['p50_ms']:9.3f} ms  x{ratio:.2f}{memory}  {flag}")
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compares two benchmark results files")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change to flag (default: 0.1)")
+    args = parser.parse_args()
+    print('\n'.join(compare(args.old, args.new, args.threshold)))
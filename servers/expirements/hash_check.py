@@ -1,10 +1,113 @@
+import functools
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional
 from PIL import Image, ImageDraw, ImageFont
 import imagehash
+import numpy as np
 
+HASH_MASK = (1 << 64) - 1
+# popcount of every byte value, for numpy versions without np.bitwise_count
+_BYTE_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
 
-def spell_hash(text: str, font_path: str= "servers/expirements/unifont-15.1.04.otf", font_size: int=50) -> imagehash.ImageHash:
+
+FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "unifont-15.1.04.otf")
+
+
+@functools.lru_cache(maxsize=None)
+def load_font(font_path: Optional[str] = FONT_PATH, font_size: int = 50):
+    """
+    Load a font once per process. Uses the default PIL font if font_path is empty.
+    """
+    if font_path:
+        return ImageFont.truetype(os.path.abspath(font_path), font_size)
+    # Fallback to a default font if no path is provided
+    return ImageFont.load_default()
+
+
+class SpellHasher:
+    """
+    Renders words with a preloaded font and keeps an LRU of their image hashes.
+
+    Args:
+    font_path (str): Optional. Path to a .ttf/.otf font file. Uses default font if None.
+    font_size (int): Font size.
+    cache_size (int): How many word hashes to keep.
+    parallel_threshold (int): Smallest batch of new words hash_many renders in a process pool.
+    max_workers (int): Size of that process pool.
+    """
+    def __init__(self, font_path: Optional[str] = FONT_PATH, font_size: int = 50, cache_size: int = 65536,
+                 parallel_threshold: int = 512, max_workers: Optional[int] = None):
+        self.font_path = font_path
+        self.font_size = font_size
+        self.font = load_font(font_path, font_size)
+        self.hash = functools.lru_cache(maxsize=cache_size)(self.render_hash)
+        self.parallel_threshold = parallel_threshold
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.pool = None
+
+    def render_hash(self, text: str) -> imagehash.ImageHash:
+        """
+        Render text on an image sized to fit it and return the image hash, bypassing the cache.
+        """
+        # Measure the text directly with the font instead of drawing it on a dummy image
+        bbox = self.font.getbbox(text)
+        text_width, text_height = bbox[2] - bbox[0], bbox[3] - bbox[1]
+
+        # Create an actual image with a white background, dynamically sized
+        img = Image.new('RGB', (text_width + 20, text_height + 20), color=(255, 255, 255))
+        d = ImageDraw.Draw(img)
+
+        # Draw the text on the actual image, offset by the margin
+        d.text((10, 10), text, fill=(0, 0, 0), font=self.font)
+        return imagehash.average_hash(img)
+
+    def hash_many(self, words: Iterable[str]) -> Dict[str, imagehash.ImageHash]:
+        """
+        Hash a batch of words, rendering each distinct word at most once.
+        Large batches are rendered across a process pool when there is more than one CPU.
+        """
+        words = list(dict.fromkeys(words))
+        if len(words) < self.parallel_threshold or self.max_workers < 2:
+            return {word: self.hash(word) for word in words}
+
+        if self.pool is None:
+            # spawned, since forking from the server's threads copies locks they may hold
+            self.pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+        size = math.ceil(len(words) / self.max_workers)
+        chunks = [words[i:i + size] for i in range(0, len(words), size)]
+        arguments = [(chunk, self.font_path, self.font_size) for chunk in chunks]
+        hashes = [value for chunk in self.pool.map(render_hashes, *zip(*arguments)) for value in chunk]
+        return {word: imagehash.hex_to_hash(value) for word, value in zip(words, hashes)}
+
+    def shutdown(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+
+def render_hashes(words: List[str], font_path: Optional[str], font_size: int) -> List[str]:
+    """
+    Hash words in a worker process. Returns the hashes as hexadecimal strings.
+    """
+    hasher = get_hasher(font_path, font_size)
+    return [str(hasher.hash(word)) for word in words]
+
+
+@functools.lru_cache(maxsize=None)
+def get_hasher(font_path: Optional[str] = FONT_PATH, font_size: int = 50) -> SpellHasher:
+    """
+    Return the shared SpellHasher for a font, creating it on first use.
+    """
+    return SpellHasher(font_path, font_size)
+
+
+def spell_hash(text: str, font_path: Optional[str] = FONT_PATH, font_size: int = 50) -> imagehash.ImageHash:
     """
     Convert text to an image and return the image hash, automatically computing image size based on text.
+    The font is loaded once and recent hashes are cached, see SpellHasher.
     
     Args:
     text (str): The Unicode text to convert into an image.
@@ -12,39 +115,46 @@ def spell_hash(text: str, font_path: str= "servers/expirements/unifont-15.1.04.o
     font_size (int): Font size.
     
     Returns:
-    str: A hexadecimal string representing the image's hash.
+    imagehash.ImageHash: The image's hash; str() gives it as a hexadecimal string.
     """
-    # Load a font. Use a default PIL font if font_path is not provided.
-    if font_path:
-        font = ImageFont.truetype(font_path, font_size)
-    else:
-        # Fallback to a default font if no path is provided
-        font = ImageFont.load_default()
-    
-    # Create a dummy image to calculate text dimensions accurately
-    dummy_img = Image.new('RGB', (1, 1))
-    dummy_draw = ImageDraw.Draw(dummy_img)
-    
-    # Draw the text on the dummy image to calculate its bounding box
-    dummy_draw.text((0, 0), text, font=font, fill=(0, 0, 0))
-    bbox = dummy_draw.textbbox((0, 0), text, font=font)
-    
-    # Calculate text width and height from the bounding box
-    text_width, text_height = bbox[2] - bbox[0], bbox[3] - bbox[1]
-    
-    # Create an actual image with a white background, dynamically sized
-    img = Image.new('RGB', (text_width + 20, text_height + 20), color=(255, 255, 255))
-    d = ImageDraw.Draw(img)
-
-    # Draw the text on the actual image, centered
-    d.text((10, 10), text, fill=(0, 0, 0), font=font)
-    # Compute image hash using imagehash library
-    hash_value = imagehash.average_hash(img)
-    
-    # Return the hash as a hexadecimal string
-    return hash_value
+    return get_hasher(font_path, font_size).hash(text)
+
+
+def spell_hash_many(words: Iterable[str], font_path: Optional[str] = FONT_PATH, font_size: int = 50) -> Dict[str, imagehash.ImageHash]:
+    """
+    Hash a batch of words with the shared SpellHasher. Returns a word -> hash mapping.
+    """
+    return get_hasher(font_path, font_size).hash_many(words)
+
+
+def hash_to_int(value) -> int:
+    """
+    Convert a stored hash (hex string or ImageHash) into a 64 bit integer.
+    Missing or malformed hashes map to 0.
+    """
+    if isinstance(value, int):
+        return value & HASH_MASK
+    try:
+        return int(str(value), 16) & HASH_MASK
+    except (TypeError, ValueError):
+        return 0
 
 
+def hamming_distances(query: int, hashes: np.ndarray) -> np.ndarray:
+    """
+    Compute the Hamming distance between one hash and an array of packed uint64 hashes.
+
+    Args:
+    query (int): The hash to compare, as returned by hash_to_int.
+    hashes (np.ndarray): A uint64 array of hashes.
+
+    Returns:
+    np.ndarray: The number of differing bits for every hash.
+    """
+    xor = np.bitwise_xor(hashes, np.uint64(query & HASH_MASK))
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(xor)
+    return _BYTE_POPCOUNT[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.uint8)
 
 
 # Example usage:
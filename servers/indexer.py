@@ -0,0 +1,189 @@
+"""
+Builds the embedding index of a project from the command line, without the editor.
+
+Every .codex file under the project's drafts is read in a process pool and its chunks are
+embedded in batches. Finished files are recorded in a manifest next to the database, so an
+interrupted run picks up where it stopped. Don't run it while the language server indexes the
+same project.
+
+Run from the servers directory:
+
+    python indexer.py path/to/project
+    python indexer.py path/to/project --workers 4 --batch-size 512
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Tuple
+
+from tools.codex_tools import CODEX_EXTENSION, CodexReader, find_codex_files
+from tools.dictionary_journal import write_json_atomic
+from tools.embedding_tools import source_key
+
+logger = logging.getLogger(__name__)
+
+MINIMUM_CHUNK_LENGTH = 4  # shorter chunks are skipped, as in DataBase.upsert_codex_file
+
+
+def file_signature(path: str) -> List[int]:
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def read_chunks(path: str, verse_chunk_size: int) -> Tuple[str, List[int], List[Tuple[str, str]], str]:
+    """
+    Reads the chunks of one file. Runs in a worker process, so errors are returned rather than raised.
+
+    Returns:
+        (path, signature, chunks, error): chunks are (id, text) pairs; error is None on success.
+    """
+    try:
+        signature = file_signature(path)
+        reader = CodexReader(verse_chunk_size=verse_chunk_size)
+        chunks = [(str(name), str(text)) for name, text in reader.iter_chunks(path) if len(text) > MINIMUM_CHUNK_LENGTH]
+        return path, signature, chunks, None
+    except Exception as error:
+        return path, None, [], f"{type(error).__name__}: {error}"
+
+
+class IndexManifest:
+    """
+    The files an indexing run has finished, with the size and modification time they had.
+
+    A file is finished once all its chunks were upserted and saved. Files that changed since,
+    or were indexed with another chunk size, are indexed again.
+
+    Example Usage:
+        manifest = IndexManifest(database_path + '.index.json', verse_chunk_size=4)
+        if not manifest.is_done(path):
+            ...
+            manifest.mark_done({path: file_signature(path)})
+    """
+    def __init__(self, path: str, verse_chunk_size: int) -> None:
+        self.path = path
+        self.verse_chunk_size = verse_chunk_size
+        self.files: Dict[str, List[int]] = {}
+        self.load()
+
+    def load(self) -> None:
+        try:
+            with open(self.path, 'r') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return
+        if data.get('verse_chunk_size') == self.verse_chunk_size:
+            self.files = {source_key(path): signature for path, signature in data.get('files', {}).items()}
+
+    def save(self) -> None:
+        write_json_atomic(self.path, {'verse_chunk_size': self.verse_chunk_size, 'files': self.files}, indent=None)
+
+    def is_done(self, path: str) -> bool:
+        try:
+            return self.files.get(source_key(path)) == file_signature(path)
+        except OSError:
+            return False
+
+    def mark_done(self, signatures: Dict[str, List[int]]) -> None:
+        for path, signature in signatures.items():
+            self.files[source_key(path)] = signature
+        self.save()
+
+    def clear(self) -> None:
+        self.files = {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def read_all(paths: List[str], verse_chunk_size: int, workers: int) -> Iterator[Tuple[str, List[int], List, str]]:
+    """
+    Yields read_chunks for every path, reading in a process pool when there is more than one worker.
+    """
+    if workers <= 1 or len(paths) <= 1:
+        for path in paths:
+            yield read_chunks(path, verse_chunk_size)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(read_chunks, paths, [verse_chunk_size] * len(paths))
+
+
+def index_project(database, paths: List[str], manifest: IndexManifest, batch_size: int = 256,
+                  workers: int = None) -> Dict[str, int]:
+    """
+    Embeds the chunks of the given files that the manifest doesn't list as done, batch_size chunks per upsert.
+
+    Returns:
+        dict: counts of the files read, skipped and failed, and of the chunks embedded.
+    """
+    workers = workers or os.cpu_count() or 1
+    todo = [path for path in paths if not manifest.is_done(path)]
+    stats = {'files': len(todo), 'skipped': len(paths) - len(todo), 'failed': 0, 'chunks': 0, 'embedded': 0}
+    logger.info("%d files to index, %d already done", len(todo), stats['skipped'])
+
+    batch: Dict[str, List[Tuple[str, str]]] = {}  # path -> its chunks
+    waiting: Dict[str, List[int]] = {}  # signatures of the files in the batch
+    batched = 0
+
+    def flush() -> None:
+        nonlocal batched
+        if batch:
+            stats['embedded'] += database.update_files(batch)  # saves the database
+            batch.clear()
+            batched = 0
+        if waiting:
+            manifest.mark_done(waiting)
+            waiting.clear()
+
+    for done, (path, signature, chunks, error) in enumerate(read_all(todo, manifest.verse_chunk_size, workers), 1):
+        if error is not None:
+            stats['failed'] += 1
+            logger.warning("Could not read %s: %s", path, error)
+            continue
+        batch[path] = chunks
+        waiting[path] = signature
+        batched += len(chunks)
+        stats['chunks'] += len(chunks)
+        if batched >= batch_size:
+            flush()
+            logger.info("%d/%d files, %d chunks embedded", done, len(todo), stats['embedded'])
+    flush()
+    return stats
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Builds the embedding index of a project's drafts")
+    parser.add_argument("project", help="the project folder, the one holding drafts")
+    parser.add_argument("--drafts", default="drafts", help="the folder under the project to index (default: drafts)")
+    parser.add_argument("--database", default=None, help="the database path (default: <project>/<drafts>/database, as the server uses)")
+    parser.add_argument("--workers", type=int, default=None, help="processes reading files (default: the number of CPUs)")
+    parser.add_argument("--batch-size", type=int, default=256, help="chunks per upsert")
+    parser.add_argument("--verse-chunk-size", type=int, default=4, help="verses per chunk")
+    parser.add_argument("--restart", action="store_true", help="ignore the manifest of a previous run")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    drafts = os.path.join(os.path.abspath(args.project), args.drafts)
+    database_path = args.database or os.path.join(drafts, "database")
+    manifest = IndexManifest(database_path + '.index.json', verse_chunk_size=args.verse_chunk_size)
+    if args.restart:
+        manifest.clear()
+
+    paths = find_codex_files(drafts)
+    if not paths:
+        logger.warning("No %s files under %s", CODEX_EXTENSION, drafts)
+        return 1
+
+    from tools.embedding_tools import DataBase  # imports txtai and torch
+    start = time.perf_counter()
+    database = DataBase(database_path, batch_size=args.batch_size)
+    stats = index_project(database, paths, manifest, batch_size=args.batch_size, workers=args.workers)
+    logger.info("Indexed %d files (%d skipped, %d failed): %d chunks, %d embedded in %.1f s",
+                stats['files'] - stats['failed'], stats['skipped'], stats['failed'],
+                stats['chunks'], stats['embedded'], time.perf_counter() - start)
+    return 1 if stats['failed'] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
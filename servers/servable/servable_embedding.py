@@ -1,15 +1,33 @@
+import functools
 import urllib
+import os
+import logging
+from enum import Enum
 from lsprotocol.types import DidCloseTextDocumentParams
+from tools.codex_tools import find_codex_files
 from tools.ls_tools import ServerFunctions
-from tools.embedding_tools import DataBase
+from tools.job_queue import JobQueue
+from tools.search_cache import SearchCache
 from lsprotocol.types import (DocumentDiagnosticParams, CompletionParams, 
     CodeActionParams, Range, CompletionItem, CompletionItemKind, 
     TextEdit, Position, Diagnostic, DiagnosticOptions, CodeAction, WorkspaceEdit, CodeActionKind, Command, DiagnosticSeverity)
 from pygls.server import LanguageServer
 from typing import List
-import time
 from servable.spelling import is_bible_ref
 
+logger = logging.getLogger(__name__)
+
+# seconds a search waits for an update of the index (e.g. a book being embedded) before giving up
+SEARCH_WAIT = 0.05
+
+
+class EMBEDDING_STATE(str, Enum):
+    NOT_LOADED = "not loaded"
+    LOADING = "loading"  # the model and index are loading in the background
+    READY = "ready"
+    FAILED = "failed"
+
+
 def uri_to_filepath(uri):
     # Decode the URL
     decoded_url = urllib.parse.unquote(uri) # TODO: #5 need to make sure we are using the vscode api conventions to use the workspace-relative URI. See line 52 below
@@ -27,40 +45,92 @@ def uri_to_filepath(uri):
 class ServableEmbedding:
     def __init__(self, sf: ServerFunctions):
         self.database = None 
+        self.state = EMBEDDING_STATE.NOT_LOADED
         self.sf = sf
         self.sf.initialize_functions.append(self.initialize)
         self.sf.close_functions.append(self.on_close)
-        self.last_served = []
-        self.time_last_serverd = time.time()
+        self.sf.add_shutdown_function(self.shutdown)
+        self.jobs = JobQueue(server=sf.server, title="Embedding")
+        self.search_cache = None
+        self.rebuild = False # the saved index predates the chunk manifest, see rebuild_index
 
-    def embed_document(self, params, sf):
+    def embed_document(self, params, sf, priority: int = 0):
+        """
+        Queues a .codex file to be embedded in the background; repeated requests for a file are coalesced.
+        """
         path = params[0]['fsPath']
-        if ".codex" in path:
-            sf.server.show_message(message="Embedding document.")
+        if ".codex" in path and self.state != EMBEDDING_STATE.FAILED:
+            # Jobs run in order, so the ones queued while the model loads wait for it
+            self.jobs.submit(path, lambda: self.upsert_document(path), priority=priority, title=os.path.basename(path))
+
+    def upsert_document(self, path: str):
+        if self.is_ready():
             self.database.upsert_codex_file(path=path)
-            sf.server.show_message(message=f"The Codex file '{path}' has been upserted into 'database'")
 
     def on_close(self, ls, params: DidCloseTextDocumentParams, fs):
         path = uri_to_filepath(params.text_document.uri)
         self.embed_document([{'fsPath': path}], fs)
-        ls.show_message("Closed file")
+
+    def shutdown(self, ls, params, sf):
+        self.jobs.shutdown()
+        if self.search_cache is not None:
+            self.search_cache.shutdown()
     
-    def embed_completion(self, server: LanguageServer, params: CompletionParams, range: Range, sf: ServerFunctions) -> List:
+    async def embed_completion(self, server: LanguageServer, params: CompletionParams, range: Range, sf: ServerFunctions) -> List:
         document_uri = params.text_document.uri
         document = server.workspace.get_document(document_uri)
+        if not self.is_ready():
+            return []
         line = document.lines[params.position.line].strip()
-        if time.time() - self.time_last_serverd > 2 or self.last_served == []:
-            if not is_bible_ref(line):
-                result = self.database.search(line, limit=2)
-                if not result:
-                    return []
-                result = [CompletionItem(label=result[0]['text'][:20]+ '...', text_edit=TextEdit(range=range, new_text=f'\nSimilar: \n{str(result[0]["text"])}\n'))]
-                self.last_served = result
-                return result
-        return []
+        if not line or is_bible_ref(line):
+            return []
+        # Cached per line and index generation, so repeated completions on a line return the same item right away
+        try:
+            result = await self.search_cache.search(line, limit=2)
+        except TimeoutError:
+            return []  # the index is being updated; cached results are still served meanwhile
+        if not result:
+            return []
+        return [CompletionItem(label=result[0]['text'][:20]+ '...', text_edit=TextEdit(range=range, new_text=f'\nSimilar: \n{str(result[0]["text"])}\n'))]
+
+    def is_ready(self) -> bool:
+        return self.state == EMBEDDING_STATE.READY
+
+    def load_database(self, path: str):
+        """
+        Loads the model and the saved index. Runs in the job queue's thread.
+        """
+        try:
+            from tools.embedding_tools import DataBase # imports txtai and torch, which alone takes seconds
+            self.database = DataBase(path)
+            self.rebuild = self.database.outdated
+            self.search_cache = SearchCache(functools.partial(self.database.search, wait=SEARCH_WAIT),
+                                            generation=lambda: self.database.generation)
+            self.state = EMBEDDING_STATE.READY
+        except Exception:
+            self.state = EMBEDDING_STATE.FAILED
+            logger.exception("Could not load the embedding model")
+
+    def rebuild_index(self, root: str):
+        """
+        Embeds every .codex file under root again when the saved index was written by an earlier version,
+        whose rows can't be traced to their files. Runs in the job queue's thread, after the files closed meanwhile.
+        """
+        if not self.is_ready() or not self.rebuild:
+            return
+        for path in find_codex_files(root):
+            try:
+                self.database.upsert_codex_file(path=path)
+            except Exception:
+                logger.exception("Could not embed %s", path)
+        self.rebuild = False
 
     def initialize(self, server, params, sf):
-        self.database = DataBase(sf.data_path+"/database")
+        # Load in the background so the other providers serve right away
+        self.state = EMBEDDING_STATE.LOADING
+        path = sf.data_path+"/database"
+        self.jobs.submit("database", lambda: self.load_database(path), priority=1, title="Loading the embedding model")
+        self.jobs.submit("rebuild", lambda: self.rebuild_index(sf.data_path), priority=-1, title="Rebuilding the embedding index")
     
 
         
\ No newline at end of file
@@ -1,38 +1,112 @@
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Tuple
+from lsprotocol.types import Diagnostic, Position, Range, DiagnosticSeverity
+
 try:
     import wildebeest.wb_analysis as analyze
-    from lsprotocol.types import Diagnostic, DiagnosticOptions, DocumentDiagnosticParams, Position, Range, DiagnosticSeverity
-    import time
-
-    last_call_time = 0
-    last_diagnostics = []
-    def wb_line_diagnostic(ls, params: DocumentDiagnosticParams, sf):
-        global last_call_time, last_diagnostics
-        current_time = time.time()
-        
-        # Check if less than 2 seconds have passed since the last call
-        if current_time - last_call_time < 2:
-            return last_diagnostics
-
-        diagnostics = []
-        document_uri = params.text_document.uri
-        if ".codex" in document_uri or ".scripture" in document_uri:
-            document = ls.workspace.get_document(document_uri)
-        
-        lines = document.lines
-        for line_num, line in enumerate(lines):
-            summary = analyze.process(string=line).summary_list_of_issues()
-            if summary:
-                for element in summary:
-                    range = Range(start=Position(line=line_num, character=0),
-                                        end=Position(line=line_num, character=len(line)))
-                    diagnostics.append(Diagnostic(range=range, message=str(element), severity=DiagnosticSeverity.Error, source='Wildebeest'))
-        
-        # Update the last call time
-        last_call_time = current_time
-        last_diagnostics = diagnostics
-        return diagnostics
 except ImportError:
-    from lsprotocol.types import Diagnostic, DiagnosticOptions, DocumentDiagnosticParams, Position, Range, DiagnosticSeverity
-    import time
-    def wb_line_diagnostic(ls, params: DocumentDiagnosticParams, sf):
-        return []
\ No newline at end of file
+    analyze = None
+
+# Printable ASCII lines can't mix scripts, hold control characters or non-canonical combinations;
+# the only Wildebeest issue they can raise is an XML escape token such as '&amp;'
+ASCII_LINE = re.compile(r'[\x20-\x7E]*\r?\n?\Z')
+
+
+def may_have_issues(line: str) -> bool:
+    """
+    Cheap character-class check: False if Wildebeest cannot report anything for the line.
+    """
+    if ASCII_LINE.match(line):
+        return '&' in line and ';' in line
+    return True
+
+
+def wb_issues(lines: List[str]) -> List[List[str]]:
+    """
+    Runs the Wildebeest analysis on each line. Module level so process pools can pickle it.
+    """
+    return [analyze.process(string=line).summary_list_of_issues() for line in lines]
+
+
+def issue_diagnostics(line_num: int, line: str, issues: List[str]) -> List[Diagnostic]:
+    diagnostics = []
+    for element in issues:
+        range = Range(start=Position(line=line_num, character=0),
+                            end=Position(line=line_num, character=len(line)))
+        diagnostics.append(Diagnostic(range=range, message=str(element), severity=DiagnosticSeverity.Error, source='Wildebeest'))
+    return diagnostics
+
+
+class WildebeestAnalyzer:
+    """
+    Wildebeest analysis of document lines.
+
+    Lines that can't raise an issue are skipped (see may_have_issues) and results are memoized by
+    line content with an LRU bound.
+
+    Attributes:
+        memo_size (int): How many distinct lines to remember.
+    """
+    def __init__(self, memo_size: int = 20000) -> None:
+        self.memo: OrderedDict = OrderedDict()
+        self.memo_size = memo_size
+        self.lock = threading.Lock()  # batches may run in several threads
+
+    def remember(self, line: str, issues: List[str]) -> None:
+        self.memo[line] = issues
+        self.memo.move_to_end(line)
+        if len(self.memo) > self.memo_size:
+            self.memo.popitem(last=False)
+
+    def issues_many(self, lines: List[str]) -> List[List[str]]:
+        """
+        Returns the Wildebeest issues of each line.
+        """
+        results = [None] * len(lines)
+        misses = {}  # line -> positions, so repeated lines are analyzed once
+        with self.lock:
+            for i, line in enumerate(lines):
+                if analyze is None or not may_have_issues(line):
+                    results[i] = []
+                elif line in self.memo:
+                    self.memo.move_to_end(line)
+                    results[i] = self.memo[line]
+                else:
+                    misses.setdefault(line, []).append(i)
+
+        if misses:
+            texts = list(misses)
+            issues = wb_issues(texts)
+            with self.lock:
+                for line, line_issues in zip(texts, issues):
+                    self.remember(line, line_issues)
+                    for i in misses[line]:
+                        results[i] = line_issues
+        return results
+
+    def line_diagnostic(self, line_num: int, line: str) -> List[Diagnostic]:
+        return issue_diagnostics(line_num, line, self.issues_many([line])[0])
+
+    def line_diagnostics(self, lines: List[Tuple[int, str]]) -> List[List[Diagnostic]]:
+        """
+        Batch form of line_diagnostic for (line_num, line) pairs.
+        """
+        issues = self.issues_many([line for _, line in lines])
+        return [issue_diagnostics(line_num, line, line_issues) for (line_num, line), line_issues in zip(lines, issues)]
+
+
+# One analyzer per process: registered with EXECUTION.PROCESS, each worker keeps its own memo across batches
+analyzer = WildebeestAnalyzer()
+
+
+def wb_line_diagnostic(line_num: int, line: str) -> List[Diagnostic]:
+    return analyzer.line_diagnostic(line_num, line)
+
+
+def wb_line_diagnostics(lines: List[Tuple[int, str]]) -> List[List[Diagnostic]]:
+    """
+    Batch form of wb_line_diagnostic. Module level so process pools can pickle it.
+    """
+    return analyzer.line_diagnostics(lines)
@@ -1,12 +1,20 @@
 from typing import List
+import asyncio
+import logging
+import os
 import re
+import string
 from enum import Enum
-from tools.spell_check import Dictionary, SpellCheck
-from tools.ls_tools import ServerFunctions
+from tools.spell_check import SpellCheck, SUGGESTION_ENGINE, remove_punctuation
+from tools.dictionary_set import DictionarySet, find_dictionaries
+from tools.ls_tools import ServerFunctions, is_scripture_document
 from lsprotocol.types import (DocumentDiagnosticParams, CompletionParams, 
     CodeActionParams, Range, CompletionItem, 
     TextEdit, Position, Diagnostic, CodeAction, WorkspaceEdit, CodeActionKind, Command, DiagnosticSeverity)
 from pygls.server import LanguageServer
+from pygls.uris import to_fs_path
+
+logger = logging.getLogger(__name__)
 
 
 class SPELLING_MESSAGE(Enum):
@@ -25,24 +33,36 @@ def is_bible_ref(text: str)-> bool:
     return bool(match)
 
 class ServableSpelling:
-    def __init__(self, sf: ServerFunctions, relative_checking=False):
+    def __init__(self, sf: ServerFunctions, relative_checking=False, engine: SUGGESTION_ENGINE = SUGGESTION_ENGINE.HASH,
+                 poll_interval: float = 2, discover_interval: float = 60):
         self.dictionary = None 
         self.spell_check = None
         self.relative_checking = relative_checking
+        self.engine = engine
+        self.poll_interval = poll_interval # seconds between checks of the .dictionary files if the client can't watch them
+        self.discover_interval = discover_interval # seconds between searches for new .dictionary files when polling
+        self.poll_task = None
         self.sf = sf
         self.sf.initialize_functions.append(self.initialize)
+        self.sf.add_shutdown_function(self.shutdown)
+        self.sf.add_watched_files('**/*.dictionary', self.on_dictionary_files_changed)
 
     def spell_completion(self, server: LanguageServer, params: CompletionParams, range: Range, sf: ServerFunctions) -> List:
         try:
             document_uri = params.text_document.uri
             document = server.workspace.get_document(document_uri)
             line = document.lines[params.position.line]
-            word = line.strip().split(" ")[-1]
+            word = line[:params.position.character].split(" ")[-1].lstrip(string.punctuation)
             if self.spell_check is not None:
                 completions = self.spell_check.complete(word=word)
+                # the completions are whole headwords, replacing the word typed so far
+                word_range = Range(start=Position(line=params.position.line, character=params.position.character - len(word)),
+                                   end=params.position)
                 return [CompletionItem(
-                    label=word+completion,
-                    text_edit=TextEdit(range=range, new_text=completion),
+                    label=completion,
+                    filter_text=remove_punctuation(completion),
+                    text_edit=TextEdit(range=word_range, new_text=completion),
+                    command=Command('Record Usage', command='pygls.server.record_usage', arguments=[[completion]]),
                     ) for completion in completions]
             else:
                 return []
@@ -52,28 +72,35 @@ class ServableSpelling:
     def spell_diagnostic(self, ls: LanguageServer, params: DocumentDiagnosticParams, sf: ServerFunctions) -> List[Diagnostic]:
         diagnostics: List[Diagnostic] = []
         document_uri = params.text_document.uri
-        if ".codex" in document_uri or ".scripture" in document_uri:
-            document = ls.workspace.get_document(document_uri)
-        lines = document.lines
-        for line_num, line in enumerate(lines):
-            words = line.split(" ")
-            edit_window = 0
-
-            for word in words:
-                if self.spell_check and self.spell_check.is_correction_needed(word):
-                    start_char = edit_window
-                    end_char = start_char + len(word)
-                    
-                    range = Range(start=Position(line=line_num, character=start_char),
-                                end=Position(line=line_num, character=end_char))
-                    diagnostics.append(Diagnostic(range=range, message=SPELLING_MESSAGE.TYPO.value, severity=DiagnosticSeverity.Warning, source='Spell-Check'))
+        if not is_scripture_document(document_uri):
+            return diagnostics
+        document = ls.workspace.get_document(document_uri)
+        for line_num, line in enumerate(document.lines):
+            diagnostics.extend(self.spell_line_diagnostic(line_num, line))
+        return diagnostics
+
+    def spell_line_diagnostic(self, line_num: int, line: str) -> List[Diagnostic]:
+        diagnostics: List[Diagnostic] = []
+        if self.spell_check is None:
+            return diagnostics
+        words = line.split(" ")
+        edit_window = 0
+
+        for word in words:
+            if self.spell_check.is_correction_needed(word):
+                start_char = edit_window
+                end_char = start_char + len(word)
                 
-                # Add one if the next character is whitespace
-                if edit_window + len(word) < len(line) and line[edit_window + len(word)] == ' ':
-                    edit_window += len(word) + 1
-                else:
-                    edit_window += len(word)
-        return diagnostics 
+                range = Range(start=Position(line=line_num, character=start_char),
+                            end=Position(line=line_num, character=end_char))
+                diagnostics.append(Diagnostic(range=range, message=SPELLING_MESSAGE.TYPO.value, severity=DiagnosticSeverity.Warning, source='Spell-Check'))
+            
+            # Add one if the next character is whitespace
+            if edit_window + len(word) < len(line) and line[edit_window + len(word)] == ' ':
+                edit_window += len(word) + 1
+            else:
+                edit_window += len(word)
+        return diagnostics
     
     def spell_action(self, ls: LanguageServer, params: CodeActionParams, range: Range, sf: ServerFunctions) -> List[CodeAction]:
         document_uri = params.text_document.uri
@@ -90,10 +117,7 @@ class ServableSpelling:
                 start_character = diagnostic.range.start.character
                 end_character = diagnostic.range.end.character
                 word = document.lines[start_line][start_character:end_character]
-                try:
-                    corrections = self.spell_check.check(word)
-                except IndexError:
-                    corrections = []
+                corrections = self.spell_check.check(word)
                 if is_bible_ref(document.lines[start_line]):
                     return []
                 for correction in corrections:
@@ -103,7 +127,8 @@ class ServableSpelling:
                         title=SPELLING_MESSAGE.REPLACE_WORD.value.format(word=word, correction=correction),
                         kind=CodeActionKind.QuickFix,
                         diagnostics=[diagnostic],
-                        edit=WorkspaceEdit(changes={document_uri: [edit]}))
+                        edit=WorkspaceEdit(changes={document_uri: [edit]}),
+                        command=Command('Record Usage', command='pygls.server.record_usage', arguments=[[correction]]))
                     
                     actions.append(action)
 
@@ -127,10 +152,53 @@ class ServableSpelling:
     
     def add_dictionary(self, args):
         args = args[0]
-        for word in args:
-            self.dictionary.define(word)
+        self.dictionary.define_many(args)
+        self.sf.invalidate_line_diagnostics(self.spell_line_diagnostic)
         self.sf.server.show_message("Dictionary updated.")
 
+    def record_usage(self, args):
+        """
+        counts a use of the words of an accepted completion or correction, which ranks them higher in completions
+        """
+        if self.dictionary is not None:
+            self.dictionary.use_many(args[0])
+
     def initialize(self, params, server: LanguageServer, sf):
-        self.dictionary = Dictionary(self.sf.data_path)
-        self.spell_check = SpellCheck(dictionary=self.dictionary, relative_checking=self.relative_checking)
\ No newline at end of file
+        self.dictionary = DictionarySet(self.sf.data_path, journal=True, binary=True)
+        self.spell_check = SpellCheck(dictionary=self.dictionary, relative_checking=self.relative_checking, engine=self.engine)
+        self.sf.invalidate_line_diagnostics(self.spell_line_diagnostic)
+        if not self.sf.watches_files(self.sf.server):
+            self.poll_task = asyncio.ensure_future(self.poll_dictionaries())
+
+    def refresh_dictionaries(self, paths=None):
+        if self.dictionary is not None and self.dictionary.refresh(paths):
+            self.sf.invalidate_line_diagnostics(self.spell_line_diagnostic)
+
+    def on_dictionary_files_changed(self, ls: LanguageServer, params, sf: ServerFunctions):
+        root = os.path.normpath(self.sf.data_path)
+        paths = [to_fs_path(change.uri) for change in params.changes]
+        self.refresh_dictionaries([path for path in paths if path and os.path.normpath(path).startswith(root)])
+
+    async def poll_dictionaries(self):
+        """
+        Checks the known .dictionary files every poll_interval and looks for new ones every discover_interval,
+        walking the drafts directory in a thread so a large project doesn't block the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        discovered = loop.time()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                paths = list(self.dictionary.members)
+                if loop.time() - discovered >= self.discover_interval:
+                    paths.extend(await loop.run_in_executor(None, find_dictionaries, self.dictionary.root))
+                    discovered = loop.time()
+                self.refresh_dictionaries(paths)
+            except Exception:
+                logger.exception("Could not refresh the dictionaries")
+
+    def shutdown(self, ls, params, sf):
+        if self.poll_task is not None:
+            self.poll_task.cancel()
+        if self.dictionary is not None:
+            self.dictionary.close()
\ No newline at end of file
@@ -2,39 +2,55 @@ import subprocess
 import os
 
 
-try:
-    from pygls.server import LanguageServer
-    from tools.ls_tools import ServerFunctions
-    from servable.spelling import ServableSpelling
-    from servable.servable_wb import wb_line_diagnostic
-    from servable.servable_embedding import ServableEmbedding
-except ImportError:
-
-    script_directory = os.path.dirname(os.path.abspath(__file__))
-    requirements_file = os.path.join(script_directory, "requirements.txt")
-    subprocess.check_call(["pip", "install", "--break-system-packages", "-r", requirements_file])
-    
-    exit()
+def main():
+    # Everything is set up here rather than at import: spawned worker processes (EXECUTION.PROCESS)
+    # import this file again as __mp_main__ and must not build a second server.
+    try:
+        from pygls.server import LanguageServer
+        from tools.ls_tools import ServerFunctions, is_scripture_document
+        from tools.providers import EXECUTION
+        from servable.spelling import ServableSpelling
+        from tools.spell_check import SUGGESTION_ENGINE
+        from servable.servable_wb import wb_line_diagnostic, wb_line_diagnostics
+        from servable.servable_embedding import ServableEmbedding
+    except ImportError:
+
+        script_directory = os.path.dirname(os.path.abspath(__file__))
+        requirements_file = os.path.join(script_directory, "requirements.txt")
+        subprocess.check_call(["pip", "install", "--break-system-packages", "-r", requirements_file])
+        
+        exit()
    
-server = LanguageServer("code-action-server", "v0.1") # TODO: #1 Dynamically populate metadata from package.json?
+    server = LanguageServer("code-action-server", "v0.1") # TODO: #1 Dynamically populate metadata from package.json?
 
-server_functions = ServerFunctions(server=server, data_path='/drafts')
-spelling = ServableSpelling(sf=server_functions, relative_checking=True)
-embedding = ServableEmbedding(sf=server_functions)
+    # COPILOT_METRICS_INTERVAL=<seconds> appends the handler metrics to drafts/metrics.jsonl that often
+    metrics_interval = float(os.environ.get('COPILOT_METRICS_INTERVAL', 0)) or None
+    server_functions = ServerFunctions(server=server, data_path='/drafts', metrics_interval=metrics_interval)
+    spelling = ServableSpelling(sf=server_functions, relative_checking=True, engine=SUGGESTION_ENGINE.COMBINED)
+    embedding = ServableEmbedding(sf=server_functions)
 
-server_functions.add_completion(spelling.spell_completion)
-server_functions.add_completion(embedding.embed_completion)
+    server_functions.add_completion(spelling.spell_completion)
+    server_functions.add_completion(embedding.embed_completion)
 
-server_functions.add_diagnostic(spelling.spell_diagnostic)
-server_functions.add_diagnostic(wb_line_diagnostic)
-server_functions.add_action(spelling.spell_action)
+    server_functions.add_line_diagnostic(spelling.spell_line_diagnostic, document_filter=is_scripture_document)
+    server_functions.add_line_diagnostic(wb_line_diagnostic, document_filter=is_scripture_document,
+                                         execution=EXECUTION.PROCESS, deadline=5, batch=wb_line_diagnostics)
+    server_functions.add_action(spelling.spell_action)
 
-def add_dictionary(args):
-    return spelling.add_dictionary(args)
+    def add_dictionary(args):
+        return spelling.add_dictionary(args)
 
-server.command("pygls.server.add_dictionary")(add_dictionary)
+    server.command("pygls.server.add_dictionary")(add_dictionary)
+
+    def record_usage(args):
+        return spelling.record_usage(args)
+
+    server.command("pygls.server.record_usage")(record_usage)
 
-if __name__ == "__main__":
     print('running:')
     server_functions.start()
     server.start_io()
+
+
+if __name__ == "__main__":
+    main()
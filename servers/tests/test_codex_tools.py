@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+from tools.codex_tools import iter_cells
+
+NOTEBOOK = {
+    'version': 12345,
+    'cells': [
+        {'kind': 1, 'language': 'markdown', 'value': '# Chapter 1', 'metadata': {'index': 10}},
+        {'kind': 2, 'language': 'scripture', 'value': 'GEN 1:1 In the beginning\nGEN 1:2 And the earth',
+         'metadata': {'type': 'chapter-heading', 'score': -1.25e-3, 'flags': [True, False, None]}},
+        {'kind': 2, 'language': 'scripture', 'value': 'GEN 2:1 Thus the heavens', 'metadata': {}},
+    ],
+    'ratio': 1.5e10,
+    'metadata': {'count': 987654321},
+}
+
+
+def write(tmp_path, text: str) -> str:
+    path = tmp_path / 'book.codex'
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+def test_cells(tmp_path):
+    assert list(iter_cells(write(tmp_path, json.dumps(NOTEBOOK)))) == NOTEBOOK['cells']
+
+
+@pytest.mark.parametrize("text", ['{}', '{"cells": []}', ' { "cells" : [ ] , "x" : 1 } '])
+def test_empty_notebooks(tmp_path, text):
+    assert list(iter_cells(write(tmp_path, text))) == []
+
+
+def test_truncated_file_raises(tmp_path):
+    path = write(tmp_path, json.dumps(NOTEBOOK)[:-20])
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_cells(path))
+
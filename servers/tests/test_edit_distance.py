@@ -0,0 +1,51 @@
+import random
+
+import pytest
+
+from tools.edit_distance import distance, distances
+
+ALPHABET = "abcdeनमस्ते"
+
+
+def random_string(rng, max_length=12):
+    return ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(0, max_length)))
+
+
+@pytest.mark.parametrize("query, candidate, expected", [
+    ("", "", 0),
+    ("", "abc", 3),
+    ("abc", "", 3),
+    ("top", "tob", 1),
+    ("kitten", "sitting", 3),
+    ("beginning", "begining", 1),
+])
+def test_known_distances(query, candidate, expected):
+    assert distance(query, candidate) == expected
+    assert distances(query, [candidate]) == [expected]
+
+
+def test_matches_the_matrix_implementation():
+    rng = random.Random(0)
+    for _ in range(2000):
+        query = random_string(rng)
+        candidates = [random_string(rng) for _ in range(20)]
+        assert distances(query, candidates) == [distance(query, candidate) for candidate in candidates]
+
+
+@pytest.mark.parametrize("max_distance", [0, 1, 2, 3])
+def test_max_distance_caps_the_result(max_distance):
+    rng = random.Random(max_distance)
+    for _ in range(500):
+        query = random_string(rng)
+        candidates = [random_string(rng) for _ in range(20)]
+        expected = [min(distance(query, candidate), max_distance + 1) for candidate in candidates]
+        assert distances(query, candidates, max_distance=max_distance) == expected
+
+
+def test_long_queries():
+    # wider than a machine word, the masks are plain Python ints
+    rng = random.Random(1)
+    for _ in range(50):
+        query = random_string(rng, 80)
+        candidates = [random_string(rng, 80) for _ in range(5)]
+        assert distances(query, candidates) == [distance(query, candidate) for candidate in candidates]
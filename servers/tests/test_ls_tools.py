@@ -0,0 +1,37 @@
+import asyncio
+
+from lsprotocol.types import Diagnostic, Position, Range, TextDocumentItem
+from pygls.server import LanguageServer
+from pygls.workspace import Workspace
+
+from tools.ls_tools import ServerFunctions
+
+
+def test_invalidation_pushes_the_open_documents_again():
+    known = {'in', 'the'}
+
+    def unknown_words(line_num, line):
+        return [Diagnostic(range=Range(start=Position(line=line_num, character=0), end=Position(line=line_num, character=0)),
+                           message=word) for word in line.split() if word not in known]
+
+    server = LanguageServer('test-server', 'v0')
+    server.lsp._workspace = Workspace(None)
+    server.workspace.put_text_document(TextDocumentItem(uri='file:///GEN.codex', language_id='scripture', version=3,
+                                                        text='in the beginning\n'))
+    published = []
+    server.publish_diagnostics = lambda uri, diagnostics, version=None: published.append(
+        (uri, version, [diagnostic.message for diagnostic in diagnostics]))
+    sf = ServerFunctions(server, data_path='/drafts', diagnostic_delay=0)
+    sf.add_line_diagnostic(unknown_words)
+
+    async def invalidate():
+        sf.invalidate_line_diagnostics(unknown_words)
+        await asyncio.gather(*sf.scheduler.tasks.values())
+
+    asyncio.run(invalidate())
+    assert published == [('file:///GEN.codex', 3, ['beginning'])]
+
+    # a word added to the dictionary disappears from the pushed diagnostics
+    known.add('beginning')
+    asyncio.run(invalidate())
+    assert published[-1] == ('file:///GEN.codex', 3, [])
@@ -0,0 +1,56 @@
+import random
+import string
+
+from tools.prefix_index import PrefixIndex
+
+
+def brute_force(frequencies, prefix, limit):
+    matches = [word for word in frequencies if word.startswith(prefix) and word != prefix]
+    return sorted(matches, key=lambda word: (-frequencies[word], len(word), word))[:limit]
+
+
+def test_example():
+    index = PrefixIndex()
+    index.add('beginning')
+    index.add('begat')
+    index.set_frequency('begat', 3)
+    assert index.complete('beg') == ['begat', 'beginning']
+
+
+def test_complete_matches_brute_force():
+    rng = random.Random(0)
+    index = PrefixIndex()
+    frequencies = {}
+    for _ in range(2000):
+        word = ''.join(rng.choice(string.ascii_lowercase[:5]) for _ in range(rng.randint(1, 8)))
+        frequency = rng.randint(0, 20)
+        if word not in frequencies:
+            frequencies[word] = frequency
+        index.add(word, frequency)
+    for _ in range(300):
+        prefix = ''.join(rng.choice(string.ascii_lowercase[:5]) for _ in range(rng.randint(0, 4)))
+        limit = rng.randint(1, 10)
+        assert index.complete(prefix, limit) == brute_force(frequencies, prefix, limit)
+
+
+def test_changes_invalidate_cached_completions():
+    rng = random.Random(1)
+    index = PrefixIndex()
+    frequencies = {}
+    prefixes = ['', 'a', 'ab', 'abc', 'b']
+    for step in range(1000):
+        word = ''.join(rng.choice('abc') for _ in range(rng.randint(1, 5)))
+        action = rng.random()
+        if action < 0.5:
+            frequencies.setdefault(word, step % 7)
+            index.add(word, step % 7)
+        elif action < 0.75:
+            frequencies.pop(word, None)
+            index.remove(word)
+        elif word in frequencies:
+            frequencies[word] = step % 11
+            index.set_frequency(word, step % 11)
+        prefix = rng.choice(prefixes)
+        limit = rng.choice([1, 3, 5, 8])  # a cached longer list answers shorter limits
+        assert index.complete(prefix, limit) == brute_force(frequencies, prefix, limit)
+    assert len(index) == len(frequencies)
@@ -0,0 +1,62 @@
+import os
+import queue
+import runpy
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from bench.lsp_session import file_uri, read_message, write_message
+
+SERVERS_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def read_messages(stream, messages: queue.Queue) -> None:
+    message = read_message(stream)
+    while message is not None:
+        messages.put(message)
+        message = read_message(stream)
+
+
+def test_importing_the_server_builds_nothing():
+    # what a spawned worker process does with the main module
+    namespace = runpy.run_path(os.path.join(SERVERS_DIRECTORY, 'server.py'), run_name='__mp_main__')
+    assert 'server' not in namespace and callable(namespace['main'])
+
+
+def test_wildebeest_diagnostics_from_the_process_pool(tmp_path):
+    # server.py runs Wildebeest with EXECUTION.PROCESS: its spawned workers import server.py again as __mp_main__
+    pytest.importorskip('wildebeest.wb_analysis')
+    (tmp_path / 'drafts').mkdir()
+    uri = file_uri(str(tmp_path / 'drafts' / 'GEN.codex'))
+    environment = dict(os.environ, COPILOT_EMBEDDING_BACKEND='stub')
+    process = subprocess.Popen([sys.executable, 'server.py'], cwd=SERVERS_DIRECTORY, env=environment,
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    messages = queue.Queue()
+    threading.Thread(target=read_messages, args=(process.stdout, messages), daemon=True).start()
+    try:
+        write_message(process.stdin, {'jsonrpc': '2.0', 'id': 1, 'method': 'initialize', 'params': {
+            'processId': None, 'rootUri': file_uri(str(tmp_path)), 'capabilities': {}}})
+        write_message(process.stdin, {'jsonrpc': '2.0', 'method': 'initialized', 'params': {}})
+        write_message(process.stdin, {'jsonrpc': '2.0', 'method': 'textDocument/didOpen', 'params': {'textDocument': {
+            'uri': uri, 'languageId': 'scripture', 'version': 1,
+            'text': 'GEN 1:1 In the beginning\nGEN 1:2 the earth &amp; the heavens\n'}}})
+
+        deadline = time.monotonic() + 60
+        wildebeest = []
+        while not wildebeest:
+            message = messages.get(timeout=max(0.0, deadline - time.monotonic()))
+            if message.get('method') == 'textDocument/publishDiagnostics' and message['params']['uri'] == uri:
+                wildebeest = [diagnostic for diagnostic in message['params']['diagnostics']
+                              if diagnostic.get('source') == 'Wildebeest']
+        assert {diagnostic['range']['start']['line'] for diagnostic in wildebeest} == {1}
+
+        write_message(process.stdin, {'jsonrpc': '2.0', 'id': 2, 'method': 'shutdown', 'params': None})
+        write_message(process.stdin, {'jsonrpc': '2.0', 'method': 'exit', 'params': None})
+        process.wait(timeout=30)
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+import expirements.hash_check as hash_check
+from tools.spell_check import SUGGESTION_ENGINE, Dictionary, SpellCheck
+
+
+@pytest.fixture(autouse=True)
+def default_font(monkeypatch):
+    # the unifont file is not part of the repository, hash with PIL's default font instead
+    monkeypatch.setattr(hash_check, 'spell_hash', lambda text, *args, **kwargs: hash_check.get_hasher(None).hash(text))
+    monkeypatch.setattr(hash_check, 'spell_hash_many',
+                        lambda words, *args, **kwargs: {word: hash_check.get_hasher(None).hash(word) for word in words})
+
+
+def write_dictionary(path, words):
+    entries = [{'headWord': word, 'id': str(i), 'hash': str(hash_check.spell_hash(word))} for i, word in enumerate(words)]
+    (path / 'project.dictionary').write_text(json.dumps({'entries': entries}))
+    return Dictionary(str(path))
+
+
+@pytest.mark.parametrize("engine", [SUGGESTION_ENGINE.SYMSPELL, SUGGESTION_ENGINE.COMBINED])
+def test_check_suggests_close_words(tmp_path, engine):
+    spell_check = SpellCheck(write_dictionary(tmp_path, ['beginning', 'earth', 'heaven']), engine=engine)
+    assert spell_check.check('begining')[0] == 'beginning'
+    assert spell_check.check('earth') == ['earth']
+
+
+def test_check_without_close_words(tmp_path):
+    spell_check = SpellCheck(write_dictionary(tmp_path, ['beginning', 'earth']), engine=SUGGESTION_ENGINE.SYMSPELL)
+    assert spell_check.check('xyzzyq') == []
+
+
+@pytest.mark.parametrize("engine", list(SUGGESTION_ENGINE))
+def test_check_with_an_empty_dictionary(tmp_path, engine):
+    spell_check = SpellCheck(Dictionary(str(tmp_path)), engine=engine)
+    assert spell_check.check('wrod') == []
+
+
+def test_complete_returns_whole_headwords(tmp_path):
+    spell_check = SpellCheck(write_dictionary(tmp_path, ["o'clock", 'begat', 'beginning']))
+    assert spell_check.complete('oc') == ["o'clock"]
+    assert spell_check.complete("o'c") == ["o'clock"]
+    assert spell_check.complete('Beg') == ['Begat', 'Beginning']
+
+
+def test_used_words_rank_first(tmp_path):
+    dictionary = write_dictionary(tmp_path, ['begat', 'beginning'])
+    spell_check = SpellCheck(dictionary)
+    assert spell_check.complete('beg') == ['begat', 'beginning']
+    assert dictionary.use_many(['beginning', 'Beginning', 'unknown']) == ['beginning']
+    assert spell_check.complete('beg') == ['beginning', 'begat']
+    assert dictionary.frequency('beginning') == 2
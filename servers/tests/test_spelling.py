@@ -0,0 +1,46 @@
+import asyncio
+import json
+
+import pytest
+from pygls.server import LanguageServer
+
+import expirements.hash_check as hash_check
+import servable.spelling as spelling_module
+from servable.spelling import ServableSpelling
+from tools.dictionary_set import DictionarySet, find_dictionaries
+from tools.ls_tools import ServerFunctions
+from tools.spell_check import SpellCheck
+
+
+def write_dictionary(path, words):
+    hasher = hash_check.get_hasher(None)  # the unifont file is not part of the repository
+    entries = [{'headWord': word, 'id': word, 'hash': str(hasher.hash(word))} for word in words]
+    path.write_text(json.dumps({'entries': entries}))
+
+
+def test_polling_checks_known_files_and_rarely_looks_for_new_ones(tmp_path, monkeypatch):
+    walks = []
+    monkeypatch.setattr(spelling_module, 'find_dictionaries', lambda root: walks.append(root) or find_dictionaries(root))
+    write_dictionary(tmp_path / 'project.dictionary', ['alpha'])
+    spelling = ServableSpelling(ServerFunctions(LanguageServer('test-server', 'v0'), data_path=str(tmp_path)),
+                                poll_interval=0.01, discover_interval=0.5)
+    spelling.dictionary = DictionarySet(str(tmp_path))
+    spelling.spell_check = SpellCheck(spelling.dictionary)
+
+    async def poll():
+        task = asyncio.ensure_future(spelling.poll_dictionaries())
+        try:
+            write_dictionary(tmp_path / 'names.dictionary', ['gamma'])
+            write_dictionary(tmp_path / 'project.dictionary', ['alpha', 'beta'])
+            await asyncio.sleep(0.2)
+            # a known file is picked up on the next tick, a new one has to wait for the next search
+            assert spelling.dictionary.is_known('beta')
+            assert not spelling.dictionary.is_known('gamma') and walks == []
+            await asyncio.sleep(0.6)
+            assert spelling.dictionary.is_known('gamma') and walks == [str(tmp_path)]
+        finally:
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+    asyncio.run(poll())
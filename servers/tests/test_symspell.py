@@ -0,0 +1,83 @@
+import random
+import string
+
+import pytest
+
+from tools.edit_distance import distance
+from tools.symspell import SymSpellIndex
+
+
+def make_words(rng, count):
+    words = set()
+    while len(words) < count:
+        words.add(''.join(rng.choice(string.ascii_lowercase[:8]) for _ in range(rng.randint(1, 10))))
+    return sorted(words)
+
+
+def brute_force(words, query, max_distance):
+    suggestions = [(word, distance(query, word)) for word in words]
+    return sorted((suggestion for suggestion in suggestions if suggestion[1] <= max_distance),
+                  key=lambda suggestion: (suggestion[1], suggestion[0]))
+
+
+def test_example():
+    index = SymSpellIndex(max_distance=2)
+    index.add('beginning')
+    assert index.lookup('begining') == [('beginning', 1)]
+
+
+@pytest.mark.parametrize("max_distance, prefix_length", [(1, 7), (2, 7), (2, 4), (3, 10)])
+def test_lookup_matches_brute_force(max_distance, prefix_length):
+    rng = random.Random(max_distance * 100 + prefix_length)
+    words = make_words(rng, 500)
+    index = SymSpellIndex(max_distance=max_distance, prefix_length=prefix_length)
+    for word in words:
+        index.add(word)
+    for _ in range(100):
+        query = rng.choice(words) if rng.random() < 0.3 else ''.join(
+            rng.choice(string.ascii_lowercase[:8]) for _ in range(rng.randint(1, 11)))
+        assert index.lookup(query, limit=len(words)) == brute_force(words, query, max_distance)
+
+
+def test_lookup_with_a_smaller_max_distance():
+    rng = random.Random(7)
+    words = make_words(rng, 300)
+    index = SymSpellIndex(max_distance=2)
+    for word in words:
+        index.add(word)
+    for query in words[:50]:
+        assert index.lookup(query[::-1], limit=len(words), max_distance=1) == brute_force(words, query[::-1], 1)
+
+
+def test_limit():
+    index = SymSpellIndex(max_distance=2)
+    for word in ['cat', 'bat', 'hat', 'rat', 'cast']:
+        index.add(word)
+    assert index.lookup('cat', limit=3) == [('cat', 0), ('bat', 1), ('cast', 1)]
+
+
+def test_reference_counts():
+    index = SymSpellIndex(max_distance=2)
+    index.add('word')
+    index.add('word')
+    index.remove('word')
+    assert 'word' in index
+    assert index.lookup('wrd') == [('word', 1)]
+    index.remove('word')
+    assert 'word' not in index
+    assert index.lookup('wrd') == []
+    assert index.deletes == {}
+
+
+def test_remove_keeps_the_other_words():
+    rng = random.Random(3)
+    words = make_words(rng, 300)
+    index = SymSpellIndex(max_distance=2)
+    for word in words:
+        index.add(word)
+    removed, kept = words[::2], words[1::2]
+    for word in removed:
+        index.remove(word)
+    assert len(index) == len(kept)
+    for query in words[:100]:
+        assert index.lookup(query, limit=len(words)) == brute_force(kept, query, 2)
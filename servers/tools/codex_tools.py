@@ -1,5 +1,44 @@
+import functools
 import json
+import os
 import re
+from typing import Iterator, List, Tuple
+
+# Compiled once instead of for every cell
+MARKER = re.compile(r'([A-Z]+) \d+:\d+')
+ANY_MARKER = re.compile(r'(\w+ \d+:\d+)')
+VERSE_INFO = re.compile(r'([A-Z]+) (\d+:\d+)')
+MARKER_TEXT = re.compile(r'[A-Z]+\s\d+:\d+\n?')
+
+
+@functools.lru_cache(maxsize=256)
+def marker_pattern(marker: str) -> re.Pattern:
+    """
+    The pattern splitting a cell on the verse markers of one book, e.g. 'GEN 1:1'.
+    """
+    return re.compile(f'({re.escape(marker)} \\d+:\\d+)')
+
+
+CODEX_EXTENSION = '.codex'
+
+
+def find_codex_files(root: str) -> List[str]:
+    """
+    Returns the paths of the .codex files under root.
+    """
+    paths = []
+    for directory, _, files in os.walk(root):
+        paths.extend(os.path.join(directory, name) for name in files if name.endswith(CODEX_EXTENSION))
+    return sorted(paths)
+
+
+def iter_cells(filename: str) -> Iterator[dict]:
+    """
+    Yields the cells of a notebook file.
+    """
+    with open(filename, 'r', encoding='utf-8') as file:
+        document = json.load(file)
+    yield from document.get('cells', [])
 
 
 class CodexReader:
@@ -27,6 +66,9 @@ class CodexReader:
 
         get_embed_format(filename: str) -> list:
             Retrieves the embedded format of chapters and verse chunks from the Codex file.
+
+        iter_chunks(filename: str) -> Iterator[Tuple[str, str]]:
+            Streams the (chunk_name, text) verse chunks of a Codex file, as get_embed_format returns them.
     """
     def __init__(self, verse_chunk_size=4):
         self.verse_chunk_size = verse_chunk_size
@@ -53,18 +95,18 @@ class CodexReader:
         return {"chapters": chapters}
 
     def split_verses(self, scripture_text):
-        marker_match = re.search(r'([A-Z]+) \d+:\d+', scripture_text)
+        marker_match = MARKER.search(scripture_text)
         if marker_match:
             marker = marker_match.group(1)
             # Split the verses and keep the markers
-            parts = re.split(f'({marker} \\d+:\\d+)', scripture_text)
+            parts = marker_pattern(marker).split(scripture_text)
             # Re-combine markers with verses
             verses = [parts[i] + parts[i + 1] for i in range(0, len(parts) - 1, 2)]
             if len(parts) % 2 != 0:
                 verses.append(parts[-1])
         else:
             
-            parts = re.split(r'(\w+ \d+:\d+)', scripture_text)
+            parts = ANY_MARKER.split(scripture_text)
             verses = [parts[i] + parts[i + 1] for i in range(0, len(parts) - 1, 2)]
             if len(parts) % 2 != 0:
                 verses.append(parts[-1])
@@ -75,26 +117,46 @@ class CodexReader:
         return [self.combine_verses(verses[i:i+self.verse_chunk_size], language) for i in range(0, len(verses), self.verse_chunk_size)]
 
     def combine_verses(self, verse_chunk, language):
-        first_verse_info = re.search(r'([A-Z]+) (\d+:\d+)', verse_chunk[0])
-        last_verse_info = re.search(r'([A-Z]+) (\d+:\d+)', verse_chunk[-1])
+        first_verse_info = VERSE_INFO.search(verse_chunk[0])
+        last_verse_info = VERSE_INFO.search(verse_chunk[-1])
 
         if first_verse_info and last_verse_info and first_verse_info.group(1) == last_verse_info.group(1):
             chunk_name = f"{language} {first_verse_info.group(1)} {first_verse_info.group(2)} - {last_verse_info.group(2)}"
         else:
             chunk_name = f"{language} Chunk (problematic schema)"
 
-        combined_text = ''.join(re.sub(r'[A-Z]+\s\d+:\d+\n?', '', verse) for verse in verse_chunk)
+        combined_text = ''.join(MARKER_TEXT.sub('', verse) for verse in verse_chunk)
         combined_text = combined_text.replace('\r', '').replace('1\n', '').replace('\n1', '') # bunch of random characters get replaced
         return {chunk_name: combined_text.strip()}
-    
+
+    def iter_scripture_cells(self, filename: str) -> Iterator[Tuple[int, str, List[str]]]:
+        """
+        Yields (cell_index, language, verses) for the scripture cells that follow a chapter cell.
+        """
+        for cell_index, cell in self.iter_scripture(filename):
+            verses = [verse for verse in self.split_verses(cell['value']) if verse]
+            if verses:
+                yield cell_index, cell['language'], verses
+
+    @staticmethod
+    def iter_scripture(filename: str) -> Iterator[Tuple[int, dict]]:
+        in_chapter = False
+        for cell_index, cell in enumerate(iter_cells(filename)):
+            if cell['kind'] == 1:  # Markdown cell representing a chapter
+                in_chapter = True
+            elif cell['kind'] == 2 and in_chapter:  # Scripture cell
+                yield cell_index, cell
+
+    def iter_chunks(self, filename: str) -> Iterator[Tuple[str, str]]:
+        """
+        Yields (chunk_name, text) for every chunk of verse_chunk_size verses, one cell at a time.
+        """
+        for _, language, verses in self.iter_scripture_cells(filename):
+            for i in range(0, len(verses), self.verse_chunk_size):
+                yield next(iter(self.combine_verses(verses[i:i + self.verse_chunk_size], language).items()))
+
     def get_embed_format(self, filename):
-        result = self.read_file(filename=filename)
-        chapters = result['chapters']
-        chunks = []
-        for chapter in chapters:
-            for chunk in chapter['verse_chunks']:
-                chunks.append(tuple(chunk.items())[0])
-        return chunks
+        return list(self.iter_chunks(filename))
 
 
 # Example usage
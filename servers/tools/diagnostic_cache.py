@@ -0,0 +1,215 @@
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import attrs
+from lsprotocol.types import Diagnostic, Position, Range
+
+
+def shift_diagnostic(diagnostic: Diagnostic, delta: int) -> Diagnostic:
+    """
+    Returns a copy of the diagnostic moved down by `delta` lines.
+    """
+    start, end = diagnostic.range.start, diagnostic.range.end
+    return attrs.evolve(diagnostic, range=Range(
+        start=Position(line=start.line + delta, character=start.character),
+        end=Position(line=end.line + delta, character=end.character)))
+
+
+def line_count(document) -> int:
+    """
+    Number of lines of a document as the LSP counts them (a trailing newline starts an empty line).
+    """
+    return document.source.count('\n') + 1
+
+
+class DocumentLines:
+    """
+    The diagnostics of every line of one document, per provider.
+
+    Each line holds `(line_num, diagnostics)` where line_num is the line the diagnostics were
+    computed for, or None while the line needs to be (re)analyzed. When lines move, the stored
+    diagnostics are shifted the next time they are collected instead of being recomputed.
+    """
+    def __init__(self, count: int = 0) -> None:
+        self.count = count
+        self.generation = 0  # changes whenever lines are added, removed or marked as changed
+        self.results: Dict[Callable, List[Optional[Tuple[int, List[Diagnostic]]]]] = {}
+
+    def lines_for(self, provider: Callable) -> List[Optional[Tuple[int, List[Diagnostic]]]]:
+        if provider not in self.results:
+            self.results[provider] = [None] * self.count
+        return self.results[provider]
+
+    def reset(self, count: int) -> None:
+        """
+        Marks every line as changed.
+        """
+        self.count = count
+        self.generation += 1
+        self.results = {}
+
+    def splice(self, start: int, end: int, new_count: int) -> None:
+        """
+        Replaces lines start..end (inclusive) by `new_count` changed lines.
+        """
+        end = min(end, self.count - 1)
+        for lines in self.results.values():
+            lines[start:end + 1] = [None] * new_count
+        self.count += new_count - max(0, end + 1 - start)
+        self.generation += 1
+
+    def dirty(self, provider: Callable) -> List[int]:
+        return [line_num for line_num, result in enumerate(self.lines_for(provider)) if result is None]
+
+
+class LineDiagnosticCache:
+    """
+    Per-document, per-line diagnostic results for line providers.
+
+    A line provider is a function `(line_num: int, line: str) -> List[Diagnostic]` whose result only
+    depends on the line's text. `update` applies the ranges of a didChange to the document's lines
+    so only the edited lines are re-analyzed, and results are also memoized by line content so
+    lines that come back (undo, paste, repeated lines) are not analyzed again.
+
+    Example Usage:
+        cache = LineDiagnosticCache()
+        cache.update(uri, params.content_changes, document)
+        diagnostics = cache.diagnostics(uri, document, [spell_line_diagnostic])
+    """
+    def __init__(self, memo_size: int = 50000) -> None:
+        self.documents: Dict[str, DocumentLines] = {}
+        self.memo: Dict[Callable, OrderedDict] = {}  # provider -> line text -> (line_num, diagnostics)
+        self.memo_size = memo_size
+        self.epoch = 0  # changes whenever results are invalidated
+
+    def update(self, uri: str, changes, document) -> DocumentLines:
+        """
+        Marks the lines touched by a didChange's content changes, shifting the lines below them.
+        Falls back to re-analyzing the whole document when the changes can't be followed.
+        """
+        count = line_count(document)
+        state = self.documents.get(uri)
+        if state is None:
+            state = self.documents[uri] = DocumentLines(count)
+            return state
+
+        for change in changes or []:
+            change_range = getattr(change, 'range', None)
+            if change_range is None:  # the whole document was replaced
+                state.reset(count)
+                return state
+            state.splice(change_range.start.line, change_range.end.line, change.text.count('\n') + 1)
+
+        if state.count != count:
+            state.reset(count)
+        return state
+
+    def close(self, uri: str) -> None:
+        self.documents.pop(uri, None)
+
+    def invalidate(self, provider: Optional[Callable] = None) -> None:
+        """
+        Forgets the results of a provider (or of all of them), e.g. when the dictionary changed.
+        """
+        self.epoch += 1
+        if provider is None:
+            self.memo = {}
+        else:
+            self.memo.pop(provider, None)
+        for state in self.documents.values():
+            state.generation += 1
+            if provider is None:
+                state.results = {}
+            else:
+                state.results.pop(provider, None)
+
+    def remember(self, provider: Callable, line: str, line_num: int, diagnostics: List[Diagnostic]) -> None:
+        memo = self.memo.setdefault(provider, OrderedDict())
+        memo[line] = (line_num, diagnostics)
+        memo.move_to_end(line)
+        if len(memo) > self.memo_size:
+            memo.popitem(last=False)
+
+    def recall(self, provider: Callable, line: str) -> Optional[Tuple[int, List[Diagnostic]]]:
+        memo = self.memo.get(provider)
+        if memo is None or line not in memo:
+            return None
+        memo.move_to_end(line)
+        return memo[line]
+
+    def pending(self, uri: str, document, provider: Callable) -> Tuple[tuple, List[Tuple[int, str]]]:
+        """
+        Fills the changed lines that are memoized and returns the ones the provider still has to analyze,
+        as (generation, [(line_num, line)]). Pass both to `apply` with the provider's results.
+        """
+        state = self.documents.get(uri)
+        if state is None:
+            state = self.documents[uri] = DocumentLines(line_count(document))
+        results = state.lines_for(provider)
+        dirty = state.dirty(provider)
+        pending = []
+        if dirty:
+            lines = document.lines
+            for line_num in dirty:
+                line = lines[line_num] if line_num < len(lines) else ''
+                result = self.recall(provider, line)
+                if result is None:
+                    pending.append((line_num, line))
+                else:
+                    results[line_num] = result
+        return (state.generation, self.epoch), pending
+
+    def apply(self, uri: str, provider: Callable, generation: tuple, pending: List[Tuple[int, str]], results: List[List[Diagnostic]]) -> None:
+        """
+        Stores a provider's results for the lines returned by `pending`. If the document changed
+        in the meantime the results are only memoized, since the line numbers may no longer match.
+        Results computed before an invalidation are dropped.
+        """
+        state_generation, epoch = generation
+        if epoch != self.epoch:
+            return
+        for (line_num, line), diagnostics in zip(pending, results):
+            self.remember(provider, line, line_num, diagnostics)
+        state = self.documents.get(uri)
+        if state is None or state.generation != state_generation:
+            return
+        lines = state.lines_for(provider)
+        for (line_num, _), diagnostics in zip(pending, results):
+            lines[line_num] = (line_num, diagnostics)
+
+    def refresh(self, uri: str, document, provider: Callable) -> None:
+        """
+        Runs the provider on the lines of the document that changed since it last ran.
+        """
+        generation, pending = self.pending(uri, document, provider)
+        if pending:
+            self.apply(uri, provider, generation, pending, [provider(line_num, line) for line_num, line in pending])
+
+    def collect(self, uri: str, provider: Callable) -> List[Diagnostic]:
+        """
+        Returns the provider's diagnostics for the document, shifted to the lines they are on now.
+        """
+        state = self.documents.get(uri)
+        if state is None:
+            return []
+        diagnostics = []
+        results = state.lines_for(provider)
+        for line_num, result in enumerate(results):
+            if result is None:
+                continue
+            computed_at, line_diagnostics = result
+            if computed_at != line_num and line_diagnostics:
+                line_diagnostics = [shift_diagnostic(diagnostic, line_num - computed_at) for diagnostic in line_diagnostics]
+                results[line_num] = (line_num, line_diagnostics)
+            diagnostics.extend(line_diagnostics)
+        return diagnostics
+
+    def diagnostics(self, uri: str, document, providers: List[Callable]) -> List[Diagnostic]:
+        """
+        Refreshes and collects the diagnostics of every provider, in provider order.
+        """
+        diagnostics = []
+        for provider in providers:
+            self.refresh(uri, document, provider)
+            diagnostics.extend(self.collect(uri, provider))
+        return diagnostics
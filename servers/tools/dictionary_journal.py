@@ -0,0 +1,86 @@
+"""
+Write-ahead journal for dictionary changes
+"""
+import json
+import os
+from typing import Dict, Iterator
+
+
+def write_json_atomic(path: str, data, indent: int = 2, default=None) -> None:
+    """
+    writes json to a temporary file and renames it over `path`, so a crash never leaves a truncated file.
+    default converts objects json can't serialize, as in json.dump
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary_path, 'w') as file:
+            json.dump(data, file, indent=indent, default=default)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+
+class DictionaryJournal:
+    """
+    An append-only file of dictionary changes, one json record per line.
+
+    Records are applied to the dictionary in memory as they are written, so adding a word only
+    appends one short line. The journal is replayed on load and emptied once the dictionary file
+    has been rewritten (compacted). Records are idempotent, so replaying a journal whose changes
+    already reached the dictionary file is harmless.
+
+    Example Usage:
+        journal = DictionaryJournal(path + '.journal')
+        journal.append({'op': 'define', 'entry': entry})
+        for record in journal.records():
+            ...
+        journal.clear()
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file = None
+        self.count = sum(1 for _ in self.records())  # records written since the last compaction
+
+    def records(self) -> Iterator[Dict]:
+        """
+        yields the records in the journal, skipping a line torn by a crash
+        """
+        try:
+            with open(self.path, 'r') as file:
+                for line in file:
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+        except FileNotFoundError:
+            return
+
+    def append(self, *records: Dict) -> None:
+        """
+        appends records with a single write
+        """
+        if self.file is None:
+            self.file = open(self.path, 'a')
+        self.file.write(''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records))
+        self.file.flush()
+        self.count += len(records)
+
+    def clear(self) -> None:
+        """
+        empties the journal after its changes were written to the dictionary file
+        """
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.count = 0
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
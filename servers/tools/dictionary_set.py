@@ -0,0 +1,210 @@
+"""
+All the .dictionary files of a project behind one index
+"""
+import heapq
+import logging
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from tools.spell_check import Dictionary, normalize, remove_punctuation
+
+logger = logging.getLogger(__name__)
+
+DICTIONARY_EXTENSION = '.dictionary'
+
+
+class IndexHooks:
+    """
+    Attached to a member Dictionary like a suggestion index, forwards its headword add/remove events to the set.
+    """
+    __slots__ = ('add', 'remove')
+
+    def __init__(self, add, remove) -> None:
+        self.add = add
+        self.remove = remove
+
+
+def find_dictionaries(root: str) -> List[str]:
+    """
+    returns the paths of the .dictionary files under root
+    """
+    paths = []
+    for directory, _, files in os.walk(root):
+        paths.extend(os.path.join(directory, name) for name in files if name.endswith(DICTIONARY_EXTENSION))
+    return sorted(paths)
+
+
+class DictionarySet:
+    """
+    Every .dictionary file under a directory, merged into one lookup and suggestion index.
+
+    It answers the same queries as a Dictionary (is_known, entries_for, nearest, complete, attach...).
+    New words go to the primary dictionary (project.dictionary), the other files are only read.
+    `refresh` picks up files that were added, removed or changed by another program and re-indexes
+    only the entries that changed; the server's own writes are recognized and skipped.
+
+    Example Usage:
+        dictionaries = DictionarySet(data_path, journal=True, binary=True)
+        spell_check = SpellCheck(dictionaries)
+        dictionaries.refresh()  # after a file watcher event, or periodically
+    """
+    def __init__(self, root: str, primary: str = 'project.dictionary', **options) -> None:
+        self.root = root
+        self.indexes = []  # suggestion indexes kept in sync with the merged headwords, see attach
+        self.counts: Dict[str, int] = {}  # normalized headword -> number of files defining it
+        self.hooks = IndexHooks(self.on_index_add, self.on_index_remove)  # attached to every member
+        self.merged = None  # the merged entries, see dictionary
+        self.merged_sources: List[Tuple[List, int]] = []  # (entries, length) of each member when merged
+        self.primary = Dictionary(root, file_name=primary, **options)
+        self.members: Dict[str, Dictionary] = {os.path.normpath(self.primary.path): self.primary}
+        self.primary.attach(self.hooks)
+        for path in find_dictionaries(root):
+            self.add_file(path)
+
+    # index events from the member dictionaries
+
+    def on_index_add(self, key: str) -> None:
+        count = self.counts.get(key, 0)
+        self.counts[key] = count + 1
+        if count == 0:
+            for index in self.indexes:
+                index.add(key)
+
+    def on_index_remove(self, key: str) -> None:
+        count = self.counts.get(key, 0)
+        if count <= 1:
+            self.counts.pop(key, None)
+            if count == 1:
+                for index in self.indexes:
+                    index.remove(key)
+        else:
+            self.counts[key] = count - 1
+
+    def attach(self, index) -> None:
+        """
+        keeps a suggestion index (anything with add/remove, e.g. SymSpellIndex) in sync with the merged headwords
+        """
+        for key in self.counts:
+            index.add(key)
+        self.indexes.append(index)
+
+    def detach(self, index) -> None:
+        self.indexes.remove(index)
+
+    # files
+
+    def add_file(self, path: str) -> bool:
+        path = os.path.normpath(path)
+        if path in self.members:
+            return False
+        try:
+            dictionary = Dictionary(os.path.dirname(path), file_name=os.path.basename(path))
+        except (OSError, ValueError) as error:
+            logger.warning("Could not load %s: %s", path, error)
+            return False
+        self.members[path] = dictionary
+        dictionary.attach(self.hooks)
+        return True
+
+    def remove_file(self, path: str) -> bool:
+        path = os.path.normpath(path)
+        dictionary = self.members.get(path)
+        if dictionary is None or dictionary is self.primary:
+            return False
+        del self.members[path]
+        dictionary.detach(self.hooks)
+        for key in dictionary.headwords:
+            self.on_index_remove(key)
+        return True
+
+    def refresh(self, paths: Optional[Iterable[str]] = None) -> bool:
+        """
+        re-indexes the dictionary files that changed on disk: the given paths (e.g. from
+        workspace/didChangeWatchedFiles) or every .dictionary file under the root.
+        Returns whether the merged index changed.
+        """
+        if paths is None:
+            paths = set(find_dictionaries(self.root)) | set(self.members)
+        changed = False
+        for path in paths:
+            path = os.path.normpath(path)
+            if not path.endswith(DICTIONARY_EXTENSION):
+                continue
+            dictionary = self.members.get(path)
+            if dictionary is None:
+                changed = (os.path.exists(path) and self.add_file(path)) or changed
+            elif not os.path.exists(path):
+                changed = self.remove_file(path) or changed
+            elif dictionary.is_modified():
+                try:
+                    changed = dictionary.reload() or changed
+                except (OSError, ValueError) as error:  # e.g. caught in the middle of a write, the next event retries
+                    logger.warning("Could not reload %s: %s", path, error)
+        return changed
+
+    def close(self) -> None:
+        for dictionary in self.members.values():
+            dictionary.close()
+
+    # lookups
+
+    @property
+    def dictionary(self) -> Dict:
+        """
+        the entries of every file, as Dictionary.dictionary. The merged list is kept until a file's entries change.
+        """
+        sources = [(member.dictionary['entries'], len(member.dictionary['entries'])) for member in self.members.values()]
+        if self.merged is None or len(sources) != len(self.merged_sources) or any(
+                entries is not merged_entries or length != merged_length
+                for (entries, length), (merged_entries, merged_length) in zip(sources, self.merged_sources)):
+            self.merged = {'entries': [entry for entries, _ in sources for entry in entries]}
+            self.merged_sources = sources
+        return self.merged
+
+    def is_known(self, word: str) -> bool:
+        return normalize(word) in self.counts
+
+    def entries_for(self, word: str) -> List[Dict]:
+        return [entry for member in self.members.values() for entry in member.entries_for(word)]
+
+    def frequency(self, word: str) -> int:
+        return max((member.frequency(word) for member in self.members.values()), default=0)
+
+    def nearest(self, word_hash, limit: int = 5) -> List[Tuple[str, int]]:
+        """
+        returns up to `limit` (headWord, distance) pairs with the closest hashes across all files
+        """
+        candidates = [pair for member in self.members.values() for pair in member.nearest(word_hash, limit=limit)]
+        return heapq.nsmallest(limit, candidates, key=lambda pair: pair[1])
+
+    def complete(self, prefix: str, limit: int = 5) -> List[str]:
+        candidates = {word for member in self.members.values() for word in member.complete(prefix, limit=limit)}
+        return heapq.nsmallest(limit, candidates, key=lambda word: (-self.frequency(word), len(word), word))
+
+    # changes, written to the primary dictionary
+
+    def define(self, word: str) -> None:
+        self.define_many([word])
+
+    def define_many(self, words: Iterable[str]) -> List[str]:
+        """
+        adds the words no file knows yet to the primary dictionary
+        """
+        words = [word for word in words if self.primary.has_headword(remove_punctuation(word))
+                 or not self.is_known(word)]
+        return self.primary.define_many(words)
+
+    def remove(self, word: str) -> None:
+        self.primary.remove(word)
+
+    def remove_many(self, words: Iterable[str]) -> List[str]:
+        """
+        removes words from the primary dictionary
+        """
+        return self.primary.remove_many(words)
+
+    def use_many(self, words: Iterable[str]) -> List[str]:
+        """
+        counts the uses of words in the primary dictionary
+        """
+        return self.primary.use_many(words)
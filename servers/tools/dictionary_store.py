@@ -0,0 +1,250 @@
+"""
+Compact binary copy of a .dictionary file for fast loading
+"""
+import json
+import mmap
+import os
+import struct
+from collections.abc import MutableMapping
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+MAGIC = b'CDXDICT1'
+FORMAT_VERSION = 1
+# magic, version, source mtime (ns), source size, entry count,
+# length of the document (without the entries) and of the headwords, in bytes
+HEADER = struct.Struct('<8sIqqQQQ')
+ALIGNMENT = 8
+
+
+def entry_template(word: str, word_hash, entry_id: str) -> Dict:
+    """
+    a new dictionary entry, as the server creates them
+    """
+    return {
+        'headWord': word,
+        'id': entry_id,
+        'hash': str(word_hash),
+        'definition': '',
+        'translationEquivalents': [],
+        'links': [],
+        'linkedEntries': [],
+        'metadata': {'extra': {}},
+        'notes': [],
+        'extra': {}
+    }
+
+
+def encode_entry(entry) -> bytes:
+    """
+    an entry as compact json. Entries that only differ from the template by their id are stored as [id, hash].
+    """
+    if isinstance(entry, LazyEntry):
+        entry = entry.load()
+    try:
+        if list(entry.items()) == list(entry_template(entry['headWord'], entry['hash'], entry['id']).items()):
+            return json.dumps([entry['id'], entry['hash']], ensure_ascii=False, separators=(',', ':')).encode()
+    except (KeyError, TypeError):
+        pass
+    return json.dumps(entry, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def decode_entry(data: bytes, head_word: str) -> Dict:
+    value = json.loads(data)
+    if isinstance(value, list):
+        return entry_template(head_word, value[1], value[0])
+    return value
+
+
+def padding(length: int) -> bytes:
+    return b'\0' * (-length % ALIGNMENT)
+
+
+def source_signature(source_path: str) -> Tuple[int, int]:
+    stat = os.stat(source_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def write_store(path: str, source_path: str, document: Dict, hashes: np.ndarray, frequencies: List[int]) -> None:
+    """
+    writes the compact form of a dictionary document loaded from source_path.
+
+    Layout: header, document json, then (8-byte aligned) hashes uint64[n], frequencies uint32[n],
+    headword offsets uint64[n+1] (characters), entry offsets uint64[n+1] (bytes),
+    the headwords as one utf-8 string and the entries as compact json.
+    """
+    entries = document['entries']
+    count = len(entries)
+    # the entries keep their place in the document, so saving it again keeps the key order
+    rest = json.dumps({key: None if key == 'entries' else value for key, value in document.items()},
+                      ensure_ascii=False, separators=(',', ':')).encode()
+    head_words = [entry['headWord'] for entry in entries]
+    headword_offsets = np.zeros(count + 1, dtype=np.uint64)
+    headword_offsets[1:] = np.cumsum([len(word) for word in head_words], dtype=np.uint64)
+    encoded = [encode_entry(entry) for entry in entries]
+    entry_offsets = np.zeros(count + 1, dtype=np.uint64)
+    entry_offsets[1:] = np.cumsum([len(data) for data in encoded], dtype=np.uint64)
+
+    headword_bytes = ''.join(head_words).encode()
+    mtime, size = source_signature(source_path)
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, mtime, size, count, len(rest), len(headword_bytes))
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary_path, 'wb') as file:
+            file.write(header + rest + padding(len(header) + len(rest)))
+            file.write(np.asarray(hashes, dtype=np.uint64)[:count].tobytes())
+            frequency_bytes = np.asarray(frequencies, dtype=np.uint32).tobytes()
+            file.write(frequency_bytes + padding(len(frequency_bytes)))
+            file.write(headword_offsets.tobytes())
+            file.write(entry_offsets.tobytes())
+            file.write(headword_bytes)
+            file.write(b''.join(encoded))
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+
+class DictionaryStore:
+    """
+    A memory-mapped compact dictionary file (see write_store).
+
+    Headwords, hashes and usage frequencies are read in bulk; full entries are decoded from
+    the mapping only when they are accessed, see LazyEntry.
+
+    Example Usage:
+        store = DictionaryStore.open(path + '.bin', path)
+        if store is None:
+            write_store(path + '.bin', path, document, hashes, frequencies)
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, 'rb') as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.parse()
+        except Exception:
+            self.close()
+            raise
+
+    def parse(self) -> None:
+        magic, version, self.source_mtime, self.source_size, count, rest_length, headword_length = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{self.path} is not a compact dictionary")
+        self.count = count
+        offset = HEADER.size
+        self.document = json.loads(self.buffer[offset:offset + rest_length])
+        offset += rest_length
+        offset += -offset % ALIGNMENT
+        self.hashes = np.frombuffer(self.buffer, dtype=np.uint64, count=count, offset=offset)
+        offset += 8 * count
+        self.frequencies = np.frombuffer(self.buffer, dtype=np.uint32, count=count, offset=offset)
+        offset += 4 * count
+        offset += -offset % ALIGNMENT
+        headword_offsets = np.frombuffer(self.buffer, dtype=np.uint64, count=count + 1, offset=offset)
+        offset += 8 * (count + 1)
+        self.entry_offsets = np.frombuffer(self.buffer, dtype=np.uint64, count=count + 1, offset=offset)
+        offset += 8 * (count + 1)
+        # the headwords are decoded as one string and sliced by character offsets
+        text = self.buffer[offset:offset + headword_length].decode()
+        bounds = headword_offsets.tolist()
+        if len(text) != bounds[-1]:
+            raise ValueError(f"{self.path} is truncated")
+        self.head_words = [text[bounds[i]:bounds[i + 1]] for i in range(count)]
+        self.entries_start = offset + headword_length
+        if self.entries_start + int(self.entry_offsets[-1]) > len(self.buffer):
+            raise ValueError(f"{self.path} is truncated")
+
+    @classmethod
+    def open(cls, path: str, source_path: str) -> Optional['DictionaryStore']:
+        """
+        opens the compact file if it was written from the current version of source_path, otherwise returns None
+        """
+        try:
+            store = cls(path)
+        except (OSError, ValueError, struct.error, UnicodeDecodeError):
+            return None
+        try:
+            current = source_signature(source_path)
+        except OSError:
+            current = None
+        if current != (store.source_mtime, store.source_size):
+            store.close()
+            return None
+        return store
+
+    @staticmethod
+    def is_current(path: str, source_path: str) -> bool:
+        """
+        checks from its header whether the compact file at path was written from the current source_path
+        """
+        try:
+            with open(path, 'rb') as file:
+                magic, version, mtime, size = HEADER.unpack(file.read(HEADER.size))[:4]
+            return magic == MAGIC and version == FORMAT_VERSION and (mtime, size) == source_signature(source_path)
+        except (OSError, struct.error):
+            return False
+
+    def entry(self, index: int) -> Dict:
+        start = self.entries_start + int(self.entry_offsets[index])
+        end = self.entries_start + int(self.entry_offsets[index + 1])
+        return decode_entry(self.buffer[start:end], self.head_words[index])
+
+    def entries(self) -> List['LazyEntry']:
+        frequencies = self.frequencies.tolist()
+        return [LazyEntry(self, i, self.head_words[i], frequencies[i]) for i in range(self.count)]
+
+    def close(self) -> None:
+        # numpy views keep the mapping alive; copy what outlives the store before closing it
+        self.hashes = self.frequencies = self.entry_offsets = None
+        try:
+            self.buffer.close()
+        except BufferError:
+            pass
+
+
+class LazyEntry(MutableMapping):
+    """
+    A dictionary entry whose headWord is known up front and whose other fields are decoded on first access.
+    Serialize it with json.dump(..., default=dict) or after load().
+    """
+    __slots__ = ('store', 'index', 'head_word', 'frequency', 'data')
+
+    def __init__(self, store: DictionaryStore, index: int, head_word: str, frequency: int = 0) -> None:
+        self.store = store
+        self.index = index
+        self.head_word = head_word
+        self.frequency = frequency
+        self.data = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.data is not None
+
+    def load(self) -> Dict:
+        if self.data is None:
+            self.data = self.store.entry(self.index)
+            self.store = None
+        return self.data
+
+    def __getitem__(self, key):
+        if key == 'headWord' and self.data is None:
+            return self.head_word
+        return self.load()[key]
+
+    def __setitem__(self, key, value) -> None:
+        self.load()[key] = value
+
+    def __delitem__(self, key) -> None:
+        del self.load()[key]
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __len__(self) -> int:
+        return len(self.load())
+
+    def __repr__(self) -> str:
+        return f"LazyEntry({self.head_word!r})" if self.data is None else repr(self.data)
@@ -24,6 +24,67 @@ def distance(str1, str2):
     # The bottom-right cell contains the final edit distance
     return matrix[-1][-1]
 
+
+def pattern_masks(query):
+    """
+    Bit masks of the positions of every character in the query, for Myers' algorithm.
+    """
+    masks = {}
+    for i, char in enumerate(query):
+        masks[char] = masks.get(char, 0) | (1 << i)
+    return masks
+
+
+def bit_parallel_distance(masks, query_length, candidate, max_distance=None):
+    """
+    Levenshtein distance between a query (given by its pattern_masks) and a candidate, computed one
+    column at a time with Myers' bit-parallel algorithm (Hyyrö's formulation for edit distance).
+
+    With max_distance, stops as soon as the distance is known to exceed it and returns max_distance + 1.
+    """
+    if max_distance is not None and abs(len(candidate) - query_length) > max_distance:
+        return max_distance + 1
+    if query_length == 0:
+        return len(candidate)
+
+    mask = (1 << query_length) - 1
+    last = 1 << (query_length - 1)
+    positive = mask  # vertical +1 deltas
+    negative = 0     # vertical -1 deltas
+    score = query_length
+    remaining = len(candidate)
+    for char in candidate:
+        remaining -= 1
+        eq = masks.get(char, 0)
+        vertical = eq | negative
+        horizontal = (((eq & positive) + positive) ^ positive) | eq
+        horizontal_positive = negative | ~(horizontal | positive)
+        horizontal_negative = positive & horizontal
+        if horizontal_positive & last:
+            score += 1
+        elif horizontal_negative & last:
+            score -= 1
+        horizontal_positive = (horizontal_positive << 1) | 1
+        horizontal_negative = horizontal_negative << 1
+        positive = (horizontal_negative | ~(vertical | horizontal_positive)) & mask
+        negative = horizontal_positive & vertical & mask
+        # each remaining column can lower the score by at most one
+        if max_distance is not None and score - remaining > max_distance:
+            return max_distance + 1
+    return score
+
+
+def distances(query, candidates, max_distance=None):
+    """
+    Edit distances from one query to many candidates. The query is preprocessed once and every
+    candidate costs one pass of integer operations instead of a full matrix.
+
+    With max_distance, candidates further away than it get max_distance + 1.
+    """
+    masks = pattern_masks(query)
+    query_length = len(query)
+    return [bit_parallel_distance(masks, query_length, candidate, max_distance) for candidate in candidates]
+
 # # Example usage:
 # string1 = "top"
 # string2 = "tob"
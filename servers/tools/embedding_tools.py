@@ -1,5 +1,150 @@
+import hashlib
+import json
+import os
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
 from tools.codex_tools import CodexReader
-from txtai import Embeddings
+from tools.dictionary_journal import write_json_atomic
+
+# "stub" swaps the model for tools.stub_embeddings.StubEmbeddings, e.g. to replay sessions offline
+EMBEDDING_BACKEND_VARIABLE = 'COPILOT_EMBEDDING_BACKEND'
+
+
+def create_embeddings(**config):
+    """
+    Returns the txtai Embeddings for config, or the stub selected by the COPILOT_EMBEDDING_BACKEND environment variable.
+    """
+    if os.environ.get(EMBEDDING_BACKEND_VARIABLE, '').lower() == 'stub':
+        from tools.stub_embeddings import StubEmbeddings
+        return StubEmbeddings(**config)
+    from txtai import Embeddings
+    return Embeddings(**config)
+
+
+def source_key(path: str) -> str:
+    """
+    The key a source file is recorded under. The server gets paths from document uris and the indexer
+    from the file system, so case and separators are normalized for both to name a file the same way.
+    The empty source (pairs from upsert_all) stays empty.
+    """
+    return os.path.normcase(os.path.abspath(path)) if path else path
+
+
+def content_hash(text: str) -> str:
+    """
+    Returns a stable hash of a chunk's text, used to skip chunks that did not change.
+    """
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class ChunkManifest:
+    """
+    What the index holds for every source file: chunk_name -> [content hash, embedding row id].
+
+    Rows are content addressed (the row id is derived from the text), so identical chunks share
+    one embedding, which is deleted once no chunk refers to it anymore. `names` maps a row back
+    to a chunk name for search results.
+
+    Example Usage:
+        manifest = ChunkManifest(name + '.chunks.json')
+        embed, delete = manifest.diff({path: [(chunk_name, text), ...]})
+    """
+    VERSION = 1
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.files: Dict[str, Dict[str, List[str]]] = {}
+        self.references: Counter = Counter()  # row id -> number of chunks using it
+        self.row_names = None  # row id -> chunk name, built on first use
+        self.exists = self.load()
+
+    def load(self) -> bool:
+        try:
+            with open(self.path, 'r') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return False
+        if data.get('version') != self.VERSION:
+            return False
+        self.files = {}
+        for source, chunks in data.get('files', {}).items():
+            self.files.setdefault(source_key(source), {}).update(chunks)
+        self.references = Counter(row for chunks in self.files.values() for _, row in chunks.values())
+        self.row_names = None
+        return True
+
+    def save(self) -> None:
+        write_json_atomic(self.path, {'version': self.VERSION, 'files': self.files}, indent=None)
+        self.exists = True
+
+    @staticmethod
+    def entries(chunks: Iterable) -> Tuple[Dict[str, List[str]], Dict[str, str]]:
+        """
+        Returns chunk_name -> [content hash, row id] for (chunk_name, text) pairs, and the text of every row.
+        Repeated names get a numbered suffix, so no chunk is lost.
+        """
+        entries, texts = {}, {}
+        for name, text in chunks:
+            name, text = str(name), str(text)
+            unique_name, number = name, 1
+            while unique_name in entries:
+                number += 1
+                unique_name = f"{name} ({number})"
+            digest = content_hash(text)
+            row = digest  # rows are keyed by their content
+            entries[unique_name] = [digest, row]
+            texts[row] = text
+        return entries, texts
+
+    def diff(self, files: Dict[str, Iterable], replace: bool = True) -> Tuple[Dict[str, str], List[str]]:
+        """
+        Replaces the chunks of the given files, or with replace=False only the chunks with the given names.
+
+        Args:
+            files: source path -> its (chunk_name, text) pairs.
+
+        Returns:
+            (embed, delete): the rows to embed, as row id -> text, and the row ids no chunk uses anymore.
+        """
+        references = self.references.copy()
+        texts = {}
+        for source, chunks in files.items():
+            entries, file_texts = self.entries(chunks)
+            previous = self.files.get(source, {})
+            if not replace:
+                entries = {**previous, **entries}
+            for _, row in previous.values():
+                references[row] -= 1
+            for _, row in entries.values():
+                references[row] += 1
+            texts.update(file_texts)
+            if entries:
+                self.files[source] = entries
+            else:
+                self.files.pop(source, None)
+        embed = {row: text for row, text in texts.items() if self.references[row] <= 0 < references[row]}
+        delete = [row for row, count in references.items() if count <= 0 < self.references[row]]
+        self.references = +references  # drops rows without references
+        self.row_names = None
+        return embed, delete
+
+    def names(self) -> Dict[str, str]:
+        """
+        Returns row id -> the name of a chunk using it (the first one, when chunks share the row).
+        """
+        if self.row_names is None:
+            self.row_names = {}
+            for chunks in self.files.values():
+                for name, (_, row) in chunks.items():
+                    self.row_names.setdefault(row, name)
+        return self.row_names
+
+    def clear(self) -> None:
+        self.files = {}
+        self.references = Counter()
+        self.row_names = None
+
 
 class DataBase:
     """
@@ -7,7 +152,12 @@ class DataBase:
 
     Attributes:
         name (str): The name of the database.
-        embeddings (Embeddings): An instance of the txtai Embeddings class for handling sentence embeddings.
+        embeddings (Embeddings): An instance of the txtai Embeddings class for handling sentence embeddings (see create_embeddings).
+        batch_size (int): How many chunks go through the model at once when upserting.
+        manifest (ChunkManifest): The chunks of every file with their content hash and row id, saved next to the database.
+        generation (int): Changes whenever the index changes, e.g. to invalidate cached search results.
+        outdated (bool): The saved index has no manifest: it was written by an earlier version, whose rows
+            can't be traced to their files. The first update replaces it instead of adding to it.
 
     Methods:
         __init__(name: str) -> None:
@@ -25,8 +175,11 @@ class DataBase:
         upsert(new_data) -> None:
             Upserts new data into the database and saves the changes.
 
-        upsert_all(new_data: list) -> None:
-            Upserts a list of new data into the database and saves the changes.
+        upsert_all(new_data: list) -> int:
+            Upserts the chunks whose content changed in one batched call and saves once.
+
+        update_files(files: dict) -> int:
+            Replaces the chunks of source files, embedding only new texts and deleting the unused ones.
 
         search(query: str, limit: int = 1) -> list:
             Searches for embeddings related to the specified query within the database.
@@ -38,16 +191,60 @@ class DataBase:
         database.save()
     """
 
-    def __init__(self, name: str) -> None:
+    def __init__(self, name: str, batch_size: int = 256) -> None:
         """
         Initializes a new database with the specified name and loads existing embeddings if available.
         """
         self.name = name
-        self.embeddings = Embeddings(path="sentence-transformers/nli-mpnet-base-v2", content=True)
+        self.batch_size = batch_size
+        self.embeddings = create_embeddings(path="sentence-transformers/nli-mpnet-base-v2", content=True,
+                                            batch=batch_size, encodebatch=min(batch_size, 64))
+        self.manifest = ChunkManifest(name + '.chunks.json')
+        self.generation = 0
+        self.lock = threading.RLock()  # txtai is not safe to search while it upserts
+        loaded = False
         try:
             self.embeddings.load(self.name)
+            loaded = True
         except:
             print("No embeddings to load yet")
+            self.manifest.clear()
+        self.outdated = loaded and not self.manifest.exists
+
+    def update_files(self, files: Dict[str, Iterable], replace: bool = True) -> int:
+        """
+        Replaces the chunks of source files: texts that aren't in the index yet are embedded (once,
+        however many chunks share them) and rows no chunk uses anymore are deleted.
+
+        Args:
+            files (dict): source path -> its (chunk_name, text) pairs.
+            replace (bool): Whether the pairs replace all the chunks of their file or only those with the same names.
+
+        Returns:
+            int: The number of rows that were embedded.
+        """
+        with self.lock:
+            before = json.dumps(self.manifest.files, sort_keys=True) if self.manifest.exists else None
+            embed, delete = self.manifest.diff({source_key(source): chunks for source, chunks in files.items()},
+                                               replace=replace)
+            try:
+                if embed and self.outdated:
+                    # Drops the earlier version's rows, which would otherwise stay in the results forever
+                    self.embeddings.index([(row, text, None) for row, text in embed.items()])
+                    self.outdated = False
+                elif embed:
+                    self.embeddings.upsert([(row, text, None) for row, text in embed.items()])
+                if delete:
+                    self.embeddings.delete(delete)
+            except Exception:
+                self.manifest = ChunkManifest(self.manifest.path)  # back to what was saved
+                raise
+            if embed or delete:
+                self.generation += 1
+                self.save()
+            elif json.dumps(self.manifest.files, sort_keys=True) != before:
+                self.manifest.save()  # only chunk names changed
+        return len(embed)
 
     def upsert_codex_file(self, path: str, verse_chunk_size: int = 4) -> None:
         """
@@ -63,19 +260,24 @@ class DataBase:
         reader = CodexReader(verse_chunk_size=verse_chunk_size)
         results = reader.get_embed_format(path)
         results = [(str(result[0]), str(result[1])) for result in results if len(result[1]) > 4]
-        self.upsert_all(results)
+        self.update_files({path: results})
 
     def index_all(self, data: list) -> None:
         """
-        Indexes all the provided data into the database.
+        Indexes all the provided data into the database, replacing what it held.
 
         Args:
-            data (list): The data to be indexed.
+            data (list): The data to be indexed, as (id, text) pairs.
 
         Returns:
             None
         """
-        self.embeddings.index(data)
+        with self.lock:
+            self.manifest.clear()
+            embed, _ = self.manifest.diff({'': [(uid, text) for uid, text, *_ in data]})
+            self.embeddings.index([(row, text, None) for row, text in embed.items()])
+            self.outdated = False
+            self.generation += 1
 
     def save(self) -> None:
         """
@@ -84,48 +286,63 @@ class DataBase:
         Returns:
             None
         """
-        self.embeddings.save(self.name)
+        with self.lock:
+            self.embeddings.save(self.name)
+            self.manifest.save()
 
     def upsert(self, new_data) -> None:
         """
         Upserts new data into the database and saves the changes.
 
         Args:
-            new_data: The new data to be upserted.
+            new_data: The (id, text) pair to be upserted.
 
         Returns:
             None
         """
-        self.embeddings.upsert(new_data)
-        self.save()
+        self.upsert_all([new_data])
 
-    def upsert_all(self, new_data: list) -> None:
+    def upsert_all(self, new_data: list) -> int:
         """
-        Upserts a list of new data into the database and saves the changes.
+        Upserts a list of new data into the database and saves the changes once.
+
+        The pairs are kept apart from the chunks of source files and replace those with the same id.
+        Texts already in the index are skipped. The others go through the model in a single upsert,
+        which encodes them `batch_size` at a time.
 
         Args:
-            new_data (list): The list of new data to be upserted.
+            new_data (list): The list of (id, text) pairs to be upserted.
 
         Returns:
-            None
+            int: The number of chunks that were embedded.
         """
-        for data in new_data:
-            if data:
-                self.embeddings.upsert(data)
-        self.save()
+        pairs = {str(data[0]): str(data[1]) for data in new_data if data}  # later pairs win
+        return self.update_files({'': list(pairs.items())}, replace=False)
 
-    def search(self, query: str, limit: int = 1) -> list:
+    def search(self, query: str, limit: int = 1, wait: float = None) -> list:
         """
         Searches for embeddings related to the specified query within the database.
 
         Args:
             query (str): The query for searching embeddings.
             limit (int): The maximum number of results to return.
+            wait (float): How many seconds to wait while an update holds the index, None to wait until it is done.
 
         Returns:
-            list: A list of search results.
+            list: A list of search results, whose ids are chunk names.
+
+        Raises:
+            TimeoutError: The index was still being updated after `wait` seconds.
         """
-        results = self.embeddings.search(query, limit) # TODO: #2 return citations as well (cf: https://github.com/neuml/txtai/blob/3861b818ae7ab89299dd5b3e0ff969d9a047449e/examples/52_Build_RAG_pipelines_with_txtai.ipynb#L445)
+        if not self.lock.acquire(timeout=-1 if wait is None else wait):
+            raise TimeoutError("The embedding index is being updated")
+        try:
+            results = self.embeddings.search(query, limit) # TODO: #2 return citations as well (cf: https://github.com/neuml/txtai/blob/3861b818ae7ab89299dd5b3e0ff969d9a047449e/examples/52_Build_RAG_pipelines_with_txtai.ipynb#L445)
+            names = self.manifest.names()
+        finally:
+            self.lock.release()
+        for result in results:
+            result['id'] = names.get(result['id'], result['id'])  # rows are keyed by content
         results = [result for result in results if result['score'] > .1]
         return results
 
@@ -0,0 +1,193 @@
+"""
+Background job queue with coalescing and work done progress
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import lsprotocol.types as lsp_types
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """
+    A unit of work for a key (e.g. a file path). Only the latest function submitted for the key runs.
+    """
+    def __init__(self, key: str, function: Callable, priority: int, title: str) -> None:
+        self.key = key
+        self.function = function
+        self.priority = priority
+        self.title = title
+        self.cancelled = False
+        self.entry = None  # its current entry in the queue's heap
+
+
+class JobQueue:
+    """
+    Runs slow jobs (e.g. embedding a document) one at a time in a background thread, so handlers return right away.
+
+    Jobs are keyed: submitting a key that is already waiting replaces its work instead of queueing it
+    twice, and a key submitted while its job runs is queued once more to pick up the latest state.
+    Higher priorities run first, then the oldest job. Progress is reported to the client as work done
+    progress while the queue has work, and cancelling it there cancels the waiting jobs.
+
+    A running job can't be interrupted, but a cancelled one has its `cancelled` flag set, which
+    long jobs may check.
+
+    Example Usage:
+        jobs = JobQueue(server, title="Embedding")
+        jobs.submit(path, lambda: database.upsert_codex_file(path), title=os.path.basename(path))
+    """
+    def __init__(self, server=None, title: str = "Indexing") -> None:
+        self.server = server
+        self.title = title
+        self.pending: Dict[str, Job] = {}
+        self.heap: List[tuple] = []
+        self.counter = itertools.count()
+        self.running: Optional[Job] = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jobs")
+        self.wakeup: Optional[asyncio.Event] = None
+        self.worker: Optional[asyncio.Task] = None
+        self.done = 0  # jobs finished since the queue was last empty, for the progress percentage
+        self.token = None
+
+    def __len__(self) -> int:
+        return len(self.pending) + (self.running is not None)
+
+    def submit(self, key: str, function: Callable, priority: int = 0, title: str = None) -> Job:
+        """
+        Queues function() for the key, or replaces the function of the job already waiting for it.
+        """
+        job = self.pending.get(key)
+        if job is None:
+            job = self.pending[key] = Job(key, function, priority, title or key)
+            self.push(job)
+        else:
+            job.function = function
+            job.title = title or job.title
+            if priority > job.priority:
+                self.reprioritize(key, priority)
+        self.start()
+        return job
+
+    def push(self, job: Job) -> None:
+        job.entry = (-job.priority, next(self.counter), job.key)
+        heapq.heappush(self.heap, job.entry)
+
+    def reprioritize(self, key: str, priority: int) -> bool:
+        """
+        Changes the priority of a waiting job. Returns False if there is none for the key.
+        """
+        job = self.pending.get(key)
+        if job is None:
+            return False
+        job.priority = priority
+        self.push(job)  # the old heap entry is skipped when it comes up
+        return True
+
+    def cancel(self, key: str) -> bool:
+        """
+        Drops the waiting job for the key, and flags the running one. Returns whether there was one.
+        """
+        job = self.pending.pop(key, None)
+        if job is not None:
+            job.cancelled = True
+        if self.running is not None and self.running.key == key:
+            self.running.cancelled = True
+            return True
+        return job is not None
+
+    def cancel_all(self) -> None:
+        for key in list(self.pending):
+            self.cancel(key)
+        if self.running is not None:
+            self.running.cancelled = True
+
+    def next_job(self) -> Optional[Job]:
+        while self.heap:
+            entry = heapq.heappop(self.heap)
+            job = self.pending.get(entry[2])
+            if job is not None and job.entry == entry:
+                del self.pending[job.key]
+                return job
+        return None
+
+    def start(self) -> None:
+        """
+        Starts the worker on the running event loop if it isn't running.
+        """
+        if self.wakeup is None:
+            self.wakeup = asyncio.Event()
+        self.wakeup.set()
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.ensure_future(self.work())
+
+    async def work(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            job = self.next_job()
+            if job is None:
+                self.end_progress()
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            self.running = job
+            await self.report_progress(job)
+            try:
+                await loop.run_in_executor(self.executor, job.function)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Job %s failed", job.title)
+            finally:
+                self.running = None
+                self.done += 1
+
+    # work done progress
+
+    def supports_progress(self) -> bool:
+        try:
+            return bool(self.server.client_capabilities.window.work_done_progress)
+        except AttributeError:
+            return False
+
+    async def report_progress(self, job: Job) -> None:
+        if self.server is None or not self.supports_progress():
+            return
+        try:
+            if self.token is None:
+                token = str(uuid.uuid4())
+                await self.server.progress.create_async(token)
+                self.server.progress.begin(token, lsp_types.WorkDoneProgressBegin(title=self.title, percentage=0, cancellable=True))
+                self.server.progress.tokens[token].add_done_callback(lambda future: self.on_progress_cancelled(token, future))
+                self.token = token
+            total = self.done + len(self.pending) + 1
+            self.server.progress.report(self.token, lsp_types.WorkDoneProgressReport(
+                message=job.title, percentage=int(100 * self.done / total)))
+        except Exception:
+            logger.exception("Could not report progress")
+
+    def on_progress_cancelled(self, token, future) -> None:
+        if future.cancelled() and token == self.token:
+            self.cancel_all()
+
+    def end_progress(self) -> None:
+        self.done = 0
+        if self.token is None:
+            return
+        token, self.token = self.token, None
+        try:
+            self.server.progress.end(token, lsp_types.WorkDoneProgressEnd(message="Finished"))
+        except Exception:
+            logger.exception("Could not end progress")
+
+    def shutdown(self, *args) -> None:
+        self.cancel_all()
+        if self.worker is not None:
+            self.worker.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -1,36 +1,150 @@
-from typing import Callable, List
+import asyncio
+import functools
+import hashlib
+import inspect
+import logging
+import os
+from typing import Callable, Dict, List
 from pygls.server import LanguageServer
 from lsprotocol.types import (Range, Position, TextEdit, DiagnosticSeverity, 
                               TEXT_DOCUMENT_DID_CLOSE, DidCloseTextDocumentParams, DidOpenTextDocumentParams, TEXT_DOCUMENT_DID_OPEN)
 
 import lsprotocol.types as lsp_types
-import time
+import uuid
+from tools.diagnostic_cache import LineDiagnosticCache
+from tools.scheduler import DiagnosticScheduler
+from tools.providers import DiagnosticProvider, EXECUTION, ProviderExecutor
+from tools.metrics import HandlerMetrics, handler_name
+
+logger = logging.getLogger(__name__)
+
+DIAGNOSTIC_IDENTIFIER = "copilot"
+STATS_COMMAND = "pygls.server.stats"
+METRICS_FILE = "metrics.jsonl"
+
+
+def is_scripture_document(uri: str) -> bool:
+    """
+    Is the document a .codex notebook or a .scripture file.
+    """
+    return ".codex" in uri or ".scripture" in uri
+
+
+def diagnostics_digest(diagnostics: List[lsp_types.Diagnostic]) -> str:
+    """
+    Short fingerprint of a list of diagnostics, so equal results get the same resultId part.
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    for diagnostic in diagnostics:
+        start, end = diagnostic.range.start, diagnostic.range.end
+        digest.update(repr((start.line, start.character, end.line, end.character, diagnostic.message,
+                            diagnostic.severity, diagnostic.source, diagnostic.code)).encode())
+    return digest.hexdigest()
+
+
+class DiagnosticReport:
+    """
+    The last diagnostics pulled for a document. `state` is what they were computed from
+    (document version and provider state), result_id is `state:digest`.
+    """
+    def __init__(self, state: str, diagnostics: List[lsp_types.Diagnostic]) -> None:
+        self.state = state
+        self.diagnostics = diagnostics
+        self.digest = diagnostics_digest(diagnostics)
+        self.result_id = f"{state}:{self.digest}"
+
+    def unchanged_since(self, previous_result_id: str) -> bool:
+        """
+        Whether a client holding previous_result_id already shows these diagnostics.
+        """
+        return bool(previous_result_id) and previous_result_id.rsplit(':', 1)[-1] == self.digest
 
 
 
 class ServerFunctions:
-    def __init__(self, server: LanguageServer, data_path: str):
+    def __init__(self, server: LanguageServer, data_path: str, diagnostic_delay: float = 0.3, metrics_interval: float = None,
+                 completion_deadline: float = 0.5):
         self.server = server
         self.completion_functions = []
+        self.completion_deadline = completion_deadline # seconds a completion request waits for slow completion functions
         self.diagnostic_functions = []
+        self.line_diagnostic_functions = []
+        self.line_cache = LineDiagnosticCache()
+        self.scheduler = DiagnosticScheduler(delay=diagnostic_delay) # debounces diagnostics per document
+        self.executor = ProviderExecutor()
+        self.provider_results: Dict[str, Dict[Callable, List[lsp_types.Diagnostic]]] = {} # uri -> latest diagnostics per provider
+        self.reports: Dict[str, DiagnosticReport] = {} # uri -> last pulled report
+        self.revisions: Dict[str, int] = {} # uri -> provider results that arrived after a pull (late lines)
         self.action_functions = []
         self.initialize_functions = []
         self.close_functions = []
         self.open_functions = []
+        self.shutdown_functions = []
+        self.watched_file_functions = [] # (glob pattern, function)
+        self.metrics = HandlerMetrics() # latency of every registered function, see the pygls.server.stats command
+        self.metrics_interval = metrics_interval # seconds between dumps of the metrics to data_path/metrics.jsonl, None to not dump
 
 
         self.completion = None
         self.diagnostic = None
+        self.document_diagnostic = None
+        self.workspace_diagnostic = None
         self.action = None
         self.data_path = data_path 
-        self.last_closed = time.time() # yes, none in quotes is intentional
     
-    def add_diagnostic(self, function: Callable):#, #trigger_characters: List):
-        self.diagnostic_functions.append((function, None))
+    def add_diagnostic(self, function: Callable, execution: EXECUTION = EXECUTION.CHEAP, deadline: float = None):#, #trigger_characters: List):
+        """
+        Adds a diagnostic over the whole document: function(ls, params, sf) -> List[Diagnostic].
+        execution is EXECUTION.CHEAP (on the event loop) or EXECUTION.THREAD (thread-safe, in a thread pool).
+        deadline is how many seconds the others wait for it before being published without it.
+        """
+        self.diagnostic_functions.append(DiagnosticProvider(function, execution, deadline))
+
+    def add_line_diagnostic(self, function: Callable, document_filter: Callable = None,
+                            execution: EXECUTION = EXECUTION.CHEAP, deadline: float = None, batch: Callable = None):
+        """
+        Adds a diagnostic that runs one line at a time: function(line_num, line) -> List[Diagnostic].
+        Its results are cached per line and only recomputed for the lines a change touches.
+        document_filter(uri) selects the documents it runs on (all documents by default).
+        execution also accepts EXECUTION.PROCESS for CPU-bound functions; they must be defined at module level.
+        batch([(line_num, line)]) -> per-line diagnostics, if given, analyzes many lines in one call.
+        """
+        self.line_diagnostic_functions.append(DiagnosticProvider(function, execution, deadline, document_filter, line=True, batch=batch))
+
+    def invalidate_line_diagnostics(self, function: Callable = None):
+        """
+        Forgets cached line diagnostics of a function (or all of them) after the state they depend on changed,
+        and gets the open documents' diagnostics updated: a pulling client is asked to pull again, otherwise
+        they are analyzed again and pushed.
+        """
+        self.line_cache.invalidate(function)
+        if self.uses_pull(self.server):
+            if self.reports:
+                self.refresh_diagnostics(self.server)
+            return
+        try:
+            documents = list(self.server.workspace.text_documents.values())
+        except RuntimeError:
+            return # not initialized yet, nothing is open
+        for document in documents:
+            params = lsp_types.DocumentDiagnosticParams(text_document=lsp_types.TextDocumentIdentifier(uri=document.uri))
+            self.scheduler.schedule(document.uri, document.version,
+                                    run=functools.partial(self.run_diagnostics, self.server, params, document.version))
 
     def add_completion(self, function: Callable, kind: lsp_types.CompletionItemKind = lsp_types.CompletionItemKind.Text):
+        """
+        Adds a completion function: function(ls, params, range, sf) -> List[CompletionItem], or a coroutine
+        function for slow ones. They run concurrently and the items of those that miss completion_deadline are left out.
+        """
         self.completion_functions.append((function, kind))
 
+    async def run_completion(self, ls, params, range, function: Callable) -> List[lsp_types.CompletionItem]:
+        with self.metrics.measure(handler_name('completion', function)):
+            items = function(ls, params, range, self)
+            if inspect.isawaitable(items): # slow completion functions may be coroutines
+                items = await items
+        return items
+
     def add_action(self, function: Callable, kind: lsp_types.CodeAction = lsp_types.CodeActionKind.QuickFix):
         self.action_functions.append((function, kind))
     
@@ -40,7 +154,184 @@ class ServerFunctions:
     def add_open_function(self, function: Callable):
         self.open_functions.append(function)
 
+    def add_shutdown_function(self, function: Callable):
+        self.shutdown_functions.append(function)
+
+    def add_watched_files(self, glob_pattern: str, function: Callable):
+        """
+        Asks the client to watch files matching glob_pattern (e.g. '**/*.dictionary');
+        function(ls, params: DidChangeWatchedFilesParams, sf) is called with their changes.
+        Only clients that can register watchers send them, see watches_files.
+        """
+        self.watched_file_functions.append((glob_pattern, function))
+
+    def watches_files(self, ls) -> bool:
+        """
+        Whether the client can watch files for the server (dynamic registration of workspace/didChangeWatchedFiles).
+        """
+        try:
+            capability = ls.client_capabilities.workspace.did_change_watched_files
+        except AttributeError:
+            return False
+        return capability is not None and bool(capability.dynamic_registration)
+
+    def register_watched_files(self, ls):
+        if not self.watched_file_functions or not self.watches_files(ls):
+            return
+        watchers = [lsp_types.FileSystemWatcher(glob_pattern=glob_pattern) for glob_pattern, _ in self.watched_file_functions]
+        ls.register_capability(lsp_types.RegistrationParams(registrations=[lsp_types.Registration(
+            id=str(uuid.uuid4()),
+            method=lsp_types.WORKSPACE_DID_CHANGE_WATCHED_FILES,
+            register_options=lsp_types.DidChangeWatchedFilesRegistrationOptions(watchers=watchers))]))
+
+    @staticmethod
+    def filter_errors(diagnostics: List[lsp_types.Diagnostic]) -> List[lsp_types.Diagnostic]:
+        error_diagnostics = [diagnostic for diagnostic in diagnostics if diagnostic.severity == DiagnosticSeverity.Error]
+        return error_diagnostics or diagnostics
+
+    def merged_diagnostics(self, document_uri: str) -> List[lsp_types.Diagnostic]:
+        """
+        The latest diagnostics of every provider for a document, in registration order.
+        """
+        results = self.provider_results.get(document_uri, {})
+        all_diagnostics = []
+        for provider in self.line_diagnostic_functions + self.diagnostic_functions:
+            all_diagnostics.extend(results.get(provider.function, []))
+        return self.filter_errors(all_diagnostics)
+
+    async def run_provider(self, ls, params, provider: DiagnosticProvider, version) -> List[lsp_types.Diagnostic]:
+        """
+        Runs one provider according to its execution and deadline. Line providers only analyze changed lines.
+        """
+        document_uri = params.text_document.uri
+        name = handler_name('diagnostic', provider.function)
+        if not provider.line:
+            with self.metrics.measure(name): # a missed deadline counts as a timeout
+                return await asyncio.wait_for(self.executor.submit(provider, ls, params, self), provider.deadline)
+
+        document = ls.workspace.get_document(document_uri)
+        generation, pending = self.line_cache.pending(document_uri, document, provider.function)
+        if pending:
+            future = self.executor.submit_lines(provider, pending)
+            try:
+                with self.metrics.measure(name):
+                    results = await asyncio.wait_for(asyncio.shield(future), provider.deadline)
+            except asyncio.TimeoutError:
+                # Keep the work: store it when it finishes and publish again if nothing changed meanwhile
+                future.add_done_callback(lambda done: self.on_late_lines(ls, params, provider, version, generation, pending, done))
+                raise
+            self.line_cache.apply(document_uri, provider.function, generation, pending, results)
+        return self.line_cache.collect(document_uri, provider.function)
+
+    def on_late_lines(self, ls, params, provider: DiagnosticProvider, version, generation, pending, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        document_uri = params.text_document.uri
+        self.line_cache.apply(document_uri, provider.function, generation, pending, future.result())
+        if self.uses_pull(ls):
+            document = ls.workspace.text_documents.get(document_uri)
+            if document is not None and document.version == version:
+                self.provider_results.setdefault(document_uri, {})[provider.function] = self.line_cache.collect(document_uri, provider.function)
+                self.revisions[document_uri] = self.revisions.get(document_uri, 0) + 1
+                self.refresh_diagnostics(ls)
+        elif self.scheduler.is_current(document_uri, version):
+            self.provider_results.setdefault(document_uri, {})[provider.function] = self.line_cache.collect(document_uri, provider.function)
+            self.publish_diagnostics(ls, document_uri, version, self.merged_diagnostics(document_uri))
+
+    async def run_diagnostics(self, ls, params, version, publish: bool = True):
+        """
+        Runs every provider that applies to the document concurrently, and publishes the merged
+        diagnostics each time one finishes. A provider that fails or misses its deadline keeps its previous results.
+        With publish=False the results are only stored in provider_results (pull diagnostics).
+        """
+        document_uri = params.text_document.uri
+        providers = [provider for provider in self.line_diagnostic_functions if provider.applies_to(document_uri)]
+        providers += self.diagnostic_functions
+        results = self.provider_results.setdefault(document_uri, {})
+        for provider in providers:
+            if provider.line:
+                # Until they are re-analyzed, show the unchanged lines' results at their new positions
+                results[provider.function] = self.line_cache.collect(document_uri, provider.function)
 
+        async def run_tracked(provider: DiagnosticProvider):
+            try:
+                return provider, await self.run_provider(ls, params, provider, version), None
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                return provider, None, error
+
+        tasks = [asyncio.ensure_future(run_tracked(provider)) for provider in providers]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                provider, diagnostics, error = await next_done
+                if isinstance(error, asyncio.TimeoutError):
+                    logger.warning("%s missed its %ss deadline for %s", provider.name, provider.deadline, document_uri)
+                    continue
+                if error is not None:
+                    logger.error("%s failed for %s", provider.name, document_uri, exc_info=error)
+                    continue
+                results[provider.function] = diagnostics
+                if publish and self.scheduler.is_current(document_uri, version):
+                    self.publish_diagnostics(ls, document_uri, version, self.merged_diagnostics(document_uri))
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def publish_diagnostics(self, ls, document_uri: str, version, diagnostics: List[lsp_types.Diagnostic]):
+        """
+        Publishes diagnostics if they were computed for the version of the document that is open now.
+        """
+        document = ls.workspace.text_documents.get(document_uri)
+        if document is None or (version is not None and document.version != version):
+            return
+        ls.publish_diagnostics(document_uri, diagnostics, version=version)
+
+    def uses_pull(self, ls) -> bool:
+        """
+        Whether the client pulls diagnostics (textDocument/diagnostic) instead of having them pushed.
+        """
+        try:
+            capabilities = ls.client_capabilities.text_document
+        except AttributeError:
+            return False
+        return capabilities is not None and capabilities.diagnostic is not None
+
+    def refresh_diagnostics(self, ls):
+        """
+        Asks a pulling client to pull diagnostics again, e.g. after results arrived late or the dictionary changed.
+        """
+        try:
+            workspace = ls.client_capabilities.workspace
+        except AttributeError:
+            return
+        if workspace is None or workspace.diagnostics is None or not workspace.diagnostics.refresh_support:
+            return
+        ls.lsp.send_request(lsp_types.WORKSPACE_DIAGNOSTIC_REFRESH)
+
+    def result_state(self, document_uri: str, version) -> str:
+        """
+        What a document's diagnostics depend on: its version, cache invalidations and late provider results.
+        """
+        return f"{version}.{self.line_cache.epoch}.{self.revisions.get(document_uri, 0)}"
+
+    async def pull_report(self, ls, params, previous_result_id: str = None) -> DiagnosticReport:
+        """
+        The document's diagnostic report, recomputed only if the document or provider state moved since the last pull.
+        """
+        document_uri = params.text_document.uri
+        document = ls.workspace.get_document(document_uri)
+        version = document.version
+        report = self.reports.get(document_uri)
+        if report is None or report.state != self.result_state(document_uri, version):
+            state = self.result_state(document_uri, version)
+            await self.run_diagnostics(ls, params, version, publish=False)
+            if document.version != version:
+                # edited while computing: report what we have, the next pull recomputes
+                state = f"{state}.stale"
+            report = DiagnosticReport(state, self.merged_diagnostics(document_uri))
+            self.reports[document_uri] = report
+        return report
 
     def start(self):
         @self.server.feature(
@@ -61,50 +352,136 @@ class ServerFunctions:
                         end=Position(line=start_line + idx, character=len(line) - 1),
                     )
                 for action_function in self.action_functions:
-                    items.extend(action_function[0](self.server, params, range, self))
+                    with self.metrics.measure(handler_name('action', action_function[0])):
+                        items.extend(action_function[0](self.server, params, range, self))
             return items
         self.action = actions
 
         @self.server.feature(lsp_types.TEXT_DOCUMENT_DID_CHANGE)
         def diagnostics(ls, params: lsp_types.DidChangeTextDocumentParams):
             document_uri = params.text_document.uri
-            all_diagnostics = []
-            for diagnostic_function in self.diagnostic_functions:
-                all_diagnostics.extend(diagnostic_function[0](ls, params, self))
-            error_diagnostics = [diagnostic for diagnostic in all_diagnostics if diagnostic.severity == DiagnosticSeverity.Error]
-            if error_diagnostics:
-                ls.publish_diagnostics(document_uri, error_diagnostics)
-            else:
-                ls.publish_diagnostics(document_uri, all_diagnostics)
+            version = params.text_document.version
+            # Track the edit right away; the analysis itself is debounced
+            self.line_cache.update(document_uri, params.content_changes, ls.workspace.get_document(document_uri))
+            if not self.uses_pull(ls):
+                self.scheduler.schedule(document_uri, version, run=lambda: self.run_diagnostics(ls, params, version))
         self.diagnostic = diagnostics
 
+        @self.server.feature(
+            lsp_types.TEXT_DOCUMENT_DIAGNOSTIC,
+            lsp_types.DiagnosticOptions(
+                identifier=DIAGNOSTIC_IDENTIFIER,
+                inter_file_dependencies=False,
+                workspace_diagnostics=True,
+            ),
+        )
+        async def document_diagnostic(ls, params: lsp_types.DocumentDiagnosticParams) -> lsp_types.DocumentDiagnosticReport:
+            report = await self.pull_report(ls, params)
+            if report.unchanged_since(params.previous_result_id):
+                return lsp_types.RelatedUnchangedDocumentDiagnosticReport(result_id=report.result_id)
+            return lsp_types.RelatedFullDocumentDiagnosticReport(items=report.diagnostics, result_id=report.result_id)
+        self.document_diagnostic = document_diagnostic
+
+        @self.server.feature(lsp_types.WORKSPACE_DIAGNOSTIC)
+        async def workspace_diagnostic(ls, params: lsp_types.WorkspaceDiagnosticParams) -> lsp_types.WorkspaceDiagnosticReport:
+            previous = {result.uri: result.value for result in params.previous_result_ids or []}
+            items = []
+            for document_uri in list(ls.workspace.text_documents):
+                document_params = lsp_types.DocumentDiagnosticParams(
+                    text_document=lsp_types.TextDocumentIdentifier(uri=document_uri))
+                report = await self.pull_report(ls, document_params)
+                version = ls.workspace.get_document(document_uri).version
+                if report.unchanged_since(previous.get(document_uri)):
+                    items.append(lsp_types.WorkspaceUnchangedDocumentDiagnosticReport(
+                        uri=document_uri, version=version, result_id=report.result_id))
+                else:
+                    items.append(lsp_types.WorkspaceFullDocumentDiagnosticReport(
+                        uri=document_uri, version=version, items=report.diagnostics, result_id=report.result_id))
+            return lsp_types.WorkspaceDiagnosticReport(items=items)
+        self.workspace_diagnostic = workspace_diagnostic
+
         @self.server.feature(lsp_types.TEXT_DOCUMENT_COMPLETION, lsp_types.CompletionOptions(trigger_characters=[""]))
-        def completions(ls, params: lsp_types.CompletionParams):
+        async def completions(ls, params: lsp_types.CompletionParams):
             range = Range(start=params.position,
                           end=Position(line=params.position.line, character=params.position.character + 5))
+            tasks = [asyncio.ensure_future(self.run_completion(ls, params, range, function))
+                     for function, _ in self.completion_functions]
+            if not tasks:
+                return lsp_types.CompletionList(items=[], is_incomplete=False)
+            done, pending = await asyncio.wait(tasks, timeout=self.completion_deadline)
             completions = []
-            for completion_function in self.completion_functions:
-                completions.extend(completion_function[0](ls, params, range, self))
-            return lsp_types.CompletionList(items = completions, is_incomplete=False)
+            for task, (function, _) in zip(tasks, self.completion_functions):
+                if task in pending:
+                    task.cancel()
+                    self.metrics.timeout(handler_name('completion', function))
+                    logger.warning("%s missed the %ss completion deadline", handler_name('completion', function), self.completion_deadline)
+                elif task.exception() is not None:
+                    logger.error("%s failed", handler_name('completion', function), exc_info=task.exception())
+                else:
+                    completions.extend(task.result())
+            # incomplete when a function was left out, so the client asks again as the user types
+            return lsp_types.CompletionList(items = completions, is_incomplete=bool(pending))
         self.completion = completions
 
         @self.server.feature(lsp_types.INITIALIZED)
         def initialize(ls, params: lsp_types.InitializedParams):
             self.initialize(ls, params, self)
             for function in self.initialize_functions:
-                function(ls, params, self)
+                with self.metrics.measure(handler_name('initialize', function)):
+                    function(ls, params, self)
+            self.register_watched_files(ls)
+            if self.metrics_interval:
+                self.metrics.start_dump(os.path.join(self.data_path, METRICS_FILE), self.metrics_interval)
+
+        @self.server.feature(lsp_types.WORKSPACE_DID_CHANGE_WATCHED_FILES)
+        def on_watched_files(ls, params: lsp_types.DidChangeWatchedFilesParams):
+            for _, function in self.watched_file_functions:
+                with self.metrics.measure(handler_name('watched_files', function)):
+                    function(ls, params, self)
         
         @self.server.feature(TEXT_DOCUMENT_DID_CLOSE)
         def on_close(ls, params: DidCloseTextDocumentParams):
-            if time.time() - self.last_closed > 10: # fix bug where pygls calls close many times
-                self.last_closed = time.time()
-                for function in self.close_functions:
+            self.scheduler.cancel(params.text_document.uri)
+            self.provider_results.pop(params.text_document.uri, None)
+            self.reports.pop(params.text_document.uri, None)
+            self.revisions.pop(params.text_document.uri, None)
+            self.line_cache.close(params.text_document.uri)
+            # Close functions are called for every closed document (every cell of a notebook); slow ones
+            # should hand their work to a tools.job_queue.JobQueue, which coalesces repeated closes of a file
+            for function in self.close_functions:
+                with self.metrics.measure(handler_name('close', function)):
                     function(ls, params, self)
         
+        @self.server.feature(lsp_types.SHUTDOWN)
+        def on_shutdown(ls, params):
+            for function in self.shutdown_functions:
+                function(ls, params, self)
+            self.executor.shutdown()
+            self.metrics.stop_dump()
+            if self.metrics_interval:
+                self.metrics.dump(os.path.join(self.data_path, METRICS_FILE))
+
         @self.server.feature(TEXT_DOCUMENT_DID_OPEN)
         def on_open(ls, params: DidOpenTextDocumentParams):
+            document_uri = params.text_document.uri
+            version = params.text_document.version
+            self.line_cache.close(document_uri)
             for function in self.open_functions:
-                function(ls, params, self)
+                with self.metrics.measure(handler_name('open', function)):
+                    function(ls, params, self)
+            self.reports.pop(document_uri, None)
+            if self.uses_pull(ls):
+                return # the client pulls the whole document's diagnostics itself
+            # Analyze the whole document once when it is opened
+            self.scheduler.schedule(document_uri, version, run=lambda: self.run_diagnostics(ls, params, version))
+
+        @self.server.command(STATS_COMMAND)
+        def stats(ls, args):
+            """
+            A snapshot of the metrics of every registered function: call counts, errors, deadline
+            timeouts and latency percentiles and histograms, in milliseconds.
+            """
+            return self.metrics.snapshot()
 
     def initialize(self, server, params, fs):        
         self.data_path = server.workspace.root_path + self.data_path
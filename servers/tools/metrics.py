@@ -0,0 +1,168 @@
+"""
+Call counts and latency histograms of the server's handlers
+"""
+import asyncio
+import bisect
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# upper bounds of the latency buckets in milliseconds; the last bucket holds everything slower
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+def handler_name(kind: str, function: Callable) -> str:
+    """
+    the name a handler's metrics are kept under, e.g. 'completion/ServableSpelling.spell_completion'
+    """
+    return f"{kind}/{getattr(function, '__qualname__', repr(function))}"
+
+
+class HandlerStats:
+    """
+    The calls of one handler: how many, how many failed or missed their deadline, and how long they took.
+    """
+    __slots__ = ('count', 'errors', 'timeouts', 'total', 'max', 'buckets')
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.total = 0.0  # milliseconds
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def record(self, milliseconds: float, error: bool = False) -> None:
+        self.count += 1
+        self.errors += error
+        self.total += milliseconds
+        self.max = max(self.max, milliseconds)
+        self.buckets[bisect.bisect_left(BUCKETS_MS, milliseconds)] += 1
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """
+        estimates the latency below which `fraction` of the calls fall, interpolating inside its bucket
+        """
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            if count and seen + count >= rank:
+                upper = min(BUCKETS_MS[index], self.max) if index < len(BUCKETS_MS) else self.max
+                lower = min(BUCKETS_MS[index - 1], upper) if index > 0 else 0.0
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.max
+
+    def snapshot(self) -> Dict:
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'mean_ms': self.total / self.count if self.count else None,
+            'p50_ms': self.percentile(0.5),
+            'p90_ms': self.percentile(0.9),
+            'p99_ms': self.percentile(0.99),
+            'max_ms': self.max,
+            # [upper bound in ms (None: slower than the last bound), calls]
+            'histogram': [[bound, count] for bound, count in zip(list(BUCKETS_MS) + [None], self.buckets) if count],
+        }
+
+
+class HandlerMetrics:
+    """
+    Per handler call counts, latency histograms, error and timeout counts, kept in memory.
+
+    ServerFunctions times every function registered with it (completion, diagnostics, code actions,
+    open, close, initialize...) and serves a snapshot through the pygls.server.stats command.
+    Handlers are recorded from the event loop and from diagnostic threads, so updates take a lock.
+
+    Example Usage:
+        metrics = HandlerMetrics()
+        with metrics.measure('completion/ServableSpelling.spell_completion'):
+            items = spelling.spell_completion(ls, params, range, sf)
+        metrics.snapshot()
+    """
+    def __init__(self) -> None:
+        self.handlers: Dict[str, HandlerStats] = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.dump_task: Optional[asyncio.Task] = None
+
+    def stats(self, name: str) -> HandlerStats:
+        stats = self.handlers.get(name)
+        if stats is None:
+            stats = self.handlers[name] = HandlerStats()
+        return stats
+
+    def record(self, name: str, seconds: float, error: bool = False) -> None:
+        with self.lock:
+            self.stats(name).record(seconds * 1000, error)
+
+    def timeout(self, name: str) -> None:
+        with self.lock:
+            self.stats(name).timeouts += 1
+
+    @contextlib.contextmanager
+    def measure(self, name: str):
+        """
+        times the block as one call of the handler `name`. An asyncio.TimeoutError (a missed deadline) counts
+        as a timeout and any other exception as an error; both are re-raised.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except asyncio.TimeoutError:
+            self.timeout(name)
+            raise
+        except Exception:
+            self.record(name, time.perf_counter() - start, error=True)
+            raise
+        self.record(name, time.perf_counter() - start)
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            handlers = {name: stats.snapshot() for name, stats in sorted(self.handlers.items())}
+        return {'time': time.time(), 'uptime_s': time.time() - self.started, 'handlers': handlers}
+
+    def reset(self) -> None:
+        with self.lock:
+            self.handlers = {}
+            self.started = time.time()
+
+    # periodic dumps
+
+    def dump(self, path: str) -> None:
+        """
+        appends a snapshot to a JSONL file
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'a') as file:
+            file.write(json.dumps(self.snapshot(), separators=(',', ':')) + '\n')
+
+    def start_dump(self, path: str, interval: float) -> None:
+        """
+        appends a snapshot to path every `interval` seconds, on the running event loop
+        """
+        self.stop_dump()
+        self.dump_task = asyncio.ensure_future(self.dump_periodically(path, interval))
+
+    async def dump_periodically(self, path: str, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.dump(path)
+            except OSError:
+                logger.exception("Could not write the metrics to %s", path)
+
+    def stop_dump(self) -> None:
+        if self.dump_task is not None:
+            self.dump_task.cancel()
+            self.dump_task = None
@@ -0,0 +1,97 @@
+"""
+Prefix index for ranked completions
+"""
+import bisect
+import heapq
+from typing import Dict, List, Tuple
+
+# sorts after any character, so prefix + PREFIX_END bounds every word starting with prefix
+PREFIX_END = chr(0x10FFFF)
+
+
+class PrefixIndex:
+    """
+    A sorted array of words searched with bisect, returning the most frequently used words
+    that start with a prefix.
+
+    Words added in bulk are sorted once, on the next lookup. Ranked results are cached per prefix
+    and a changed word only drops the entries of its own prefixes.
+
+    Example Usage:
+        index = PrefixIndex()
+        index.add('beginning')
+        index.add('begat')
+        index.set_frequency('begat', 3)
+        index.complete('beg')  # ['begat', 'beginning']
+    """
+    def __init__(self, cache_size: int = 4096) -> None:
+        self.words: List[str] = []
+        self.pending: List[str] = []  # added but not yet merged into the sorted words
+        self.frequencies: Dict[str, int] = {}
+        self.cache: Dict[str, Tuple[int, List[str]]] = {}  # prefix -> (limit, completions)
+        self.cache_size = cache_size
+
+    def __len__(self) -> int:
+        return len(self.words) + len(self.pending)
+
+    def sort(self) -> None:
+        """
+        merges pending words into the sorted array
+        """
+        if self.pending:
+            self.words.extend(self.pending)
+            self.words.sort()
+            self.pending = []
+
+    def invalidate(self, word: str) -> None:
+        """
+        drops the cached completions of every prefix of the word
+        """
+        if not self.cache:
+            return
+        for i in range(len(word) + 1):
+            self.cache.pop(word[:i], None)
+
+    def add(self, word: str, frequency: int = 0) -> None:
+        if word in self.frequencies:
+            return
+        self.pending.append(word)
+        self.frequencies[word] = frequency
+        self.invalidate(word)
+
+    def remove(self, word: str) -> None:
+        if word not in self.frequencies:
+            return
+        self.sort()
+        i = bisect.bisect_left(self.words, word)
+        if i < len(self.words) and self.words[i] == word:
+            del self.words[i]
+        del self.frequencies[word]
+        self.invalidate(word)
+
+    def set_frequency(self, word: str, frequency: int) -> None:
+        if word in self.frequencies and self.frequencies[word] != frequency:
+            self.frequencies[word] = frequency
+            self.invalidate(word)
+
+    def complete(self, prefix: str, limit: int = 5) -> List[str]:
+        """
+        returns up to `limit` words that start with (and are longer than) the prefix,
+        most frequent first, then shortest, then alphabetical
+        """
+        cached = self.cache.get(prefix)
+        if cached is not None and cached[0] >= limit:
+            # the ranking is a total order, so a longer cached list starts with the same words
+            return cached[1][:limit]
+
+        self.sort()
+        start = bisect.bisect_right(self.words, prefix)  # skips the prefix itself
+        end = bisect.bisect_left(self.words, prefix + PREFIX_END, start)
+        frequencies = self.frequencies
+        completions = heapq.nsmallest(
+            limit, self.words[start:end], key=lambda word: (-frequencies[word], len(word), word))
+
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache[prefix] = (limit, completions)
+        return completions[:]
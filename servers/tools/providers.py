@@ -0,0 +1,129 @@
+import asyncio
+import functools
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from enum import Enum
+from typing import Callable, List, Optional, Tuple
+
+from lsprotocol.types import Diagnostic
+
+
+class EXECUTION(str, Enum):
+    CHEAP = "cheap"  # fast enough to run on the event loop
+    THREAD = "thread"  # thread-safe, runs in a thread pool (good for work that releases the GIL or waits)
+    PROCESS = "process"  # CPU-bound, runs in a process pool; the function must be picklable (module level)
+
+
+class DiagnosticProvider:
+    """
+    A registered diagnostic function and how to run it.
+
+    Attributes:
+        function (Callable): The diagnostic function. Line providers take (line_num, line),
+            document providers take (ls, params, sf).
+        execution (EXECUTION): Where the function runs.
+        deadline (float): Seconds to wait for a result before publishing without it. None waits forever.
+        document_filter (Callable): uri -> bool, the documents the provider runs on. None runs on all.
+        line (bool): Whether this is a line provider.
+        batch (Callable): Optional batch form of a line provider, [(line_num, line)] -> per-line diagnostics.
+            Used instead of calling function once per line.
+    """
+    def __init__(self, function: Callable, execution: EXECUTION = EXECUTION.CHEAP, deadline: Optional[float] = None,
+                 document_filter: Optional[Callable] = None, line: bool = False, batch: Optional[Callable] = None) -> None:
+        if execution == EXECUTION.PROCESS and not line:
+            raise ValueError("Only line diagnostics can run in a process pool")
+        self.function = function
+        self.execution = EXECUTION(execution)
+        self.deadline = deadline
+        self.document_filter = document_filter
+        self.line = line
+        self.batch = batch
+
+    def applies_to(self, uri: str) -> bool:
+        return self.document_filter is None or self.document_filter(uri)
+
+    @property
+    def name(self) -> str:
+        return getattr(self.function, '__qualname__', repr(self.function))
+
+
+def run_lines(function: Callable, lines: List[Tuple[int, str]]) -> List[List[Diagnostic]]:
+    """
+    Runs a line provider on (line_num, line) pairs. Module level so process pools can pickle it.
+    """
+    return [function(line_num, line) for line_num, line in lines]
+
+
+class ProviderExecutor:
+    """
+    Runs diagnostic providers according to their EXECUTION, off the event loop when they ask for it.
+    The pools are created on first use. Worker processes are spawned rather than forked: a fork of the
+    multithreaded server could inherit locks held by its other threads and deadlock.
+    """
+    def __init__(self, max_threads: Optional[int] = None, max_processes: Optional[int] = None, min_chunk: int = 64) -> None:
+        self.max_threads = max_threads
+        self.max_processes = max_processes or max(1, (os.cpu_count() or 2) - 1)
+        self.min_chunk = min_chunk  # fewest lines sent to a worker process at once
+        self.threads = None
+        self.processes = None
+
+    def thread_pool(self) -> ThreadPoolExecutor:
+        if self.threads is None:
+            self.threads = ThreadPoolExecutor(max_workers=self.max_threads, thread_name_prefix="diagnostics")
+        return self.threads
+
+    def process_pool(self) -> ProcessPoolExecutor:
+        if self.processes is None:
+            self.processes = ProcessPoolExecutor(max_workers=self.max_processes, mp_context=multiprocessing.get_context('spawn'))
+        return self.processes
+
+    def submit(self, provider: DiagnosticProvider, *args) -> asyncio.Future:
+        """
+        Runs a document provider with the given arguments and returns a future of its diagnostics.
+        """
+        loop = asyncio.get_running_loop()
+        call = functools.partial(provider.function, *args)
+        if provider.execution == EXECUTION.THREAD:
+            return loop.run_in_executor(self.thread_pool(), call)
+        future = loop.create_future()
+        try:
+            future.set_result(call())
+        except Exception as error:
+            future.set_exception(error)
+        return future
+
+    def submit_lines(self, provider: DiagnosticProvider, lines: List[Tuple[int, str]]) -> asyncio.Future:
+        """
+        Runs a line provider on (line_num, line) pairs and returns a future of the per-line diagnostics.
+        In a process pool the lines are split in chunks across the workers.
+        """
+        loop = asyncio.get_running_loop()
+        call = provider.batch or functools.partial(run_lines, provider.function)
+        if provider.execution == EXECUTION.PROCESS:
+            size = max(self.min_chunk, math.ceil(len(lines) / self.max_processes))
+            chunks = [loop.run_in_executor(self.process_pool(), call, lines[i:i + size])
+                      for i in range(0, len(lines), size)]
+            gathered = asyncio.gather(*chunks)
+            return asyncio.ensure_future(self.flatten(gathered))
+        if provider.execution == EXECUTION.THREAD:
+            return loop.run_in_executor(self.thread_pool(), call, lines)
+        future = loop.create_future()
+        try:
+            future.set_result(call(lines))
+        except Exception as error:
+            future.set_exception(error)
+        return future
+
+    @staticmethod
+    async def flatten(gathered) -> List[List[Diagnostic]]:
+        return [result for chunk in await gathered for result in chunk]
+
+    def shutdown(self) -> None:
+        if self.threads is not None:
+            self.threads.shutdown(wait=False, cancel_futures=True)
+            self.threads = None
+        if self.processes is not None:
+            self.processes.shutdown(wait=False, cancel_futures=True)
+            self.processes = None
@@ -0,0 +1,68 @@
+import asyncio
+import inspect
+import logging
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class DiagnosticScheduler:
+    """
+    Debounces diagnostic runs per document.
+
+    Every change schedules a run for the document's new version. A run waits `delay` seconds
+    first, so a burst of edits only runs once. Scheduling a newer version cancels the pending or
+    in-flight run of the same document, and results are only published if they were computed
+    for the latest version.
+
+    Example Usage:
+        scheduler = DiagnosticScheduler(delay=0.3)
+        scheduler.schedule(uri, version, run=lambda: compute(uri), publish=lambda result: send(uri, result))
+    """
+    def __init__(self, delay: float = 0.3) -> None:
+        self.delay = delay
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.versions: Dict[str, Any] = {}
+
+    def is_current(self, uri: str, version) -> bool:
+        return uri in self.versions and self.versions[uri] == version
+
+    def schedule(self, uri: str, version, run: Callable, publish: Callable = None) -> asyncio.Task:
+        """
+        Schedules run() for a document version; publish(result) is called if it is still the latest one.
+        run may be a regular function or return an awaitable, and may publish by itself (see is_current).
+        """
+        self.versions[uri] = version
+        self.cancel_task(uri)
+        task = asyncio.ensure_future(self.run(uri, version, run, publish))
+        self.tasks[uri] = task
+        return task
+
+    async def run(self, uri: str, version, run: Callable, publish: Callable = None) -> None:
+        try:
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            result = run()
+            if inspect.isawaitable(result):
+                result = await result
+            if publish is not None and self.is_current(uri, version):
+                publish(result)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Diagnostics failed for %s", uri)
+        finally:
+            if self.tasks.get(uri) is asyncio.current_task():
+                del self.tasks[uri]
+
+    def cancel_task(self, uri: str) -> None:
+        task = self.tasks.pop(uri, None)
+        if task is not None and not task.done():
+            task.cancel()
+
+    def cancel(self, uri: str) -> None:
+        """
+        Cancels any run for the document and forgets it, e.g. when it is closed.
+        """
+        self.cancel_task(uri)
+        self.versions.pop(uri, None)
@@ -0,0 +1,90 @@
+"""
+Cache of semantic search results
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+
+def normalize_query(query: str) -> str:
+    """
+    lowercases a query and collapses its whitespace, so equivalent queries share a cache entry
+    """
+    return ' '.join(query.lower().split())
+
+
+class SearchCache:
+    """
+    An LRU cache with a time to live for the results of a slow search function, e.g. DataBase.search.
+
+    Results are keyed by normalized query, limit and the index generation, so they are dropped
+    as soon as the index changes. Searches run in a worker thread; concurrent requests for the
+    same key wait for the one search in flight instead of starting their own.
+
+    Example Usage:
+        cache = SearchCache(database.search, generation=lambda: database.generation)
+        results = await cache.search('in the beginning', limit=2)
+    """
+    def __init__(self, function: Callable, generation: Callable = None, max_size: int = 256, ttl: float = 300) -> None:
+        self.function = function
+        self.generation = generation or (lambda: 0)
+        self.max_size = max_size
+        self.ttl = ttl
+        self.results: OrderedDict = OrderedDict()  # key -> (time, results)
+        self.in_flight: Dict[tuple, asyncio.Future] = {}
+        self.current_generation = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search")
+
+    def key(self, query: str, limit: int) -> tuple:
+        return normalize_query(query), limit, self.generation()
+
+    def get(self, key: tuple) -> Optional[List]:
+        if key[2] != self.current_generation:
+            self.results.clear()  # the index changed, nothing cached is valid anymore
+            self.current_generation = key[2]
+            return None
+        cached = self.results.get(key)
+        if cached is None:
+            return None
+        stored_at, results = cached
+        if time.monotonic() - stored_at > self.ttl:
+            del self.results[key]
+            return None
+        self.results.move_to_end(key)
+        return results
+
+    def put(self, key: tuple, results: List) -> None:
+        if key[2] != self.generation():
+            return  # the index changed while searching
+        self.results[key] = (time.monotonic(), results)
+        self.results.move_to_end(key)
+        if len(self.results) > self.max_size:
+            self.results.popitem(last=False)
+
+    async def search(self, query: str, limit: int = 1) -> List:
+        key = self.key(query, limit)
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        future = self.in_flight.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.executor, self.function, query, limit)
+            self.in_flight[key] = future
+            future.add_done_callback(lambda done: self.finish(key, done))
+        # shielded, so a cancelled request does not cancel the search others wait for
+        return await asyncio.shield(future)
+
+    def finish(self, key: tuple, future: asyncio.Future) -> None:
+        if self.in_flight.get(key) is future:
+            del self.in_flight[key]
+        if not future.cancelled() and future.exception() is None:
+            self.put(key, future.result())
+
+    def clear(self) -> None:
+        self.results.clear()
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
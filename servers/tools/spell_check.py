@@ -1,16 +1,24 @@
 """
 Spell checking
 """
+import asyncio
 import json
 import os
-from typing import List, Dict
+import time
+from typing import Iterable, List, Dict, Tuple
+from collections import Counter
 import uuid
 import expirements.hash_check as hash_check
-import tools.edit_distance as edit_distance
+from tools.symspell import SymSpellIndex
+from tools.prefix_index import PrefixIndex
+from tools.dictionary_journal import DictionaryJournal, write_json_atomic
+from tools.dictionary_store import DictionaryStore, LazyEntry, entry_template, source_signature, write_store
 # from codex_types.types import Dictionary as DictionaryType
 # from codex_types.types import DictionaryEntry
 import re
 import string
+from enum import Enum
+import numpy as np
 
 
 translator = str.maketrans('', '', string.punctuation)
@@ -24,10 +32,70 @@ def remove_punctuation(text: str) -> str:
     return text.translate(translator).strip()
 
 
+def normalize(word: str) -> str:
+    """
+    normalizes a word for headword lookups (lowercased, punctuation removed)
+    """
+    return remove_punctuation(word.lower())
+
+
+def entry_frequency(entry: Dict) -> int:
+    """
+    returns the usage frequency stored in an entry's metadata
+    """
+    if isinstance(entry, LazyEntry) and not entry.loaded:
+        return entry.frequency
+    try:
+        return int(entry['metadata']['extra'].get('frequency', 0))
+    except (KeyError, TypeError, AttributeError, ValueError):
+        return 0
+
+
 class Dictionary():
-    def __init__(self, project_path) -> None:
-        self.path = project_path + '/project.dictionary' # TODO: #4 Use all .dictionary files in drafts directory
-        self.dictionary = self.load_dictionary()  # load the .dictionary (json file)
+    """
+    The project dictionary and its lookup indexes.
+
+    By default every change rewrites the dictionary file. With journal=True changes are appended
+    to `project.dictionary.journal` instead, and written to the dictionary file (compacted) after
+    `compact_after` changes, `compact_interval` seconds after the first pending change, or on close.
+    The interval is timed on the running event loop (the server); without one the next change after
+    the interval compacts.
+
+    With binary=True the dictionary is loaded from a compact copy, `project.dictionary.bin`
+    (see tools.dictionary_store), whose entries are only decoded when they are used. The copy is
+    rebuilt whenever the json file changed; the json file stays the source of truth.
+
+    See tools.dictionary_set for all the .dictionary files of a project.
+    """
+    def __init__(self, project_path, journal: bool = False, compact_after: int = 1000, compact_interval: float = 30,
+                 binary: bool = False, file_name: str = 'project.dictionary') -> None:
+        self.path = os.path.join(project_path, file_name)
+        self.binary_path = self.path + '.bin' if binary else None
+        self.store = None
+        self.dictionary = self.load_compact() if binary else self.load_dictionary()  # load the .dictionary (json file)
+        self.signature = self.file_signature()  # the version of the file the entries come from
+        self.headwords: Dict[str, List[Dict]] = {}  # normalized headword -> entries
+        self.indexes = []  # suggestion indexes kept in sync with the headwords, see attach
+        self.prefixes = PrefixIndex()
+        self.attach(self.prefixes)
+        for entry in self.dictionary['entries']:
+            self.index_entry(entry)
+        # packed perceptual hashes, aligned with self.dictionary['entries']
+        if self.store is not None:
+            self._hashes = np.array(self.store.hashes, dtype=np.uint64)
+        else:
+            self._hashes = self.entry_hashes(self.dictionary['entries'])
+        self._hash_count = len(self._hashes)
+        self.journal = None
+        self.compact_after = compact_after
+        self.compact_interval = compact_interval
+        self.last_compacted = time.time()
+        self.compact_timer = None  # asyncio.TimerHandle of the scheduled compaction
+        if journal:
+            self.journal = DictionaryJournal(self.path + '.journal')
+            for record in self.journal.records():
+                self.apply(record)
+        self.prefixes.sort()
     
     def load_dictionary(self) -> Dict:
         """
@@ -47,67 +115,440 @@ class Dictionary():
                 json.dump(new_dict, file)
             return new_dict
 
+    def load_compact(self) -> Dict:
+        """
+        loads the dictionary from its compact copy, rebuilding the copy from the json file if it is out of date
+        """
+        self.store = DictionaryStore.open(self.binary_path, self.path)
+        if self.store is None:
+            document = self.load_dictionary()
+            entries = document['entries']
+            try:
+                write_store(self.binary_path, self.path, document, self.entry_hashes(entries), [entry_frequency(entry) for entry in entries])
+            except OSError:
+                pass  # the json file is enough, the copy is only there to load faster
+            return document
+        document = dict(self.store.document)
+        document['entries'] = self.store.entries()
+        return document
+
+    def save_compact(self) -> None:
+        """
+        rewrites the compact copy from the dictionary in memory
+        """
+        entries = [entry.load() if isinstance(entry, LazyEntry) else entry for entry in self.dictionary['entries']]
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+        write_store(self.binary_path, self.path, dict(self.dictionary, entries=entries), self.hashes,
+                    [entry_frequency(entry) for entry in entries])
+
+    @staticmethod
+    def entry_hashes(entries: List[Dict]) -> np.ndarray:
+        return np.array([hash_check.hash_to_int(entry.get('hash')) for entry in entries], dtype=np.uint64)
+
     def save_dictionary(self) -> None:
-        with open(self.path, 'w') as file:
-            json.dump(self.dictionary, file, indent=2)
+        write_json_atomic(self.path, self.dictionary, indent=2, default=dict)
+        self.signature = self.file_signature()
+
+    def file_signature(self):
+        """
+        (mtime, size) of the dictionary file, None if it is missing
+        """
+        try:
+            return source_signature(self.path)
+        except OSError:
+            return None
+
+    def is_modified(self) -> bool:
+        """
+        checks if another program changed the dictionary file since it was loaded or saved
+        """
+        return self.file_signature() != self.signature
+
+    def reload(self) -> bool:
+        """
+        re-reads the dictionary file after another program changed it, re-indexing only the entries
+        that were added, removed or edited. Changes still in the journal are applied again on top.
+        Returns whether any entry changed.
+        """
+        signature = self.file_signature()
+        with open(self.path, 'r') as file:
+            document = json.load(file)
+        entries = document.get('entries', [])
+
+        def entry_key(entry):
+            return entry.get('id') or entry['headWord']
+
+        current = {}
+        for entry in self.dictionary['entries']:
+            current.setdefault(entry_key(entry), []).append(entry)
+        added = []
+        for entry in entries:
+            known = current.get(entry_key(entry))
+            if known and dict(known[0]) == entry:
+                known.pop(0)  # unchanged, keep the indexed entry
+            else:
+                added.append(entry)
+        removed = {id(entry) for stale in current.values() for entry in stale}
+
+        for entry in self.dictionary['entries']:
+            if id(entry) in removed:
+                self.unindex_entry(entry)
+        if removed:
+            self.filter_entries(lambda entry: id(entry) not in removed)
+        for entry in added:
+            self.add_entry(entry)
+        self.dictionary = dict(document, entries=self.dictionary['entries'])
+        self.signature = signature
+        if self.journal is not None:
+            for record in self.journal.records():
+                self.apply(record)
+        return bool(added or removed)
+
+    def persist(self, *records: Dict) -> None:
+        """
+        saves changes: appended to the journal if there is one, otherwise by rewriting the dictionary file
+        """
+        if not records:
+            return
+        if self.journal is None:
+            self.save_dictionary()
+            return
+        self.journal.append(*records)
+        if self.journal.count >= self.compact_after or time.time() - self.last_compacted >= self.compact_interval:
+            self.compact()
+        else:
+            self.schedule_compaction()
+
+    def schedule_compaction(self) -> None:
+        """
+        compacts the journal compact_interval seconds from now, if no compaction is scheduled yet
+        and this runs on an event loop
+        """
+        if self.compact_timer is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self.compact_timer = loop.call_later(self.compact_interval, self.compact_pending)
+
+    def compact_pending(self) -> None:
+        self.compact_timer = None
+        if self.journal is not None and self.journal.count:
+            self.compact()
+
+    def compact(self) -> None:
+        """
+        writes the dictionary file and empties the journal
+        """
+        if self.compact_timer is not None:
+            self.compact_timer.cancel()
+            self.compact_timer = None
+        self.save_dictionary()
+        self.last_compacted = time.time()
+        if self.journal is not None:
+            self.journal.clear()
+
+    def close(self) -> None:
+        """
+        compacts pending journal records and refreshes the compact copy, e.g. on shutdown
+        """
+        if self.compact_timer is not None:
+            self.compact_timer.cancel()
+            self.compact_timer = None
+        if self.journal is not None:
+            if self.journal.count:
+                self.compact()
+            self.journal.close()
+        if self.binary_path is not None and not DictionaryStore.is_current(self.binary_path, self.path):
+            try:
+                self.save_compact()
+            except OSError:
+                pass
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+    def apply(self, record: Dict) -> None:
+        """
+        applies a journal record to the dictionary in memory
+        """
+        op = record.get('op')
+        if op == 'define':
+            entry = record['entry']
+            if not self.has_headword(entry['headWord']):
+                self.add_entry(entry)
+        elif op == 'remove':
+            self.remove_entries(record['headWord'])
+        elif op == 'frequency':
+            self.set_frequency(record['headWord'], record['frequency'])
+
+    def index_entry(self, entry: Dict) -> None:
+        """
+        adds an entry to the headword index
+        """
+        key = normalize(entry['headWord'])
+        if key not in self.headwords:
+            self.headwords[key] = []
+            for index in self.indexes:
+                index.add(key)
+        self.headwords[key].append(entry)
+        if entry_frequency(entry):
+            self.prefixes.set_frequency(key, self.frequency(key))
+
+    def unindex_entry(self, entry: Dict) -> None:
+        """
+        removes an entry from the headword index
+        """
+        key = normalize(entry['headWord'])
+        entries = [indexed for indexed in self.headwords.get(key, []) if indexed is not entry]
+        if entries:
+            self.headwords[key] = entries
+            self.prefixes.set_frequency(key, self.frequency(key))
+        elif key in self.headwords:
+            del self.headwords[key]
+            for index in self.indexes:
+                index.remove(key)
+
+    def attach(self, index) -> None:
+        """
+        keeps a suggestion index (anything with add/remove, e.g. SymSpellIndex) in sync with the normalized headwords
+        """
+        for key in self.headwords:
+            index.add(key)
+        self.indexes.append(index)
+
+    def detach(self, index) -> None:
+        """
+        stops updating a suggestion index
+        """
+        self.indexes.remove(index)
+
+    @property
+    def hashes(self) -> np.ndarray:
+        """
+        the stored hashes as a uint64 array, in entry order
+        """
+        return self._hashes[:self._hash_count]
+
+    def append_hash(self, value) -> None:
+        """
+        appends a hash to the packed hash array, growing it geometrically
+        """
+        if self._hash_count == len(self._hashes):
+            grown = np.zeros(max(16, 2 * len(self._hashes)), dtype=np.uint64)
+            grown[:self._hash_count] = self._hashes[:self._hash_count]
+            self._hashes = grown
+        self._hashes[self._hash_count] = hash_check.hash_to_int(value)
+        self._hash_count += 1
+
+    def nearest(self, word_hash, limit: int = 5) -> List[Tuple[str, int]]:
+        """
+        returns up to `limit` (headWord, distance) pairs with the closest hashes
+        """
+        distances = hash_check.hamming_distances(hash_check.hash_to_int(word_hash), self.hashes)
+        if len(distances) > limit:
+            kth = distances[np.argpartition(distances, limit - 1)[limit - 1]]
+            candidates = np.flatnonzero(distances <= kth)
+        else:
+            candidates = np.arange(len(distances))
+        # sort by distance, keeping dictionary order between equal distances
+        candidates = candidates[np.lexsort((candidates, distances[candidates]))][:limit]
+        entries = self.dictionary['entries']
+        return [(entries[i]['headWord'], int(distances[i])) for i in candidates]
+
+    def is_known(self, word: str) -> bool:
+        """
+        checks if a word is in the dictionary, ignoring case and punctuation
+        """
+        return normalize(word) in self.headwords
+
+    def entries_for(self, word: str) -> List[Dict]:
+        """
+        returns the entries whose normalized headword matches the word
+        """
+        return self.headwords.get(normalize(word), [])
+
+    def frequency(self, word: str) -> int:
+        """
+        returns the stored usage frequency of a word
+        """
+        return max((entry_frequency(entry) for entry in self.entries_for(word)), default=0)
+
+    def set_frequency(self, word: str, frequency: int) -> None:
+        """
+        sets a known word's usage frequency, which ranks completions
+        """
+        entries = self.entries_for(word)
+        if not entries:
+            return
+        extra = entries[0].setdefault('metadata', {}).setdefault('extra', {})
+        extra['frequency'] = frequency
+        self.prefixes.set_frequency(normalize(word), self.frequency(word))
+
+    def record_usage(self, word: str, count: int = 1) -> None:
+        """
+        increases a known word's usage frequency
+        """
+        entries = self.entries_for(word)
+        if entries:
+            self.set_frequency(word, entry_frequency(entries[0]) + count)
+
+    def complete(self, prefix: str, limit: int = 5) -> List[str]:
+        """
+        returns up to `limit` normalized headwords starting with the prefix, most used first
+        """
+        return self.prefixes.complete(normalize(prefix), limit=limit)
 
     def define(self, word: str) -> None:
         word = remove_punctuation(word)
         
         # Add a word if it does not already exist
-        if not any(entry['headWord'] == word for entry in self.dictionary['entries']):
-            new_entry = {
-                'headWord': word, 
-                'id': str(uuid.uuid4()),
-                'hash': str(hash_check.spell_hash(word)),
-                'definition': '',
-                'translationEquivalents': [],
-                'links': [],
-                'linkedEntries': [],
-                'metadata': {'extra': {}},
-                'notes': [],
-                'extra': {}
-            }
-            
-            self.dictionary['entries'].append(new_entry)
-            self.save_dictionary()
+        if not self.has_headword(word):
+            new_entry = self.new_entry(word, hash_check.spell_hash(word))
+            self.add_entry(new_entry)
+            self.persist({'op': 'define', 'entry': new_entry})
+        else:
+            # Defining a known word again counts as using it
+            self.record_usage(word)
+            self.persist(*self.frequency_records([word]))
+
+    @staticmethod
+    def new_entry(word: str, word_hash) -> Dict:
+        return entry_template(word, word_hash, str(uuid.uuid4()))
+
+    def has_headword(self, word: str) -> bool:
+        """
+        checks for an entry whose headWord is exactly `word`
+        """
+        return any(entry['headWord'] == word for entry in self.entries_for(word))
+
+    def define_many(self, words: Iterable[str]) -> List[str]:
+        """
+        adds the words that are not in the dictionary yet and counts a use of the known ones,
+        hashing the new words in one batch and saving once. Returns the added words.
+        """
+        counts = Counter(word for word in map(remove_punctuation, words) if word)
+        added = [word for word in counts if not self.has_headword(word)]
+        hashes = hash_check.spell_hash_many(added) if added else {}
+
+        records = []
+        for word in added:
+            entry = self.new_entry(word, hashes[word])
+            self.add_entry(entry)
+            records.append({'op': 'define', 'entry': entry})
+            counts[word] -= 1  # the first occurrence defines the word
+        used = [word for word, count in counts.items() if count > 0]
+        for word in used:
+            self.record_usage(word, counts[word])
+        records.extend(self.frequency_records(used))
+        self.persist(*records)
+        return added
+
+    def use_many(self, words: Iterable[str]) -> List[str]:
+        """
+        counts a use of each known word (e.g. an accepted completion) and saves the new frequencies.
+        Returns the normalized words that were counted.
+        """
+        counts = Counter(normalize(word) for word in words if self.is_known(word))
+        for word, count in counts.items():
+            self.record_usage(word, count)
+        self.persist(*self.frequency_records(counts))
+        return list(counts)
+
+    def frequency_records(self, words: Iterable[str]) -> List[Dict]:
+        """
+        journal records of the words' new frequencies. Without a journal there are none: a use alone
+        does not rewrite the dictionary file, the frequencies are saved with the next change.
+        """
+        if self.journal is None:
+            return []
+        return [{'op': 'frequency', 'headWord': word, 'frequency': self.frequency(word)} for word in words]
+
+    def remove_many(self, words: Iterable[str]) -> List[str]:
+        """
+        removes the entries of all the words in one pass and saves once. Returns the removed words.
+        """
+        removed = {word for word in map(remove_punctuation, words) if self.has_headword(word)}
+        if not removed:
+            return []
+        for word in removed:
+            for entry in self.entries_for(word):
+                if entry['headWord'] == word:
+                    self.unindex_entry(entry)
+        self.filter_entries(lambda entry: entry['headWord'] not in removed)
+        self.persist(*({'op': 'remove', 'headWord': word} for word in sorted(removed)))
+        return sorted(removed)
+
+    def add_entry(self, entry: Dict) -> None:
+        self.dictionary['entries'].append(entry)
+        self.append_hash(entry.get('hash'))
+        self.index_entry(entry)
+
+    def remove_entries(self, word: str) -> None:
+        """
+        removes the entries whose headWord is exactly `word`
+        """
+        for entry in self.entries_for(word):
+            if entry['headWord'] == word:
+                self.unindex_entry(entry)
+        self.filter_entries(lambda entry: entry['headWord'] != word)
+
+    def filter_entries(self, keep_entry) -> None:
+        """
+        keeps the entries (and their hashes) for which keep_entry(entry) is true
+        """
+        entries = self.dictionary['entries']
+        keep = np.fromiter((keep_entry(entry) for entry in entries), dtype=bool, count=len(entries))
+        self.dictionary['entries'] = [entry for entry, kept in zip(entries, keep) if kept]
+        self._hashes = self.hashes[keep]
+        self._hash_count = len(self._hashes)
 
     def remove(self, word: str) -> None:
         word = remove_punctuation(word)
         # Remove a word
-        self.dictionary['entries'] = [entry for entry in self.dictionary['entries'] if entry['headWord'] != word]
-        self.save_dictionary()
+        self.remove_entries(word)
+        self.persist({'op': 'remove', 'headWord': word})
 
     
 
+class SUGGESTION_ENGINE(str, Enum):
+    HASH = "hash"  # visual similarity of the rendered words
+    SYMSPELL = "symspell"  # bounded edit distance through a symmetric delete index
+    COMBINED = "combined"  # edit distance candidates ranked by visual similarity, topped up by the hash search
+
+
 class SpellCheck:
-    def __init__(self, dictionary: Dictionary, relative_checking=False):
+    def __init__(self, dictionary: Dictionary, relative_checking=False, engine: str = SUGGESTION_ENGINE.HASH, max_distance: int = 2):
         self.dictionary = dictionary
         self.relative_checking = relative_checking
+        self.engine = engine
+        self.symspell = None
+        if engine != SUGGESTION_ENGINE.HASH:
+            self.symspell = SymSpellIndex(max_distance=max_distance)
+            self.dictionary.attach(self.symspell)
     
     def is_correction_needed(self, word: str) -> bool:
         if word.upper() == word:
             return False
         if re.search(r"\d+:\d+", word):
             return False
-        word = word.lower()
-        word = remove_punctuation(word)
-        return not any(
-            entry['headWord'].lower() == word for entry in self.dictionary.dictionary['entries']
-        )
+        return not self.dictionary.is_known(word)
 
     def check(self, word: str) -> List[str]:
         word = remove_punctuation(word).lower()
-        word_hash = hash_check.spell_hash(word)
 
         if not self.is_correction_needed(word):
             return [word]  # No correction needed, return the original word
 
-        entries = self.dictionary.dictionary['entries']
-        possibilities = [
-            (entry['headWord'], abs(word_hash-hash_check.imagehash.hex_to_hash(entry['hash'])))
-            for entry in entries
-        ]
+        if self.engine == SUGGESTION_ENGINE.SYMSPELL:
+            possibilities = self.symspell.lookup(word, limit=5)
+        elif self.engine == SUGGESTION_ENGINE.COMBINED:
+            possibilities = self.combined_suggestions(word, limit=5)
+        else:
+            possibilities = self.dictionary.nearest(hash_check.spell_hash(word), limit=5)
 
         # Adjust the threshold based on word length
         # possibilities = [
@@ -115,22 +556,50 @@ class SpellCheck:
         #     if edit_distance <= threshold_multiplier * len(word)
         # ]
 
-        if not possibilities:
-            return [sorted(entries, key=lambda x: x['headWord'])[0]['headWord']]  # Return the top result if no other suggestions
+        return [self.headword(word) for word, _ in possibilities]
+
+    def headword(self, word: str) -> str:
+        """
+        maps a normalized suggestion back to the headword as written in the dictionary
+        """
+        entries = self.dictionary.entries_for(word)
+        return entries[0]['headWord'] if entries else word
+
+    def combined_suggestions(self, word: str, limit: int = 5) -> List[Tuple[str, int]]:
+        """
+        edit distance candidates ranked by (edit distance, hash distance), topped up with the nearest hashes
+        """
+        word_hash = hash_check.hash_to_int(hash_check.spell_hash(word))
+        ranked = []
+        for candidate, distance in self.symspell.lookup(word, limit=len(self.symspell)):
+            hash_distance = min(bin(word_hash ^ hash_check.hash_to_int(entry.get('hash'))).count('1')
+                                for entry in self.dictionary.entries_for(candidate))
+            ranked.append((candidate, distance, hash_distance))
+        ranked.sort(key=lambda suggestion: (suggestion[1], suggestion[2]))
+        suggestions = [(candidate, distance) for candidate, distance, _ in ranked[:limit]]
 
-        sorted_possibilities = sorted(possibilities, key=lambda x: x[1])
-        suggestions = [word for word, _ in sorted_possibilities]
-        return suggestions[:5]
+        seen = {candidate for candidate, _ in suggestions}
+        for candidate, hash_distance in self.dictionary.nearest(word_hash, limit=limit):
+            if len(suggestions) >= limit:
+                break
+            if normalize(candidate) not in seen:
+                seen.add(normalize(candidate))
+                suggestions.append((candidate, hash_distance))
+        return suggestions
     
     def complete(self, word: str) -> List[str]:
+        """
+        returns the headwords that complete the word, as whole words: a headword can differ from what was
+        typed in case and punctuation ("oc" -> "o'clock"), so it replaces the typed word instead of extending it
+        """
         word = remove_punctuation(word)
-        entries = self.dictionary.dictionary['entries']
-        completions = [
-            entry['headWord'][len(word):] for entry in entries
-        ]
-
-        sorted_completions = sorted(completions, key=lambda x: edit_distance.distance(x, word)) # keeping edit distance here because it is slightly faster than creating that many images on the fly
-        return sorted_completions[:5]
+        if not word:
+            return []
+        completions = [self.headword(match) for match in self.dictionary.complete(word, limit=5)]
+        if word[0].isupper():
+            # keep the capital of a word typed at the start of a sentence
+            completions = [completion[:1].upper() + completion[1:] for completion in completions]
+        return completions
 
 
 if __name__ == "__main__":
@@ -0,0 +1,72 @@
+"""
+A stand-in for txtai's Embeddings that needs no model, for benchmarks and offline runs
+"""
+import json
+import os
+import re
+from typing import Dict, Iterable, List
+
+WORD = re.compile(r'\w+')
+
+
+class StubEmbeddings:
+    """
+    Keeps the indexed texts in memory and scores a search by the words it shares with each text.
+
+    It has the part of the txtai Embeddings interface DataBase uses (index, upsert, delete, search,
+    load and save), so the server runs end to end without downloading or loading a model. Select
+    it with the COPILOT_EMBEDDING_BACKEND=stub environment variable, see embedding_tools.create_embeddings.
+
+    Example Usage:
+        embeddings = StubEmbeddings()
+        embeddings.upsert([('GEN 1:1', 'In the beginning', None)])
+        embeddings.search('beginning', 1)
+    """
+    FILE_NAME = 'stub_embeddings.json'
+
+    def __init__(self, **config) -> None:
+        self.config = config
+        self.documents: Dict[str, str] = {}
+        self.words: Dict[str, frozenset] = {}
+
+    def index(self, documents: Iterable) -> None:
+        self.documents = {}
+        self.words = {}
+        self.upsert(documents)
+
+    def upsert(self, documents: Iterable) -> None:
+        for uid, text, *_ in documents:
+            self.documents[uid] = text
+            self.words[uid] = frozenset(WORD.findall(text.lower()))
+
+    def delete(self, ids: Iterable) -> List:
+        deleted = []
+        for uid in ids:
+            if self.documents.pop(uid, None) is not None:
+                del self.words[uid]
+                deleted.append(uid)
+        return deleted
+
+    def search(self, query: str, limit: int = 3) -> List[Dict]:
+        query_words = frozenset(WORD.findall(query.lower()))
+        if not query_words:
+            return []
+        scored = []
+        for uid, words in self.words.items():
+            shared = len(query_words & words)
+            if shared:
+                scored.append((shared / len(query_words | words), uid))
+        scored.sort(reverse=True)
+        return [{'id': uid, 'text': self.documents[uid], 'score': score} for score, uid in scored[:limit]]
+
+    def count(self) -> int:
+        return len(self.documents)
+
+    def load(self, path: str) -> None:
+        with open(os.path.join(path, self.FILE_NAME), 'r') as file:
+            self.index(json.load(file).items())
+
+    def save(self, path: str) -> None:
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, self.FILE_NAME), 'w') as file:
+            json.dump(self.documents, file)
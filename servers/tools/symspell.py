@@ -0,0 +1,112 @@
+"""
+Symmetric delete (SymSpell) suggestion index
+"""
+from typing import Dict, List, Set, Tuple, Union
+import tools.edit_distance as edit_distance
+
+
+class SymSpellIndex:
+    """
+    An index of words by their deletions, for finding every word within a bounded edit distance
+    without comparing against the whole dictionary.
+
+    Every word is stored under all the strings obtained by deleting up to `max_distance` characters
+    from its first `prefix_length` characters. A lookup generates the same deletions for the query
+    and only verifies the words that share one of them.
+
+    Words are reference counted so the same word can be added by several dictionaries.
+
+    Example Usage:
+        index = SymSpellIndex(max_distance=2)
+        index.add('beginning')
+        index.lookup('begining')  # [('beginning', 1)]
+    """
+    def __init__(self, max_distance: int = 2, prefix_length: int = 7) -> None:
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.words: Dict[str, int] = {}  # word -> reference count
+        # delete -> word, or a list of words when several share it (saves a container per delete)
+        self.deletes: Dict[str, Union[str, List[str]]] = {}
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def __contains__(self, word: str) -> bool:
+        return word in self.words
+
+    def edits(self, word: str) -> Set[str]:
+        """
+        returns the word's prefix and every string made by deleting up to max_distance characters from it
+        """
+        edits = {word[:self.prefix_length]}
+        frontier = edits
+        for _ in range(self.max_distance):
+            frontier = {edit[:i] + edit[i + 1:] for edit in frontier for i in range(len(edit))} - edits
+            edits |= frontier
+        return edits
+
+    def add(self, word: str) -> None:
+        """
+        adds a word to the index, or increases its reference count
+        """
+        if not word:
+            return
+        if word in self.words:
+            self.words[word] += 1
+            return
+        self.words[word] = 1
+        for edit in self.edits(word):
+            bucket = self.deletes.get(edit)
+            if bucket is None:
+                self.deletes[edit] = word
+            elif isinstance(bucket, str):
+                self.deletes[edit] = [bucket, word]
+            else:
+                bucket.append(word)
+
+    def remove(self, word: str) -> None:
+        """
+        decreases the word's reference count and drops it from the index when it reaches zero
+        """
+        count = self.words.get(word)
+        if count is None:
+            return
+        if count > 1:
+            self.words[word] = count - 1
+            return
+        del self.words[word]
+        for edit in self.edits(word):
+            bucket = self.deletes.get(edit)
+            if bucket == word:
+                del self.deletes[edit]
+            elif isinstance(bucket, list) and word in bucket:
+                bucket.remove(word)
+                if len(bucket) == 1:
+                    self.deletes[edit] = bucket[0]
+
+    def candidates(self, word: str) -> Set[str]:
+        """
+        returns the words sharing a deletion with the query; a superset of the words within max_distance
+        """
+        candidates = set()
+        for edit in self.edits(word):
+            bucket = self.deletes.get(edit)
+            if bucket is None:
+                continue
+            if isinstance(bucket, str):
+                candidates.add(bucket)
+            else:
+                candidates.update(bucket)
+        return candidates
+
+    def lookup(self, word: str, limit: int = 5, max_distance: int = None) -> List[Tuple[str, int]]:
+        """
+        returns up to `limit` (word, distance) pairs within max_distance of the query, closest first
+        """
+        if max_distance is None or max_distance > self.max_distance:
+            max_distance = self.max_distance
+        candidates = list(self.candidates(word))
+        distances = edit_distance.distances(word, candidates, max_distance=max_distance)
+        suggestions = [(candidate, distance) for candidate, distance in zip(candidates, distances) if distance <= max_distance]
+        suggestions.sort(key=lambda suggestion: (suggestion[1], suggestion[0]))
+        return suggestions[:limit]